@@ -0,0 +1,179 @@
+"""
+Implicit-feedback alternating least squares (Hu, Koren & Volinsky, 2008).
+
+Every (user, movie) pair gets a preference p = 1 if rated, else 0, with a
+confidence c = 1 + ALS_ALPHA · rating. Unrated movies therefore count as
+weak negatives instead of being fitted as zero ratings. User factors X and
+item factors Y are solved in turn. Each row solves the normal equations
+
+    (YᵀY + Yᵀ(Cᵤ − I)Y + λI) xᵤ = Yᵀ Cᵤ pᵤ
+
+which use the shared YᵀY plus a correction over that row's rated movies only.
+ALS_SOLVER picks how a block of rows is solved:
+    cg         a few conjugate-gradient steps warm-started from the previous
+               factors, vectorized over the whole block (default)
+    cholesky   exact per-row solves of the k × k systems (batched)
+
+Row blocks run through parallel.map_row_blocks: N_JOBS processes, or BLAS
+threads in-process when serial. Factors are saved in the SVD layout
+(U = X, Σ = 1, Vt = Yᵀ), so scoring, hybrid, ANN and the service use them
+unchanged.
+"""
+
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from instrumentation import span, count, traced
+from parallel import map_row_blocks
+from config import (
+    N_FACTORS,
+    ALS_ITERATIONS,
+    ALS_REG,
+    ALS_ALPHA,
+    ALS_SOLVER,
+    ALS_CG_STEPS,
+    USER_BLOCK_SIZE,
+)
+
+LOSS_CHUNK = 1_000_000   # rated pairs per chunk when evaluating the loss
+EXACT_CHUNK = 256        # rows per batched k × k solve
+
+
+def confidence(R, alpha=ALS_ALPHA):
+    """CSR of confidences 1 + alpha · rating on the rated entries of `R`."""
+    C = csr_matrix(R, dtype=np.float32, copy=True)
+    C.data = 1 + alpha * C.data
+    return C
+
+
+def _row_index(C):
+    return np.repeat(np.arange(C.shape[0]), np.diff(C.indptr))
+
+
+def _apply(C, Y, YtY, reg, X):
+    """A·X for every row of the block: (YᵀY + λI)x + Σᵢ (cᵢ − 1)(yᵢ·x) yᵢ."""
+    Yi = Y[C.indices]
+    weights = (C.data - 1) * np.einsum("nk,nk->n", Yi, X[_row_index(C)])
+    correction = csr_matrix((weights, C.indices, C.indptr), shape=C.shape) @ Y
+    return X @ YtY + reg * X + correction
+
+
+def solve_cg(C, Y, YtY, reg, X, steps=ALS_CG_STEPS):
+    """`steps` conjugate-gradient iterations from X for the rows of C (vectorized over rows)."""
+    X = np.array(X, dtype=np.float32)
+    b = np.asarray(C @ Y, dtype=np.float32)  # Yᵀ Cᵤ pᵤ: p is 1 exactly on the rated entries
+    r = b - _apply(C, Y, YtY, reg, X)
+    p = r.copy()
+    rs = np.einsum("ij,ij->i", r, r)
+    for _ in range(steps):
+        Ap = _apply(C, Y, YtY, reg, p)
+        denom = np.einsum("ij,ij->i", p, Ap)
+        step = np.divide(rs, denom, out=np.zeros_like(rs), where=denom > 0)
+        X += step[:, None] * p
+        r -= step[:, None] * Ap
+        rs_new = np.einsum("ij,ij->i", r, r)
+        p = r + np.divide(rs_new, rs, out=np.zeros_like(rs), where=rs > 0)[:, None] * p
+        rs = rs_new
+    return X
+
+
+def solve_exact(C, Y, YtY, reg, chunk_size=EXACT_CHUNK):
+    """Exact solution of every row's k × k system, `chunk_size` rows per batched solve."""
+    k = Y.shape[1]
+    X = np.zeros((C.shape[0], k), dtype=np.float32)
+    base = np.asarray(YtY, dtype=np.float64) + reg * np.eye(k)
+    for start in range(0, C.shape[0], chunk_size):
+        stop = min(start + chunk_size, C.shape[0])
+        A = np.broadcast_to(base, (stop - start, k, k)).copy()
+        b = np.zeros((stop - start, k))
+        for offset, row in enumerate(range(start, stop)):
+            lo, hi = C.indptr[row], C.indptr[row + 1]
+            if lo == hi:
+                continue
+            Yu = np.asarray(Y[C.indices[lo:hi]], dtype=np.float64)
+            c = np.asarray(C.data[lo:hi], dtype=np.float64)
+            A[offset] += (Yu.T * (c - 1)) @ Yu
+            b[offset] = c @ Yu
+        X[start:stop] = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+    return X
+
+
+def als_worker(arrays, start, stop, reg=ALS_REG, solver=ALS_SOLVER, cg_steps=ALS_CG_STEPS):
+    """Row-block worker: new factors for rows [start, stop) of the confidence matrix C."""
+    C = arrays["C"][start:stop]
+    count("rows", stop - start)
+    if solver == "cholesky":
+        return solve_exact(C, arrays["Y"], arrays["YtY"], reg)
+    return solve_cg(C, arrays["Y"], arrays["YtY"], reg, arrays["X"][start:stop], cg_steps)
+
+
+def solve_side(C, X, Y, reg=ALS_REG, solver=ALS_SOLVER, cg_steps=ALS_CG_STEPS,
+               block_size=USER_BLOCK_SIZE, n_jobs=None):
+    """New factors for every row of C given the fixed factors Y of the other side."""
+    if solver not in ("cg", "cholesky"):
+        raise ValueError(f"unknown ALS solver: {solver}")
+    Y = np.ascontiguousarray(Y, dtype=np.float32)
+    results = map_row_blocks(
+        als_worker,
+        {"C": C, "X": X, "Y": Y, "YtY": Y.T @ Y},
+        n_rows=C.shape[0],
+        block_size=block_size,
+        n_jobs=n_jobs,
+        reg=reg,
+        solver=solver,
+        cg_steps=cg_steps,
+    )
+    return np.vstack(results) if results else np.zeros_like(X)
+
+
+def fold_in(R, Vt, reg=ALS_REG, alpha=ALS_ALPHA):
+    """Exact ALS user factors for rating rows `R` against fixed item factors (Vt = Yᵀ)."""
+    Y = np.ascontiguousarray(np.asarray(Vt).T, dtype=np.float32)
+    return solve_exact(confidence(R, alpha), Y, Y.T @ Y, reg)
+
+
+@traced("loss")
+def implicit_loss(C, X, Y, reg=ALS_REG, chunk_size=LOSS_CHUNK):
+    """
+    Σ over all pairs c·(p − x·y)² + λ(‖X‖² + ‖Y‖²), without the dense product:
+    Σ_all (x·y)² = tr(XᵀX · YᵀY), corrected on the rated pairs.
+    """
+    rows = _row_index(C)
+    observed = 0.0
+    for start in range(0, C.nnz, chunk_size):
+        stop = min(start + chunk_size, C.nnz)
+        s = np.einsum("nk,nk->n", X[rows[start:stop]], Y[C.indices[start:stop]], dtype=np.float64)
+        observed += float(np.sum(C.data[start:stop] * (1 - s) ** 2 - s ** 2))
+    unobserved = float(np.sum((X.T.astype(np.float64) @ X) * (Y.T.astype(np.float64) @ Y)))
+    return unobserved + observed + reg * float(np.sum(X.astype(np.float64) ** 2) + np.sum(Y.astype(np.float64) ** 2))
+
+
+@traced("als")
+def train_als(R, factors=N_FACTORS, iterations=ALS_ITERATIONS, reg=ALS_REG, alpha=ALS_ALPHA,
+              solver=ALS_SOLVER, cg_steps=ALS_CG_STEPS, seed=42, n_jobs=None):
+    """
+    Implicit ALS on the user × movie CSR `R`.
+    Returns (X users × k, Y movies × k, [per-iteration {iteration, seconds, loss}]).
+    """
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 0.01, size=(R.shape[0], factors)).astype(np.float32)
+    Y = rng.normal(0, 0.01, size=(R.shape[1], factors)).astype(np.float32)
+    C_users = confidence(R, alpha)
+    C_items = C_users.T.tocsr()
+
+    history = []
+    for iteration in range(1, iterations + 1):
+        start = time.perf_counter()
+        with span("users"):
+            X = solve_side(C_users, X, Y, reg, solver, cg_steps, n_jobs=n_jobs)
+        with span("items"):
+            Y = solve_side(C_items, Y, X, reg, solver, cg_steps, n_jobs=n_jobs)
+        seconds = time.perf_counter() - start
+
+        loss = implicit_loss(C_users, X, Y, reg)
+        history.append({"iteration": iteration, "seconds": round(seconds, 3), "loss": loss})
+        print(f"   iteration {iteration:>2}/{iterations}: loss {loss:.4e} "
+              f"({loss / max(R.nnz, 1):.4f} per rating) in {seconds:.2f}s")
+    return X, Y, history
@@ -0,0 +1,401 @@
+"""
+Approximate nearest-neighbour (maximum inner product) index in pure NumPy.
+
+IVF: k-means splits the items into `n_lists` inverted lists; a query scores
+the `nprobe` lists whose centroids match it best and only their members, so
+a query touches ≈ nprobe / n_lists of the catalogue. Optional product
+quantization (PQ) stores each item as `pq_m` one-byte codes of its residual
+to the list centroid; scores are then read from per-query lookup tables.
+Sparse vectors (TF-IDF) are indexed as CSR and always scored exactly.
+
+Indexes built here (MODEL_DIR/ann/<name>/):
+    svd_items   rows of Vt.T · Σ — query with a U row for user recommendations
+    tfidf       L2-normalized TF-IDF rows — inner product == cosine
+
+Run:
+    python ann.py             # build both indexes + recall@K report
+    python ann.py --report    # recall@K report for the existing indexes
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+from artifacts import (
+    save_dense, load_dense, save_sparse, load_sparse, sparse_exists, load_ids,
+)
+from instrumentation import traced, count, stage_trace
+from neighbors import top_k_block
+from config import (
+    ANN_DIR,
+    ANN_N_LISTS,
+    ANN_NPROBE,
+    ANN_PQ_SUBVECTORS,
+    TOP_N_SIMILAR,
+    SVD_U_PATH,
+    SVD_SIGMA_PATH,
+    SVD_Vt_PATH,
+    MOVIE_IDS_PATH,
+    TFIDF_MATRIX_PATH,
+    TFIDF_MOVIE_IDS_PATH,
+)
+
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_CLUSTER = 32   # training rows per centroid
+ASSIGN_CHUNK = 8192              # rows per distance block
+PQ_CODES = 256                   # one byte per sub-vector
+PQ_RERANK_FACTOR = 4             # PQ: exact rescoring of the best k × factor candidates
+REPORT_QUERIES = 200
+REPORT_NPROBES = (1, 2, 4, 8, 16, 32, 64)
+
+
+# ──────────────────────────────────────────────────────────────
+# k-means (dense or CSR rows, dense centroids)
+# ──────────────────────────────────────────────────────────────
+
+def _row_norms_sq(X):
+    if issparse(X):
+        return np.asarray(X.multiply(X).sum(axis=1)).ravel()
+    return np.einsum("ij,ij->i", X, X)
+
+
+def assign(X, centroids, chunk_size=ASSIGN_CHUNK):
+    """Nearest centroid (L2) of every row, in row chunks."""
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(X.shape[0], dtype=np.int32)
+    for start in range(0, X.shape[0], chunk_size):
+        # argmin ‖x − c‖² == argmax x·c − ‖c‖²/2
+        scores = np.asarray(X[start:start + chunk_size] @ centroids.T) - half_norms
+        labels[start:start + chunk_size] = np.argmax(scores, axis=1)
+    return labels
+
+
+@traced("kmeans")
+def kmeans(X, n_clusters, n_iter=KMEANS_ITERATIONS, seed=0):
+    """Lloyd's k-means on a row sample of X; returns float32 centroids."""
+    rng = np.random.default_rng(seed)
+    n_rows = X.shape[0]
+    n_clusters = max(1, min(int(n_clusters), n_rows))
+
+    sample_size = min(n_rows, n_clusters * KMEANS_SAMPLE_PER_CLUSTER)
+    sample = X[np.sort(rng.choice(n_rows, sample_size, replace=False))]
+    centroids = sample[rng.choice(sample_size, n_clusters, replace=False)]
+    centroids = np.asarray(centroids.toarray() if issparse(centroids) else centroids, dtype=np.float32)
+
+    for _ in range(n_iter):
+        labels = assign(sample, centroids)
+        onehot = csr_matrix(
+            (np.ones(sample_size, dtype=np.float32), (labels, np.arange(sample_size))),
+            shape=(n_clusters, sample_size),
+        )
+        counts = np.asarray(onehot.sum(axis=1)).ravel()
+        sums = onehot @ sample
+        sums = sums.toarray() if issparse(sums) else np.asarray(sums)
+
+        filled = counts > 0
+        centroids[filled] = (sums[filled] / counts[filled, None]).astype(np.float32)
+        # Empty clusters restart from random sample rows
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            refill = sample[rng.choice(sample_size, len(empty), replace=False)]
+            centroids[empty] = refill.toarray() if issparse(refill) else refill
+    return centroids
+
+
+# ──────────────────────────────────────────────────────────────
+# IVF(-PQ) index
+# ──────────────────────────────────────────────────────────────
+
+def default_n_lists(n_items):
+    """≈ √N lists unless ANN_N_LISTS is set."""
+    if ANN_N_LISTS > 0:
+        return min(ANN_N_LISTS, n_items)
+    return max(1, min(n_items, int(np.sqrt(n_items))))
+
+
+class IVFIndex:
+    """Inverted-file index; items are stored grouped by list (offsets[l]:offsets[l + 1])."""
+
+    def __init__(self, centroids, offsets, rows, item_ids, vectors=None, codebooks=None, codes=None):
+        self.centroids = centroids
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.rows = rows            # original row of every stored item
+        self.item_ids = item_ids    # external id of every original row
+        self.vectors = vectors      # dense / CSR vectors in list order (None with PQ)
+        self.codebooks = codebooks  # (pq_m, PQ_CODES, d / pq_m)
+        self.codes = codes          # (n_items, pq_m) uint8
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @property
+    def n_items(self):
+        return len(self.rows)
+
+    # ── Build ──────────────────────────────────────────────────
+
+    @classmethod
+    @traced("build")
+    def build(cls, X, item_ids, n_lists=None, pq_m=0, seed=0):
+        """Index the rows of X (dense or CSR). `pq_m` > 0 enables product quantization (dense only)."""
+        n_lists = n_lists or default_n_lists(X.shape[0])
+        count("items", X.shape[0])
+        centroids = kmeans(X, n_lists, seed=seed)
+        labels = assign(X, centroids)
+
+        order = np.argsort(labels, kind="stable").astype(np.int32)
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=len(centroids)), out=offsets[1:])
+        ordered = X[order]
+
+        if pq_m and not issparse(X):
+            residuals = np.asarray(ordered, dtype=np.float32) - centroids[labels[order]]
+            codebooks, codes = train_pq(residuals, pq_m, seed=seed)
+            return cls(centroids, offsets, order, np.asarray(item_ids), codebooks=codebooks, codes=codes)
+
+        vectors = ordered.tocsr() if issparse(ordered) else np.ascontiguousarray(ordered, dtype=np.float32)
+        return cls(centroids, offsets, order, np.asarray(item_ids), vectors=vectors)
+
+    # ── Query ──────────────────────────────────────────────────
+
+    def _candidates(self, lists):
+        starts = self.offsets[lists]
+        lengths = self.offsets[lists + 1] - starts
+        total = int(lengths.sum())
+        # Concatenated ranges starts[i]:starts[i] + lengths[i]
+        shift = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return np.arange(total) + shift, lengths
+
+    def _score(self, query, lists, candidates, lengths):
+        if self.codes is None:
+            return np.asarray(self.vectors[candidates] @ query).ravel()
+        # ADC: q·c_list + Σ_m table[m, code_m]
+        m, _, d_sub = self.codebooks.shape
+        table = np.einsum("mkd,md->mk", self.codebooks, query.reshape(m, d_sub))
+        codes = self.codes[candidates]
+        scores = np.repeat(self.centroids[lists] @ query, lengths)
+        scores += table[np.arange(m), codes].sum(axis=1)
+        return scores
+
+    def probe(self, queries, nprobe=ANN_NPROBE):
+        """The `nprobe` lists whose centroids score highest for each query."""
+        nprobe = max(1, min(int(nprobe), self.n_lists))
+        coarse = queries @ self.centroids.T
+        return np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+    def scanned(self, probes):
+        """Mean fraction of the items scored per query for `probes`."""
+        sizes = np.diff(self.offsets)
+        return float(sizes[probes].sum(axis=1).mean()) / max(self.n_items, 1)
+
+    def search(self, queries, k=TOP_N_SIMILAR, nprobe=ANN_NPROBE, rerank=None, rerank_factor=PQ_RERANK_FACTOR):
+        """
+        Approximate top-k inner products for each query row.
+        With PQ, `rerank` (the original vectors, indexed by original row) rescores
+        the best k × `rerank_factor` quantized candidates exactly.
+        Returns (item ids, scores) of shape (n_queries, k); empty slots are -1 / -inf.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        probes = self.probe(queries, nprobe)
+        shortlist = k * rerank_factor if (rerank is not None and self.codes is not None) else k
+
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for q, (query, lists) in enumerate(zip(queries, probes)):
+            candidates, lengths = self._candidates(lists)
+            if len(candidates) == 0:
+                continue
+            cand_scores = self._score(query, lists, candidates, lengths).astype(np.float32)
+            top, top_scores = top_k_block(cand_scores[None, :], shortlist, exclude_self=False)
+            rows = self.rows[candidates[top[0]]]
+            if shortlist > k:
+                exact = np.asarray(rerank[rows] @ query, dtype=np.float32)
+                top, top_scores = top_k_block(exact[None, :], k, exclude_self=False)
+                rows = rows[top[0]]
+            n = min(k, len(rows))
+            ids[q, :n] = self.item_ids[rows[:n]]
+            scores[q, :n] = top_scores[0][:n]
+        return ids, scores
+
+    # ── Persistence ────────────────────────────────────────────
+
+    def save(self, directory):
+        tmp_dir = directory + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        meta = {"n_items": self.n_items, "n_lists": self.n_lists, "storage": "pq"}
+        save_dense(os.path.join(tmp_dir, "centroids"), self.centroids, dtype=np.float32)
+        save_dense(os.path.join(tmp_dir, "offsets"), self.offsets)
+        save_dense(os.path.join(tmp_dir, "rows"), self.rows, dtype=np.int32)
+        save_dense(os.path.join(tmp_dir, "item_ids"), self.item_ids)
+        if self.codes is not None:
+            save_dense(os.path.join(tmp_dir, "codebooks"), self.codebooks, dtype=np.float32)
+            save_dense(os.path.join(tmp_dir, "codes"), self.codes, dtype=np.uint8)
+        elif issparse(self.vectors):
+            save_sparse(os.path.join(tmp_dir, "vectors"), self.vectors)
+            meta["storage"] = "csr"
+        else:
+            save_dense(os.path.join(tmp_dir, "vectors"), self.vectors, dtype=np.float32)
+            meta["storage"] = "dense"
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_dir, directory)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Memory-map an index written by save()."""
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        def part(name):
+            return load_dense(os.path.join(directory, name), mmap=mmap)
+
+        kwargs = {}
+        if meta["storage"] == "pq":
+            kwargs.update(codebooks=np.asarray(part("codebooks")), codes=part("codes"))
+        elif meta["storage"] == "csr":
+            kwargs["vectors"] = load_sparse(os.path.join(directory, "vectors"), mmap=mmap)
+        else:
+            kwargs["vectors"] = part("vectors")
+        return cls(np.asarray(part("centroids")), part("offsets"), part("rows"), part("item_ids"), **kwargs)
+
+
+@traced("train_pq")
+def train_pq(X, pq_m, seed=0):
+    """Product quantizer: split the columns into `pq_m` groups, k-means each. Returns (codebooks, codes)."""
+    d = X.shape[1]
+    if d % pq_m:
+        raise ValueError(f"vector dimension {d} is not divisible by pq_m={pq_m}")
+    d_sub = d // pq_m
+    n_codes = min(PQ_CODES, X.shape[0])
+
+    codebooks = np.zeros((pq_m, PQ_CODES, d_sub), dtype=np.float32)
+    codes = np.empty((X.shape[0], pq_m), dtype=np.uint8)
+    for m in range(pq_m):
+        sub = np.ascontiguousarray(X[:, m * d_sub:(m + 1) * d_sub])
+        codebooks[m, :n_codes] = kmeans(sub, n_codes, seed=seed + m)
+        codes[:, m] = assign(sub, codebooks[m, :n_codes])
+    return codebooks, codes
+
+
+# ──────────────────────────────────────────────────────────────
+# Build + recall report
+# ──────────────────────────────────────────────────────────────
+
+def index_dir(name):
+    return os.path.join(ANN_DIR, name)
+
+
+def exact_search(X, queries, k):
+    """Exact top-k inner products (item rows, scores) by brute force."""
+    scores = np.asarray(queries @ X.T)
+    scores = scores.toarray() if issparse(scores) else scores
+    return top_k_block(scores.astype(np.float32), k, exclude_self=False)
+
+
+@traced("recall_report")
+def recall_report(index, X, queries, k=TOP_N_SIMILAR, nprobes=REPORT_NPROBES, rerank=None):
+    """recall@k and mean query time of `index` vs exact search, for each nprobe."""
+    exact_rows, _ = exact_search(X, queries, k)
+    exact_ids = np.asarray(index.item_ids)[exact_rows]
+
+    report = []
+    for nprobe in nprobes:
+        if nprobe > index.n_lists:
+            break
+        start = time.perf_counter()
+        approx_ids, _ = index.search(queries, k, nprobe, rerank=rerank)
+        elapsed = time.perf_counter() - start
+        hits = [len(set(a[a >= 0].tolist()) & set(e.tolist())) for a, e in zip(approx_ids, exact_ids)]
+        report.append({
+            "nprobe": nprobe,
+            "recall_at_k": round(float(np.mean(hits)) / k, 4),
+            "query_ms": round(1000 * elapsed / len(queries), 3),
+            "scanned_fraction": round(index.scanned(index.probe(queries, nprobe)), 4),
+        })
+    return report
+
+
+@traced("load.sources")
+def load_sources():
+    """{name: (matrix, item ids, report queries)} for every index whose model artifacts exist."""
+    sources = {}
+    rng = np.random.default_rng(0)
+    try:
+        U = load_dense(SVD_U_PATH)
+        Sigma = load_dense(SVD_SIGMA_PATH)
+        Vt = load_dense(SVD_Vt_PATH)
+        items = np.ascontiguousarray(np.asarray(Vt).T * Sigma, dtype=np.float32)
+        users = rng.choice(U.shape[0], min(REPORT_QUERIES, U.shape[0]), replace=False)
+        sources["svd_items"] = (items, np.asarray(load_ids(MOVIE_IDS_PATH)), np.asarray(U[np.sort(users)]))
+    except FileNotFoundError:
+        print("⚠️  SVD model not found — skipping svd_items index")
+
+    if sparse_exists(TFIDF_MATRIX_PATH) and os.path.exists(TFIDF_MOVIE_IDS_PATH):
+        from sklearn.preprocessing import normalize
+
+        matrix = normalize(load_sparse(TFIDF_MATRIX_PATH, mmap=False)).astype(np.float32)
+        rows = rng.choice(matrix.shape[0], min(REPORT_QUERIES, matrix.shape[0]), replace=False)
+        sources["tfidf"] = (matrix, load_dense(TFIDF_MOVIE_IDS_PATH, mmap=False), matrix[np.sort(rows)].toarray())
+    else:
+        print("⚠️  TF-IDF matrix not found — skipping tfidf index")
+    return sources
+
+
+def print_report(name, report):
+    print(f"→ {name}: recall@{TOP_N_SIMILAR} vs exact search")
+    for row in report:
+        print(f"   nprobe {row['nprobe']:>3}: recall {row['recall_at_k']:.3f}, "
+              f"{row['query_ms']:.2f} ms/query, scans {row['scanned_fraction'] * 100:.1f}%")
+
+
+def run(build=True):
+    """Build the ANN indexes from the trained artifacts and write the recall report."""
+    print("ANN index build started..." if build else "ANN recall report...")
+    results = {}
+    for name, (matrix, item_ids, queries) in load_sources().items():
+        if build:
+            start = time.time()
+            pq_m = ANN_PQ_SUBVECTORS if name == "svd_items" else 0
+            index = IVFIndex.build(matrix, item_ids, pq_m=pq_m)
+            index.save(index_dir(name))
+            print(f"→ {name}: {index.n_items:,} items in {index.n_lists:,} lists "
+                  f"({'PQ ' + str(pq_m) + ' bytes/item' if pq_m else 'exact vectors'}) "
+                  f"in {time.time() - start:.1f}s")
+        elif not os.path.exists(os.path.join(index_dir(name), "meta.json")):
+            continue
+
+        index = IVFIndex.load(index_dir(name))
+        report = recall_report(index, matrix, queries, rerank=matrix if index.codes is not None else None)
+        print_report(name, report)
+        results[name] = {"n_items": index.n_items, "n_lists": index.n_lists, "k": TOP_N_SIMILAR,
+                         "default_nprobe": ANN_NPROBE, "recall": report}
+
+    if not results:
+        print("❌ No trained models found. Run collaborative_svd.py / tfidf_model.py first.")
+        return
+    os.makedirs(ANN_DIR, exist_ok=True)
+    with open(os.path.join(ANN_DIR, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ ANN indexes ready → {ANN_DIR}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build IVF(-PQ) ANN indexes and report recall@K.")
+    parser.add_argument("--report", action="store_true", help="only report recall for the existing indexes")
+    args = parser.parse_args()
+    with stage_trace("ann"):
+        run(build=not args.report)
+
+
+if __name__ == "__main__":
+    main()
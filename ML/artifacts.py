@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# ──────────────────────────────────────────────────────────────
+# Artifact store for MODEL_DIR
+# Everything is written uncompressed as raw .npy so loads can use
+# mmap_mode='r': startup is near-instant and every process that maps the
+# same file shares one page-cache copy.
+#   dense  → <path>.npy
+#   sparse → <prefix>.data.npy / .indices.npy / .indptr.npy / .shape.npy
+#   ids    → sorted int array; position in the array == matrix index
+# Files are written to a temporary name and renamed, so readers never see
+# a half-written artifact.
+# ──────────────────────────────────────────────────────────────
+
+SPARSE_PARTS = ("data", "indices", "indptr", "shape")
+
+
+def _npy(path):
+    return path if path.endswith(".npy") else path + ".npy"
+
+
+def _atomic_save(path, array):
+    path = _npy(path)
+    tmp_path = path[:-4] + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def save_dense(path, array, dtype=None):
+    """Write a dense array as a raw .npy file."""
+    array = np.asarray(array, dtype=dtype)
+    _atomic_save(path, np.ascontiguousarray(array))
+
+
+def load_dense(path, mmap=True):
+    """Load a dense .npy artifact, memory-mapped read-only by default."""
+    return np.load(_npy(path), mmap_mode="r" if mmap else None)
+
+
+def sparse_paths(prefix):
+    return {part: f"{prefix}.{part}.npy" for part in SPARSE_PARTS}
+
+
+def save_sparse(prefix, matrix):
+    """Write a sparse matrix as separate CSR data/indices/indptr arrays."""
+    matrix = csr_matrix(matrix)
+    paths = sparse_paths(prefix)
+    _atomic_save(paths["data"], matrix.data)
+    _atomic_save(paths["indices"], matrix.indices)
+    _atomic_save(paths["indptr"], matrix.indptr)
+    _atomic_save(paths["shape"], np.asarray(matrix.shape, dtype=np.int64))
+
+
+def load_sparse(prefix, mmap=True):
+    """Rebuild a CSR matrix whose arrays are memory-mapped from disk."""
+    paths = sparse_paths(prefix)
+    mode = "r" if mmap else None
+    data = np.load(paths["data"], mmap_mode=mode)
+    indices = np.load(paths["indices"], mmap_mode=mode)
+    indptr = np.load(paths["indptr"], mmap_mode=mode)
+    shape = tuple(int(x) for x in np.load(paths["shape"]))
+    return csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+def sparse_exists(prefix):
+    return all(os.path.exists(p) for p in sparse_paths(prefix).values())
+
+
+def save_ids(path, ids):
+    """Write an id map as a sorted int array (index i ↔ ids[i])."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if ids.size and np.any(ids[1:] < ids[:-1]):
+        raise ValueError(f"id array for {path} must be sorted")
+    if ids.size and (ids.min() < np.iinfo(np.int32).min or ids.max() > np.iinfo(np.int32).max):
+        raise ValueError(f"ids in {path} do not fit in int32")
+    _atomic_save(path, ids.astype(np.int32))
+
+
+def load_ids(path, mmap=True):
+    """Load a sorted id array written by save_ids."""
+    return load_dense(path, mmap=mmap)
+
+
+def ids_to_index(sorted_ids, values):
+    """Matrix indices of `values` in `sorted_ids` (-1 where absent) via binary search."""
+    values = np.asarray(values, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.full(values.shape, -1, dtype=np.int64)
+    pos = np.searchsorted(sorted_ids, values)
+    pos_clipped = np.minimum(pos, len(sorted_ids) - 1)
+    found = (pos < len(sorted_ids)) & (np.asarray(sorted_ids)[pos_clipped] == values)
+    return np.where(found, pos_clipped, -1)
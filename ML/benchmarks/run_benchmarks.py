@@ -0,0 +1,237 @@
+"""
+Benchmark the training stages on a seeded synthetic dataset.
+
+Each stage runs in its own process through the train_models scheduler
+(one at a time, forced), so wall time and peak RSS are per stage. Results
+are written as JSON and can be gated against an earlier run:
+
+    python benchmarks/run_benchmarks.py --scale small
+    python benchmarks/run_benchmarks.py --scale medium --stages content,tfidf
+    python benchmarks/run_benchmarks.py --scale small --baseline benchmarks/results/base.json
+
+A stage regresses when its wall time or peak RSS exceeds the baseline by
+more than --max-regression (default 25%); the exit code is then 1.
+The import time of the entry points (IMPORT_MODULES) is measured with
+`python -X importtime` in fresh interpreters and reported alongside.
+The dataset is regenerated only when scale, counts or seed change.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import synthetic  # redirects ML_CACHE_DIR / ML_MODEL_DIR / ML_OUTPUT_DIR first
+
+import numpy as np  # noqa: E402
+
+from config import N_JOBS, COLLAB_ENGINE, MOVIES_COLLECTION, RATINGS_COLLECTION  # noqa: E402
+from snapshot import read_meta, read_snapshot  # noqa: E402
+from reports import compare, git_revision, save_json  # noqa: E402
+import train_models  # noqa: E402
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DATASET_FILE = os.path.join(synthetic.BENCH_DIR, "dataset.json")
+DEFAULT_STAGES = ("content", "tfidf", "collab", "hybrid")
+MAX_REGRESSION = 0.25
+GATED_METRICS = ("wall_time", "peak_rss_mb")
+# Entry points timed with `python -X importtime`, and the heavy packages reported for each
+IMPORT_MODULES = ("cli", "config", "train_models", "recommender_service", "content_based", "tfidf_model",
+                  "collaborative_svd", "hybrid", "ann", "quantize")
+HEAVY_PACKAGES = ("numpy", "scipy.sparse", "pandas", "sklearn", "pymongo", "pyarrow")
+IMPORT_RUNS = 3
+
+
+# ──────────────────────────────────────────────────────────────
+# Dataset
+# ──────────────────────────────────────────────────────────────
+
+def prepare_dataset(n_movies, n_ratings, n_users, seed):
+    """Reuse the work-dir snapshot when it was generated with the same parameters."""
+    params = {"movies": n_movies, "ratings": n_ratings, "users": n_users, "seed": seed}
+    metas = [read_meta(name) for name in (MOVIES_COLLECTION, RATINGS_COLLECTION)]
+    if os.path.exists(DATASET_FILE) and all(meta and meta["key"] == {"synthetic": params} for meta in metas):
+        with open(DATASET_FILE, "r", encoding="utf-8") as f:
+            dataset = json.load(f)
+        if dataset.get("params") == params:
+            print(f"→ Reusing synthetic dataset in {synthetic.BENCH_DIR}")
+            return dataset
+
+    # Generated in a child process: stage processes are forked from this one,
+    # and the generator's arrays must not count towards their RSS
+    with multiprocessing.Pool(1) as pool:
+        dataset = pool.apply(synthetic.write_dataset, (n_movies, n_ratings, n_users, seed))
+    dataset["params"] = params
+    save_json(DATASET_FILE, dataset)
+    return dataset
+
+
+def work_units(stage_names):
+    """Pairs / users each stage processes, from the snapshot and the stages' own filters."""
+    from content_based import MIN_VOTE_COUNT
+    from collaborative_svd import select_active_users
+
+    units = {}
+    movies = read_snapshot(MOVIES_COLLECTION, ["vote_count", "overview"])
+    if "content" in stage_names:
+        n = int((np.asarray(movies["vote_count"]) > MIN_VOTE_COUNT).sum())
+        units["content"] = ("pairs", n * n)
+    if "tfidf" in stage_names:
+        n = int(sum(len(str(text or "").strip()) > 20 for text in movies["overview"]))
+        units["tfidf"] = ("pairs", n * n)
+    if {"collab", "hybrid"} & set(stage_names):
+        ratings = read_snapshot(RATINGS_COLLECTION, ["userId"])
+        if COLLAB_ENGINE == "als":  # trains on every user
+            n_users = len(np.unique(np.asarray(ratings["userId"])))
+        else:
+            n_users = len(select_active_users(ratings["userId"]))
+        for name in ("collab", "hybrid"):
+            units[name] = ("users", n_users)
+    return units
+
+
+# ──────────────────────────────────────────────────────────────
+# Run
+# ──────────────────────────────────────────────────────────────
+
+def run_stages(stage_names):
+    """Run the named stages one at a time; {name: result} with throughput added."""
+    stages = [stage for stage in train_models.STAGES if stage.name in stage_names]
+    results = train_models.run_pipeline(stages, jobs=1, force=True)
+    units = work_units(stage_names)  # after the runs, for the same RSS reason as above
+
+    for name, result in results.items():
+        unit = units.get(name)
+        if unit and result.get("status") == "ran" and result.get("wall_time"):
+            kind, amount = unit
+            result[kind] = amount
+            result[f"{kind}_per_s"] = round(amount / result["wall_time"], 1)
+    return results
+
+
+def import_times(modules=IMPORT_MODULES, runs=IMPORT_RUNS):
+    """
+    Import time of each module in a fresh interpreter (`python -X importtime`,
+    best of `runs`): its cumulative ms and the ms of the heavy packages it pulls in.
+    """
+    results = {}
+    for module in modules:
+        best = None
+        for _ in range(runs):
+            process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                     capture_output=True, text=True, cwd=ML_DIR)
+            if process.returncode != 0:
+                best = {"error": process.stderr.strip().splitlines()[-1]}
+                break
+            times = {}
+            for line in process.stderr.splitlines():
+                if not line.startswith("import time:"):
+                    continue
+                _, cumulative, name = line.split("|")
+                if cumulative.strip().isdigit():  # not the header
+                    times[name.strip()] = int(cumulative) / 1000
+            if best is None or times[module] < best[module]:
+                best = times
+
+        if "error" in best:
+            results[module] = best
+            continue
+        results[module] = {
+            "import_ms": round(best[module], 1),
+            "packages": {package: round(best[package], 1) for package in HEAVY_PACKAGES if package in best},
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ML training stages on synthetic data.")
+    parser.add_argument("--scale", choices=sorted(synthetic.SCALES), default="small")
+    parser.add_argument("--movies", type=int, help="override the scale's movie count")
+    parser.add_argument("--ratings", type=int, help="override the scale's rating count")
+    parser.add_argument("--users", type=int, help=f"default: ratings / {synthetic.RATINGS_PER_USER}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                        help="comma-separated stage names (see train_models.STAGES)")
+    parser.add_argument("--output", help="results JSON (default: benchmarks/results/<scale>-<time>.json)")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to gate against")
+    parser.add_argument("--max-regression", type=float, default=MAX_REGRESSION,
+                        help="allowed relative increase of wall time / peak RSS")
+    parser.add_argument("--skip-imports", action="store_true", help="do not time module imports")
+    args = parser.parse_args()
+
+    stage_names = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = set(stage_names) - {stage.name for stage in train_models.STAGES}
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    n_movies, n_ratings = synthetic.resolve_scale(args.scale, args.movies, args.ratings)
+    dataset = prepare_dataset(n_movies, n_ratings, args.users, args.seed)
+
+    started = time.time()
+    stages = run_stages(stage_names)
+    results = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+        "scale": args.scale,
+        "dataset": dataset,
+        "environment": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "n_jobs": N_JOBS,
+            "collab_engine": COLLAB_ENGINE,
+        },
+        "stages": stages,
+        "imports": {} if args.skip_imports else import_times(),
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{args.scale}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    save_json(output, results)
+
+    print("\n" + "═" * 70)
+    print(" BENCHMARK RESULTS ".center(70))
+    print("═" * 70)
+    for name, result in stages.items():
+        line = f"{name:<8} {result['status']:<8}"
+        if result.get("wall_time") is not None:
+            line += f" {result['wall_time']:>9.2f}s"
+        if result.get("peak_rss_mb") is not None:
+            line += f"  peak RSS {result['peak_rss_mb']:>9,.0f} MB"
+        for kind in ("pairs", "users"):
+            if f"{kind}_per_s" in result:
+                line += f"  {result[f'{kind}_per_s']:>14,.0f} {kind}/s"
+        print(line)
+    if results["imports"]:
+        print(f"\nImport time (python -X importtime, best of {IMPORT_RUNS}):")
+        for module, result in results["imports"].items():
+            if "error" in result:
+                print(f"   ❌ {module:<20} {result['error']}")
+                continue
+            packages = ", ".join(f"{package} {ms:,.0f}" for package, ms in result["packages"].items())
+            print(f"   {module:<20} {result['import_ms']:>8,.0f} ms" + (f"   ({packages})" if packages else ""))
+    print(f"\nResults: {output}")
+
+    failed = [name for name, result in stages.items() if result["status"] != "ran"]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.baseline} (max regression {args.max_regression:.0%}):")
+        regressions = compare(results["stages"], baseline.get("stages", {}), GATED_METRICS, args.max_regression)
+
+    if failed or regressions:
+        for name in failed:
+            print(f"❌ {name} did not complete")
+        for message in regressions:
+            print(f"❌ Regression: {message}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Seeded synthetic movies / ratings, written straight to the snapshot cache.
+
+The columns match what the loaders export from MongoDB, so every training
+stage reads them exactly like a real snapshot:
+    movies   movieId, title, genres, overview, vote_average, vote_count, popularity
+    ratings  userId, movieId, rating, timestamp
+
+Distributions are rough stand-ins for TMDB / MovieLens: 0–4 genres per
+movie, Zipf-distributed overview words with a genre-specific share,
+log-normal vote counts, and popularity-skewed ratings from users whose
+activity is log-normal. Same seed + scale → identical snapshots.
+
+Everything is written below ML_BENCH_DIR (default benchmarks/work/): cache,
+models and outputs are redirected there before config is imported, so a
+benchmark never touches the real snapshot or the backend data.
+
+Run (from ML/):
+    python benchmarks/synthetic.py --scale small
+    python benchmarks/synthetic.py --movies 50000 --ratings 5000000 --seed 7
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.getenv("ML_BENCH_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "work"))
+for _var, _sub in (("ML_CACHE_DIR", "cache"), ("ML_MODEL_DIR", "models"), ("ML_OUTPUT_DIR", "output")):
+    os.environ.setdefault(_var, os.path.join(BENCH_DIR, _sub))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import MOVIES_COLLECTION, RATINGS_COLLECTION  # noqa: E402
+from snapshot import write_snapshot, snapshot_dir  # noqa: E402
+
+# movies, ratings (users default to ratings / RATINGS_PER_USER)
+SCALES = {
+    "tiny": (2_000, 100_000),
+    "small": (10_000, 1_000_000),
+    "medium": (100_000, 10_000_000),
+    "large": (1_000_000, 100_000_000),
+}
+
+GENRES = [
+    "Drama", "Comedy", "Thriller", "Action", "Romance", "Horror", "Crime", "Documentary",
+    "Adventure", "ScienceFiction", "Family", "Mystery", "Fantasy", "Animation", "Music",
+    "Foreign", "History", "War", "Western", "TVMovie",
+]
+GENRE_COUNT_P = [0.05, 0.35, 0.35, 0.17, 0.08]  # P(0..4 genres)
+VOCABULARY_SIZE = 20_000
+GENRE_WORD_SHARE = 0.3       # overview words drawn from the first genre's own vocabulary
+OVERVIEW_WORDS = (15, 80)
+RATINGS_PER_USER = 100
+RATING_CHUNK = 5_000_000     # ratings drawn per chunk (bounds generator memory)
+TIMESTAMP_RANGE = (946_684_800, 1_704_067_200)  # 2000-01-01 … 2024-01-01
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "an", "el", "is", "or", "ux", "ba", "de"]
+
+
+def vocabulary(size=VOCABULARY_SIZE):
+    """Deterministic pseudo-words: base-16 digits spelled as syllables."""
+    words = []
+    for i in range(size):
+        word, n = "", i + len(SYLLABLES)
+        while n:
+            word = SYLLABLES[n % len(SYLLABLES)] + word
+            n //= len(SYLLABLES)
+        words.append(word)
+    return np.array(words, dtype=object)
+
+
+def zipf_probabilities(n, exponent=1.1):
+    p = 1.0 / np.arange(1, n + 1) ** exponent
+    return p / p.sum()
+
+
+# ──────────────────────────────────────────────────────────────
+# Movies
+# ──────────────────────────────────────────────────────────────
+
+def generate_movies(n_movies, seed=0):
+    """{column: array} for `n_movies` movies (movieId 1..n)."""
+    rng = np.random.default_rng(seed)
+    n_genres = len(GENRES)
+
+    # Weighted sampling without replacement: smallest exponential / weight keys
+    genre_weights = zipf_probabilities(n_genres, exponent=0.8)
+    keys = rng.exponential(size=(n_movies, n_genres)) / genre_weights
+    ranked = np.argsort(keys, axis=1)
+    counts = rng.choice(len(GENRE_COUNT_P), size=n_movies, p=GENRE_COUNT_P)
+    genre_names = np.array(GENRES, dtype=object)
+    genres = [" ".join(genre_names[row[:count]]) for row, count in zip(ranked, counts)]
+
+    # Overviews: global Zipf words + a slice of the vocabulary owned by the first genre
+    words = vocabulary()
+    lengths = rng.integers(*OVERVIEW_WORDS, size=n_movies)
+    word_p = zipf_probabilities(VOCABULARY_SIZE)
+    drawn = rng.choice(VOCABULARY_SIZE, size=int(lengths.sum()), p=word_p)
+    own = rng.random(len(drawn)) < GENRE_WORD_SHARE
+    first_genre = np.where(counts > 0, ranked[:, 0], n_genres)
+    slice_size = VOCABULARY_SIZE // (n_genres + 1)
+    offsets = np.repeat(first_genre * slice_size, lengths)
+    drawn[own] = offsets[own] + drawn[own] % slice_size
+    overviews = [" ".join(chunk) for chunk in np.split(words[drawn], np.cumsum(lengths)[:-1])]
+
+    vote_count = np.round(rng.lognormal(mean=5.0, sigma=1.5, size=n_movies)).astype(np.int64)
+    vote_average = np.round(np.clip(rng.normal(6.2, 1.0, size=n_movies), 0, 10), 1)
+    popularity = np.round(vote_count / 40 * rng.lognormal(0, 0.5, size=n_movies), 3)
+
+    movie_ids = np.arange(1, n_movies + 1, dtype=np.int64)
+    return {
+        "movieId": movie_ids,
+        "title": [f"Movie {i}" for i in movie_ids],
+        "genres": genres,
+        "overview": overviews,
+        "vote_average": vote_average,
+        "vote_count": vote_count,
+        "popularity": popularity,
+    }
+
+
+# ──────────────────────────────────────────────────────────────
+# Ratings
+# ──────────────────────────────────────────────────────────────
+
+def generate_ratings(n_ratings, movies, n_users=None, seed=0):
+    """
+    {userId, movieId, rating, timestamp} with at most one rating per (user, movie).
+    Duplicate draws are dropped, so slightly fewer than `n_ratings` rows remain.
+    """
+    rng = np.random.default_rng(seed + 1)
+    n_movies = len(movies["movieId"])
+    n_users = n_users or max(1, n_ratings // RATINGS_PER_USER)
+
+    user_p = rng.lognormal(0, 1.0, size=n_users)
+    user_p /= user_p.sum()
+    movie_p = np.asarray(movies["vote_count"], dtype=np.float64) + 1
+    movie_p /= movie_p.sum()
+    quality = np.asarray(movies["vote_average"], dtype=np.float32) / 2
+
+    keys = []
+    for start in range(0, n_ratings, RATING_CHUNK):
+        size = min(RATING_CHUNK, n_ratings - start)
+        users = rng.choice(n_users, size=size, p=user_p).astype(np.int64)
+        items = rng.choice(n_movies, size=size, p=movie_p).astype(np.int64)
+        keys.append(np.unique(users * n_movies + items))
+    keys = np.unique(np.concatenate(keys)) if keys else np.empty(0, dtype=np.int64)
+
+    users, items = keys // n_movies, keys % n_movies
+    del keys
+    noise = rng.normal(0, 0.9, size=len(users)).astype(np.float32)
+    rating = np.clip(np.round((quality[items] + noise) * 2) / 2, 0.5, 5.0).astype(np.float32)
+    timestamp = rng.integers(*TIMESTAMP_RANGE, size=len(users), dtype=np.int64)
+
+    # Shuffle out of (user, movie) order, like an unsorted collection export
+    order = rng.permutation(len(users))
+    return {
+        "userId": (users[order] + 1).astype(np.int32),
+        "movieId": np.asarray(movies["movieId"])[items[order]].astype(np.int32),
+        "rating": rating[order],
+        "timestamp": timestamp[order],
+    }
+
+
+def write_dataset(n_movies, n_ratings, n_users=None, seed=0):
+    """Generate and write both snapshots; returns a description of the dataset."""
+    start = time.time()
+    params = {"movies": int(n_movies), "ratings": int(n_ratings), "users": n_users, "seed": int(seed)}
+
+    movies = generate_movies(n_movies, seed)
+    write_snapshot(MOVIES_COLLECTION, movies, {"synthetic": params})
+    ratings = generate_ratings(n_ratings, movies, n_users, seed)
+    del movies
+    write_snapshot(RATINGS_COLLECTION, ratings, {"synthetic": params})
+
+    dataset = {
+        **params,
+        "users": int(len(np.unique(ratings["userId"]))),
+        "ratings_written": int(len(ratings["userId"])),
+        "generate_seconds": round(time.time() - start, 3),
+    }
+    print(f"→ Synthetic dataset: {n_movies:,} movies, {dataset['ratings_written']:,} ratings, "
+          f"{dataset['users']:,} users in {dataset['generate_seconds']:.1f}s → {snapshot_dir('')}")
+    return dataset
+
+
+def resolve_scale(scale=None, movies=None, ratings=None):
+    """(movies, ratings) from a named scale, overridden by explicit counts."""
+    base_movies, base_ratings = SCALES[scale or "small"]
+    return movies or base_movies, ratings or base_ratings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic movies / ratings snapshot.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--movies", type=int, help="override the scale's movie count")
+    parser.add_argument("--ratings", type=int, help="override the scale's rating count")
+    parser.add_argument("--users", type=int, help=f"default: ratings / {RATINGS_PER_USER}")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    n_movies, n_ratings = resolve_scale(args.scale, args.movies, args.ratings)
+    write_dataset(n_movies, n_ratings, args.users, args.seed)
+
+
+if __name__ == "__main__":
+    main()
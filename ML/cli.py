@@ -0,0 +1,66 @@
+"""
+Single entry point for the ML scripts (run from ML/):
+
+    python -m cli train [--force] [--refresh] [--jobs N]   the training pipeline
+    python -m cli content | tfidf | collab | hybrid        one stage, in this process
+    python -m cli ann | quantize [--report]
+    python -m cli serve --http [--port 8765]               recommender_service.py
+    python -m cli snapshot [--refresh]
+    python -m cli evaluate [...] | benchmark [...]
+    python -m cli verify
+
+Every argument after the command goes to the script, which runs exactly as
+`python <script> ...` would. Nothing is imported until the command is
+known, so `--help` and light commands (serve, snapshot) start without
+pandas, scikit-learn or a MongoDB connection.
+"""
+
+import argparse
+import os
+import runpy
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# command → (module or script below ML/, description); stage commands match train_models.STAGES
+COMMANDS = {
+    "train": ("train_models", "run the training pipeline (stages in dependency order)"),
+    "content": ("content_based", "content-based stage (Jaccard + cosine)"),
+    "tfidf": ("tfidf_model", "TF-IDF stage"),
+    "collab": ("collaborative_svd", "collaborative stage (SVD / ALS); --shard N regenerates a user shard"),
+    "hybrid": ("hybrid", "hybrid blending stage"),
+    "ann": ("ann", "build the ANN indexes and report recall"),
+    "quantize": ("quantize", "quantize the SVD factors and report overlap"),
+    "serve": ("recommender_service", "serve recommendations over HTTP or stdio"),
+    "snapshot": ("snapshot", "export movies / ratings to the snapshot cache"),
+    "evaluate": ("evaluation/run_evaluation.py", "offline evaluation on a held-out split"),
+    "benchmark": ("benchmarks/run_benchmarks.py", "benchmark the stages on synthetic data"),
+    "verify": ("verify_mongodb", "check the MongoDB collections"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m cli",
+        description="Run an ML pipeline stage or tool.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n" + "\n".join(f"  {name:<10} {help}" for name, (_, help) in COMMANDS.items())
+               + "\n\n`python -m cli <command> --help` shows the command's own options.",
+    )
+    parser.add_argument("command", choices=COMMANDS, metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments passed to the command")
+    args = parser.parse_args(argv)
+
+    target, _ = COMMANDS[args.command]
+    if target.endswith(".py"):
+        path = os.path.join(BASE_DIR, target)
+        sys.argv = [path, *args.args]
+        sys.path.insert(0, os.path.dirname(path))  # the script's own imports (synthetic, metrics)
+        runpy.run_path(path, run_name="__main__")
+    else:
+        sys.argv = [target, *args.args]  # run_module replaces argv[0] with the module's path
+        runpy.run_module(target, run_name="__main__", alter_sys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,107 +1,249 @@
+import argparse
 import json
+import os
 import warnings
-import joblib
 import numpy as np
-import pandas as pd
 from scipy.sparse import csr_matrix
-from sklearn.utils.extmath import randomized_svd
 
+import shards
+from artifacts import save_dense, save_sparse, save_ids, ids_to_index
+from instrumentation import span, count, traced, stage_trace
+from snapshot import get_ratings, get_user_counts
+from neighbor_table import write_outputs, write_neighbor_table, indices_to_ids
+from neighbors import top_k_block, mask_rated
+from parallel import map_row_blocks, resolve_n_jobs
+from als import train_als, fold_in as als_fold_in
 from config import (
     OUT_USER_RECS,
+    OUT_USER_RECS_BIN,
+    OUTPUT_FORMAT,
     MAX_USERS_TO_SAVE,
     N_FACTORS,
     TOP_N_USER,
     SVD_U_PATH,
     SVD_SIGMA_PATH,
     SVD_Vt_PATH,
-    USER_TO_IDX_PATH,
-    MOVIE_TO_IDX_PATH,
-    is_mongodb_available,
-    get_ratings_collection,
+    USER_IDS_PATH,
+    MOVIE_IDS_PATH,
+    SVD_RATINGS_PATH,
+    USER_BLOCK_SIZE,
+    USER_SHARDS,
+    ITEM_SHARDS,
+    SHARD_MANIFEST_PATH,
+    OUT_USER_SHARDS_INDEX,
+    SVD_META_PATH,
+    COLLAB_ENGINE,
+    ALS_REG,
+    ALS_ALPHA,
+    ALS_SOLVER,
+    ALS_CG_STEPS,
+    ALS_ITERATIONS,
 )
 
+MIN_USER_RATINGS = 20  # Users need at least this many ratings
+SHARD_READ_CHUNK = 5_000_000  # ratings hashed per chunk when selecting a shard's users
 
-def run():
+
+def select_active_users(user_col, min_ratings=MIN_USER_RATINGS, limit=MAX_USERS_TO_SAVE, user_counts=None):
     """
-    Trains a collaborative filtering model using Randomized SVD.
-    Uses Pearson correlation / Euclidean distance for similarity.
-    Filters to users with 20+ ratings to remove sparse users.
-    Saves model components for fast on-demand recommendations.
-    Generates top-N recommendations only for the most active users.
+    The `limit` users with the most ratings among those with at least `min_ratings`.
+    `user_counts` — (ids, counts) already in that order, see snapshot.get_user_counts —
+    skips grouping `user_col`.
     """
-    print("Collaborative filtering (SVD) training started...")
-    print("→ Using Pearson correlation / Euclidean distance")
-    print("→ Filtering to users with 20+ ratings")
-
-    if not is_mongodb_available():
-        print("❌ MongoDB not available. Cannot continue.")
-        return
-
-    ratings_col = get_ratings_collection()
-
-    # ── 1. Filter users with 20+ ratings ──────────────────────────
-    print("Finding users with 20+ ratings...")
-    pipeline = [
-        {"$group": {"_id": "$userId", "count": {"$sum": 1}}},
-        {"$match": {"count": {"$gte": 20}}},  # At least 20 ratings
-        {"$sort": {"count": -1}},
-        {"$limit": MAX_USERS_TO_SAVE}
-    ]
+    if user_counts is not None:
+        users, counts = user_counts
+        return np.asarray(users)[np.asarray(counts) >= min_ratings][:limit]
+    users, counts = np.unique(np.asarray(user_col), return_counts=True)
+    eligible = counts >= min_ratings
+    users, counts = users[eligible], counts[eligible]
+    order = np.argsort(-counts, kind="stable")[:limit]
+    return users[order]
+
+
+@traced("rating_matrix")
+def build_rating_matrix(user_col, movie_col, rating_col):
+    """
+    CSR user × movie matrix from rating columns.
+    Returns (R, user_ids, movie_ids); both id arrays are sorted and index == matrix position.
+    """
+    user_ids, row = np.unique(np.asarray(user_col, dtype=np.int64), return_inverse=True)
+    movie_ids, col = np.unique(np.asarray(movie_col, dtype=np.int64), return_inverse=True)
 
-    active_users = [doc["_id"] for doc in ratings_col.aggregate(pipeline)]
-    if not active_users:
-        print("❌ No users found with 20+ ratings.")
-        return
+    R = csr_matrix(
+        (np.asarray(rating_col, dtype=np.float32), (row, col)),
+        shape=(len(user_ids), len(movie_ids)),
+        dtype=np.float32
+    )
+    count("users", R.shape[0])
+    count("nnz", R.nnz)
+    return R, user_ids, movie_ids
 
-    print(f"→ Selected {len(active_users):,} users with 20+ ratings")
 
-    # ── 2. Load ratings only for selected users ───────────────────
-    print("Loading ratings for selected users...")
-    cursor = ratings_col.find(
-        {"userId": {"$in": active_users}},
-        {"_id": 0, "userId": 1, "movieId": 1, "rating": 1}
+def recommend_worker(arrays, start, stop, top_n=TOP_N_USER):
+    """
+    Row-block worker: top-N matrix indices for users [start, stop).
+    One GEMM scores the whole block; rated items are masked from R's CSR arrays.
+    """
+    US, Vt, R = arrays["US"], arrays["Vt"], arrays["R"]
+
+    # Reconstruct predicted ratings for the whole block
+    with span("scoring"):
+        scores = np.asarray(US[start:stop] @ Vt, dtype=np.float32)
+        mask_rated(scores, R.indptr, R.indices, start, stop)
+        count("users", stop - start)
+
+    # Top-N without ordering the whole row
+    return top_k_block(scores, top_n, exclude_self=False)
+
+
+@traced("recommend")
+def recommend_all_users(U, Sigma, Vt, R, top_n=TOP_N_USER, block_size=USER_BLOCK_SIZE, n_jobs=None):
+    """Top-N (matrix indices, scores) for every user in R, in blocks of `block_size` users."""
+    US = (U * Sigma).astype(np.float32)
+    results = map_row_blocks(
+        recommend_worker,
+        {"US": US, "Vt": np.asarray(Vt, dtype=np.float32), "R": R},
+        n_rows=R.shape[0],
+        block_size=block_size,
+        n_jobs=n_jobs,
+        top_n=min(top_n, R.shape[1]),
     )
-
-    df = pd.DataFrame(list(cursor))
-    if df.empty:
-        print("❌ No ratings loaded.")
+    indices = np.vstack([idx for idx, _ in results])
+    scores = np.vstack([sc for _, sc in results])
+    return indices, scores
+
+
+# ──────────────────────────────────────────────────────────────
+# Sharded recommendations (see shards.py)
+# ──────────────────────────────────────────────────────────────
+
+@traced("load.shard_ratings")
+def shard_ratings(shard, n_shards):
+    """Rating columns of the users in `shard` with at least MIN_USER_RATINGS ratings."""
+    ratings = get_ratings()
+    if ratings is None:
+        return None
+    user_col = ratings["userId"]
+    rows = np.concatenate([
+        start + np.flatnonzero(shards.user_shard(user_col[start:start + SHARD_READ_CHUNK], n_shards) == shard)
+        for start in range(0, len(user_col), SHARD_READ_CHUNK)
+    ] or [np.empty(0, dtype=np.int64)])
+    selected = {column: np.asarray(values)[rows] for column, values in ratings.items()}
+
+    active = select_active_users(selected["userId"], limit=None)
+    keep = np.isin(selected["userId"], active)
+    count("rows", int(keep.sum()))
+    return {column: values[keep] for column, values in selected.items()}
+
+
+def recommend_shard_worker(arrays, start, stop, top_n=TOP_N_USER, columns=()):
+    """
+    Row-block worker over item shards: each item shard's Vt (arrays "Vt0",
+    "Vt1", …, covering `columns` ranges) is scored and reduced to its top-N
+    in turn, and the per-shard lists are merged. Returns global column indices.
+    """
+    US, R = arrays["US"], arrays["R"]
+    block = US[start:stop]
+    rows = np.repeat(np.arange(stop - start), np.diff(R.indptr[start:stop + 1]))
+    cols = R.indices[R.indptr[start]:R.indptr[stop]]
+    count("users", stop - start)
+
+    indices, scores = [], []
+    for shard, (first, last) in enumerate(columns):
+        with span("scoring"):
+            block_scores = np.asarray(block @ arrays[f"Vt{shard}"], dtype=np.float32)
+            inside = (cols >= first) & (cols < last)
+            block_scores[rows[inside], cols[inside] - first] = -np.inf
+        idx, sc = top_k_block(block_scores, min(top_n, last - first), exclude_self=False)
+        indices.append(idx + first)
+        scores.append(sc)
+
+    if len(columns) == 1:
+        return indices[0], scores[0]
+    indices, scores = np.hstack(indices), np.hstack(scores)
+    order, top_scores = top_k_block(scores, top_n, exclude_self=False)
+    return np.take_along_axis(indices, order, axis=1), top_scores
+
+
+@traced("user_shard")
+def generate_user_shard(shard, manifest=None):
+    """
+    Fold the users of one shard into the model, store their factors and write
+    their top-N list. Needs only the manifest and item shards, so shards
+    can be generated in separate processes or on separate machines.
+    """
+    manifest = manifest or shards.read_manifest()
+    if manifest is None:
+        print("❌ No shard manifest found. Run collaborative_svd.py with ML_USER_SHARDS > 0 first.")
+        return
+    n_shards = manifest["user_shards"]
+    if not 0 <= shard < n_shards:
+        print(f"❌ User shard {shard} does not exist (the model has {n_shards} user shards).")
         return
+    Sigma, Vts, movie_ids, columns = shards.load_item_shards(manifest)
+    movie_ids = np.concatenate([np.asarray(ids) for ids in movie_ids])
 
-    print(f"→ Loaded {len(df):,} ratings")
+    ratings = shard_ratings(shard, n_shards)
+    if ratings is None:
+        print("❌ MongoDB not available and no ratings snapshot found. Cannot continue.")
+        return
 
-    # ── 3. Prepare data ───────────────────────────────────────────
-    df["userId"] = df["userId"].astype(int)
-    df["movieId"] = df["movieId"].astype(int)
-    df["rating"] = df["rating"].astype(np.float32)
+    # Rating matrix over the model's movie columns (movies unknown to the SVD are ignored)
+    cols = ids_to_index(movie_ids, ratings["movieId"])
+    known = cols >= 0
+    user_ids, rows = np.unique(np.asarray(ratings["userId"], dtype=np.int64)[known], return_inverse=True)
+    R = csr_matrix(
+        (np.asarray(ratings["rating"], dtype=np.float32)[known], (rows, cols[known])),
+        shape=(len(user_ids), len(movie_ids)),
+        dtype=np.float32,
+    )
 
-    # Create consecutive indices for matrix
-    user_ids = sorted(df["userId"].unique())
-    movie_ids = sorted(df["movieId"].unique())
+    # Fold-in: projection r · V one item shard at a time (SVD), or the exact ALS user solve
+    model = manifest.get("model") or {"engine": "svd"}
+    with span("fold_in"):
+        if model["engine"] == "als":
+            US = als_fold_in(R, np.hstack([np.asarray(Vt) for Vt in Vts]), model["reg"], model["alpha"])
+        else:
+            US = np.zeros((R.shape[0], len(Sigma)), dtype=np.float32)
+            for Vt, (first, last) in zip(Vts, columns):
+                US += np.asarray(R[:, first:last] @ np.asarray(Vt).T, dtype=np.float32)
+    Sigma_safe = np.where(Sigma == 0, 1.0, Sigma)
+    shards.write_user_shard(shard, US / Sigma_safe, user_ids, R)
+
+    results = map_row_blocks(
+        recommend_shard_worker,
+        {"US": US, "R": R, **{f"Vt{i}": Vt for i, Vt in enumerate(Vts)}},
+        n_rows=R.shape[0],
+        block_size=USER_BLOCK_SIZE,
+        top_n=min(TOP_N_USER, len(movie_ids)),
+        columns=columns,
+    )
+    top_indices = np.vstack([idx for idx, _ in results]) if results else np.empty((0, 0), dtype=np.int32)
+    top_scores = np.vstack([sc for _, sc in results]) if results else np.empty((0, 0), dtype=np.float32)
+    write_neighbor_table(shards.recommendations_path(shard), user_ids,
+                         indices_to_ids(movie_ids, top_indices), top_scores)
+    print(f"→ User shard {shard + 1}/{n_shards}: {len(user_ids):,} users → {shards.recommendations_path(shard)}")
 
-    user_to_idx = {uid: i for i, uid in enumerate(user_ids)}
-    movie_to_idx = {mid: i for i, mid in enumerate(movie_ids)}
-    idx_to_movie = {i: mid for mid, i in movie_to_idx.items()}
 
-    # Build sparse rating matrix
-    row = df["userId"].map(user_to_idx).values
-    col = df["movieId"].map(movie_to_idx).values
-    data = df["rating"].values
+def write_shards(Sigma, Vt, movie_ids, n_user_shards=USER_SHARDS, n_item_shards=ITEM_SHARDS, model=None):
+    """Split the trained model into item shards and generate every user shard in turn."""
+    print(f"Sharding: {n_user_shards} user shards (hash of userId) × {n_item_shards} item shards (movieId range)...")
+    manifest = shards.write_item_shards(Sigma, Vt, movie_ids, n_user_shards, n_item_shards, model)
+    for shard in range(n_user_shards):
+        generate_user_shard(shard, manifest)
+    shards.write_recommendations_index(manifest)
+    print(f"→ Shard manifest: {SHARD_MANIFEST_PATH}")
 
-    R = csr_matrix(
-        (data, (row, col)),
-        shape=(len(user_ids), len(movie_ids)),
-        dtype=np.float32
-    )
 
-    print(f"→ Rating matrix shape: {R.shape}")
-    print(f"→ Density: {R.nnz / np.prod(R.shape):.4%}")
+def train_svd(R):
+    """Randomized SVD of R: (U, Σ, Vt, model metadata)."""
+    from sklearn.utils.extmath import randomized_svd
 
-    # ── 4. Train Randomized SVD ──────────────────────────────────
     n_components = min(N_FACTORS, R.shape[0] - 1, R.shape[1] - 1)
     n_components = max(30, n_components)  # avoid too small latent space
 
     print(f"Training Randomized SVD (factors = {n_components})...")
-    with warnings.catch_warnings():
+    with warnings.catch_warnings(), span("svd"):
         warnings.simplefilter("ignore", category=FutureWarning)
         U, Sigma, Vt = randomized_svd(
             R,
@@ -110,82 +252,169 @@ def run():
             random_state=42,
             power_iteration_normalizer="QR"  # more stable
         )
+    return U, Sigma, Vt, {"engine": "svd", "factors": int(n_components)}
 
-    # ── 5. Save model components ─────────────────────────────────
-    print("Saving SVD model components...")
-    joblib.dump(U, SVD_U_PATH, compress=3)
-    joblib.dump(Sigma, SVD_SIGMA_PATH, compress=3)
-    joblib.dump(Vt, SVD_Vt_PATH, compress=3)
-    joblib.dump(user_to_idx, USER_TO_IDX_PATH, compress=3)
-    joblib.dump(movie_to_idx, MOVIE_TO_IDX_PATH, compress=3)
 
-    print("→ Model artifacts saved successfully")
+def train_implicit_als(R):
+    """Implicit ALS of R in the SVD layout: (U = X, Σ = 1, Vt = Yᵀ, model metadata)."""
+    print(f"Training implicit ALS (factors = {N_FACTORS}, {ALS_ITERATIONS} iterations, "
+          f"solver = {ALS_SOLVER}, workers: {resolve_n_jobs()})...")
+    X, Y, history = train_als(R)
+    meta = {"engine": "als", "factors": N_FACTORS, "reg": ALS_REG, "alpha": ALS_ALPHA,
+            "solver": ALS_SOLVER, "cg_steps": ALS_CG_STEPS, "history": history}
+    return X, np.ones(X.shape[1], dtype=np.float32), Y.T, meta
 
-    # ── 6. Generate recommendations for active users ─────────────
-    print(f"Generating top-{TOP_N_USER} recommendations for {len(user_ids):,} users...")
-    user_recs = {}
 
-    for orig_uid in user_ids:
-        uid = user_to_idx[orig_uid]
+def run():
+    """
+    Trains a collaborative filtering model with the configured COLLAB_ENGINE:
+    Randomized SVD on the most active users (20+ ratings, MAX_USERS_TO_SAVE),
+    or implicit-feedback ALS on every user (see als.py).
+    Saves model components for fast on-demand recommendations.
+    Generates top-N recommendations for every user in the model.
+    """
+    use_als = COLLAB_ENGINE == "als"
+    if use_als:
+        print("Collaborative filtering (implicit ALS) training started...")
+        print("→ Ratings as confidence-weighted implicit feedback, every user")
+    else:
+        print("Collaborative filtering (SVD) training started...")
+        print("→ Using Pearson correlation / Euclidean distance")
+        print("→ Filtering to users with 20+ ratings")
+
+    print("Loading ratings from snapshot...")
+    ratings = get_ratings()
+    if ratings is None:
+        print("❌ MongoDB not available and no ratings snapshot found. Cannot continue.")
+        return
+
+    # ── 1. Filter users with 20+ ratings (SVD) ────────────────────
+    user_counts = get_user_counts()
+    if use_als:
+        active_users = select_active_users(ratings["userId"], min_ratings=1, limit=None, user_counts=user_counts)
+    else:
+        print("Finding users with 20+ ratings...")
+        active_users = select_active_users(ratings["userId"], user_counts=user_counts)
+    if len(active_users) == 0:
+        print("❌ No users found with enough ratings.")
+        return
+
+    print(f"→ Selected {len(active_users):,} users" + ("" if use_als else " with 20+ ratings"))
+
+    # ── 2. Keep ratings only for selected users ───────────────────
+    keep = np.isin(ratings["userId"], active_users)
+    ratings = {column: np.asarray(values)[keep] for column, values in ratings.items()}
+    if len(ratings["userId"]) == 0:
+        print("❌ No ratings loaded.")
+        return
+
+    print(f"→ Loaded {len(ratings['userId']):,} ratings")
+
+    # ── 3. Build sparse rating matrix ─────────────────────────────
+    R, user_ids, movie_ids = build_rating_matrix(
+        ratings["userId"], ratings["movieId"], ratings["rating"]
+    )
 
-        # Reconstruct predicted ratings for this user
-        user_vector = U[uid] * Sigma
-        scores = user_vector @ Vt
+    print(f"→ Rating matrix shape: {R.shape}")
+    print(f"→ Density: {R.nnz / np.prod(R.shape):.4%}")
 
-        # Mask already rated items
-        rated_mask = R[uid].toarray().flatten() > 0
-        scores[rated_mask] = -np.inf
+    # ── 4. Train the configured engine ───────────────────────────
+    U, Sigma, Vt, model = train_implicit_als(R) if use_als else train_svd(R)
 
-        # Get top N
-        top_indices = np.argsort(scores)[::-1][:TOP_N_USER]
-        top_movies = [int(idx_to_movie[i]) for i in top_indices]
+    # ── 5. Save model components ─────────────────────────────────
+    print("Saving SVD model components...")
+    with span("save_model"):
+        save_dense(SVD_U_PATH, U, dtype=np.float32)
+        save_dense(SVD_SIGMA_PATH, Sigma, dtype=np.float32)
+        save_dense(SVD_Vt_PATH, Vt, dtype=np.float32)
+        save_ids(USER_IDS_PATH, user_ids)
+        save_ids(MOVIE_IDS_PATH, movie_ids)
+        save_sparse(SVD_RATINGS_PATH, R)
+        with open(SVD_META_PATH, "w", encoding="utf-8") as f:
+            json.dump(model, f, indent=2)
 
-        user_recs[str(orig_uid)] = {
-            "collaborative": top_movies
+    print("→ Model artifacts saved successfully")
+
+    # ── 6. Generate recommendations for active users ─────────────
+    print(f"Generating top-{TOP_N_USER} recommendations for {len(user_ids):,} users...")
+    print(f"→ Block size: {USER_BLOCK_SIZE:,} users, workers: {resolve_n_jobs()}")
+    top_indices, top_scores = recommend_all_users(U, Sigma, Vt, R)
+    top_movies = indices_to_ids(movie_ids, top_indices)
+
+    def user_recs():
+        # Keep lists other stages (hybrid) stored for users still in the model
+        previous = {}
+        if os.path.exists(OUT_USER_RECS):
+            with open(OUT_USER_RECS, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+        return {
+            str(orig_uid): {**previous.get(str(orig_uid), {}), "collaborative": top_movies[uid].astype(int).tolist()}
+            for uid, orig_uid in enumerate(user_ids)
         }
 
     # ── 7. Save collaborative recommendations ─────────────────────
     try:
-        with open(OUT_USER_RECS, "w", encoding="utf-8") as f:
-            json.dump(user_recs, f, indent=None)
-        print(f"→ Saved collaborative recommendations for {len(user_recs):,} users")
+        write_outputs(
+            OUT_USER_RECS, OUT_USER_RECS_BIN.format(kind="collaborative"), user_recs,
+            keys=user_ids, neighbors=top_movies, scores=top_scores, indent=None,
+        )
+        print(f"→ Saved collaborative recommendations for {len(user_ids):,} users ({OUTPUT_FORMAT})")
         print(f"   → {OUT_USER_RECS}")
     except Exception as e:
-        print(f"Error saving user_recommendations.json: {e}")
+        print(f"Error saving user recommendations: {e}")
+
+    # ── 8. Sharded recommendations for every active user ─────────
+    if USER_SHARDS > 0:
+        write_shards(Sigma, Vt, movie_ids, model=model)
+    elif os.path.exists(OUT_USER_SHARDS_INDEX):
+        os.remove(OUT_USER_SHARDS_INDEX)  # shard tables of an earlier model: stop serving them
 
     print("\n" + "="*60)
     print("COLLABORATIVE FILTERING MODEL READY")
-    print("→ SVD model saved → ready for on-demand use")
+    print(f"→ {model['engine'].upper()} model saved → ready for on-demand use")
     print("→ Next step: run hybrid.py")
     print("="*60)
 
 
 # ── Helper function for later use (API / on-demand) ──────────────────────────────
-def get_collaborative_recommendations(user_id: int, top_n: int = TOP_N_USER) -> list[int]:
+_service = None
+
+
+def get_recommender_service():
+    """Process-wide RecommenderService — artifacts are loaded on first use only."""
+    global _service
+    if _service is None:
+        from recommender_service import RecommenderService
+        _service = RecommenderService.load()
+    return _service
+
+
+def get_collaborative_recommendations(user_id: int, top_n: int = TOP_N_USER, ratings: dict = None) -> list[int]:
     """
     Get top-N recommendations for a user using the trained SVD model.
-    Fast inference — only one user row.
+    Fast inference — the model stays loaded between calls and rated items are excluded.
+    Users outside the model are folded in from `ratings` ({movieId: rating}) when given.
     """
-    try:
-        U = joblib.load(SVD_U_PATH)
-        Sigma = joblib.load(SVD_SIGMA_PATH)
-        Vt = joblib.load(SVD_Vt_PATH)
-        user_to_idx = joblib.load(USER_TO_IDX_PATH)
-        movie_to_idx = joblib.load(MOVIE_TO_IDX_PATH)
-    except FileNotFoundError:
-        raise RuntimeError("SVD model not found. Run collaborative_svd.py first.")
-
-    if user_id not in user_to_idx:
-        return []  # or raise error — your choice
+    service = get_recommender_service()
+    movies = service.recommend(user_id, top_n)
+    if not movies and ratings:
+        movies = service.recommend_for_ratings([ratings], top_n, user_ids=[user_id])[0]
+    return movies
 
-    uid = user_to_idx[user_id]
-    scores = (U[uid] * Sigma) @ Vt
 
-    top_indices = np.argsort(scores)[::-1][:top_n]
-    recommended_movie_ids = [movie_to_idx[i] for i in top_indices]
+def main():
+    parser = argparse.ArgumentParser(description="Train the SVD model and generate collaborative recommendations.")
+    parser.add_argument("--shard", type=int, metavar="N",
+                        help="only (re)generate user shard N of the existing sharded model")
+    args = parser.parse_args()
 
-    return recommended_movie_ids
+    if args.shard is None:
+        with stage_trace("collab"):
+            run()
+    else:
+        with stage_trace(f"collab.shard-{args.shard:03d}"):
+            generate_user_shard(args.shard)
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -1,13 +1,18 @@
 import os
-from pymongo import MongoClient
+import threading
 
 # ──────────────────────────────────────────────────────────────
 # Directories and file paths
 # ──────────────────────────────────────────────────────────────
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-BACKEND_DIR = os.path.join(BASE_DIR, '..', 'backend', 'data')
-CACHE_DIR = os.path.join(BASE_DIR, 'cache')
-MODEL_DIR = os.path.join(BASE_DIR, 'models')
+# Overridable so benchmarks and experiments can run against a separate tree
+BACKEND_DIR = os.getenv("ML_OUTPUT_DIR", os.path.join(BASE_DIR, '..', 'backend', 'data'))
+CACHE_DIR = os.getenv("ML_CACHE_DIR", os.path.join(BASE_DIR, 'cache'))
+MODEL_DIR = os.getenv("ML_MODEL_DIR", os.path.join(BASE_DIR, 'models'))
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, 'snapshots')  # columnar copies of movies / ratings
+PIPELINE_DIR = os.path.join(CACHE_DIR, 'pipeline')   # train_models.py state + run reports
+INCREMENTAL_DIR = os.path.join(MODEL_DIR, 'incremental')  # per-stage catalogue state (incremental.py)
+TRACE_DIR = os.path.join(CACHE_DIR, 'traces')         # per-stage span traces (instrumentation.py)
 
 os.makedirs(BACKEND_DIR, exist_ok=True)
 os.makedirs(CACHE_DIR, exist_ok=True)
@@ -16,17 +21,70 @@ os.makedirs(MODEL_DIR, exist_ok=True)
 # Output files
 OUT_MOVIES_JSON       = os.path.join(BACKEND_DIR, 'movies.json')
 OUT_CONTENT_BASED     = os.path.join(BACKEND_DIR, 'content_based.json')
+OUT_TFIDF_JSON        = os.path.join(BACKEND_DIR, 'tfidf_recommendations.json')
+OUT_HYBRID_JSON       = os.path.join(BACKEND_DIR, 'hybrid_recommendations.json')
 OUT_USER_RECS         = os.path.join(BACKEND_DIR, 'user_recommendations.json')
+OUT_MOVIE_INDEX       = os.path.join(BACKEND_DIR, 'movies.index.bin')  # serving index (movie_index.py)
+
+# Binary neighbour tables (see neighbor_table.py)
+OUT_CONTENT_BASED_BIN = os.path.join(BACKEND_DIR, 'content_based.bin')
+OUT_TFIDF_BIN         = os.path.join(BACKEND_DIR, 'tfidf_recommendations.bin')
+OUT_HYBRID_BIN        = os.path.join(BACKEND_DIR, 'hybrid_recommendations.bin')
+OUT_USER_RECS_BIN     = os.path.join(BACKEND_DIR, 'user_recommendations.{kind}.bin')
+OUT_USER_SHARDS_INDEX = os.path.join(BACKEND_DIR, 'user_recommendations.shards.json')  # sharding mode
+
+# "binary" (neighbour tables), or "json" / "both" for readers of the old JSON files
+OUTPUT_FORMAT         = os.getenv("ML_OUTPUT_FORMAT", "binary")
 
 # Model artifacts (for on-demand inference)
+# Raw .npy files, memory-mapped on load (see artifacts.py)
 TFIDF_VECTORIZER_PATH = os.path.join(MODEL_DIR, 'tfidf_vectorizer.joblib')
-TFIDF_MATRIX_PATH     = os.path.join(MODEL_DIR, 'tfidf_matrix.joblib')
+TFIDF_MATRIX_PATH     = os.path.join(MODEL_DIR, 'tfidf_matrix')  # CSR: .data/.indices/.indptr/.shape.npy
+TFIDF_MOVIE_IDS_PATH  = os.path.join(MODEL_DIR, 'tfidf_movie_ids.npy')  # movieId of each matrix row
+
+SVD_U_PATH            = os.path.join(MODEL_DIR, 'svd_U.npy')
+SVD_SIGMA_PATH        = os.path.join(MODEL_DIR, 'svd_Sigma.npy')
+SVD_Vt_PATH           = os.path.join(MODEL_DIR, 'svd_Vt.npy')
+USER_IDS_PATH         = os.path.join(MODEL_DIR, 'svd_user_ids.npy')   # sorted; index == row of U
+MOVIE_IDS_PATH        = os.path.join(MODEL_DIR, 'svd_movie_ids.npy')  # sorted; index == column of Vt
+SVD_RATINGS_PATH      = os.path.join(MODEL_DIR, 'svd_R')  # CSR of rated items, for masking
+SVD_META_PATH         = os.path.join(MODEL_DIR, 'svd_meta.json')  # engine, hyper-parameters, ALS loss history
+
+# Item-neighbour tables with scores (neighbor_table.py format), read by hybrid.py
+CONTENT_NEIGHBORS_PATH = os.path.join(MODEL_DIR, 'content_neighbors.bin')
+TFIDF_NEIGHBORS_PATH   = os.path.join(MODEL_DIR, 'tfidf_neighbors.bin')
+
+# Fitted numeric scaler of content_based.py (reused by incremental runs)
+CONTENT_SCALER_PATH    = os.path.join(MODEL_DIR, 'content_scaler.joblib')
+
+# Local recommender service (recommender_service.py)
+RECOMMENDER_HOST      = os.getenv("RECOMMENDER_HOST", "127.0.0.1")
+RECOMMENDER_PORT      = int(os.getenv("RECOMMENDER_PORT", "8765"))
 
-SVD_U_PATH            = os.path.join(MODEL_DIR, 'svd_U.joblib')
-SVD_SIGMA_PATH        = os.path.join(MODEL_DIR, 'svd_Sigma.joblib')
-SVD_Vt_PATH           = os.path.join(MODEL_DIR, 'svd_Vt.joblib')
-USER_TO_IDX_PATH      = os.path.join(MODEL_DIR, 'user_to_idx.joblib')
-MOVIE_TO_IDX_PATH     = os.path.join(MODEL_DIR, 'movie_to_idx.joblib')
+# Approximate nearest-neighbour indexes (ann.py), stored under MODEL_DIR/ann
+ANN_DIR               = os.path.join(MODEL_DIR, 'ann')
+ANN_N_LISTS           = 0      # IVF lists; 0 = √N
+ANN_NPROBE            = 8      # lists scanned per query: higher = better recall, slower
+ANN_PQ_SUBVECTORS     = 0      # product-quantize SVD item factors into this many bytes (0 = off;
+                               # must divide N_FACTORS)
+ANN_SERVING           = os.getenv("ML_ANN_SERVING", "0") == "1"  # recommender_service queries the index
+
+# Sharded collaborative model (shards.py): manifest + per-shard artifacts
+SHARD_MANIFEST_PATH   = os.path.join(MODEL_DIR, 'shard_manifest.json')
+SHARD_DIR             = os.path.join(MODEL_DIR, 'shards')
+
+# Quantized SVD factors (quantize.py), stored under MODEL_DIR/quantized
+QUANT_DIR             = os.path.join(MODEL_DIR, 'quantized')
+FACTOR_QUANTIZATION   = os.getenv("ML_FACTOR_QUANTIZATION", "int8")  # "int8" (per-row scale) or "float16"
+QUANT_RERANK_FACTOR   = 4      # quantized scan keeps top-N × factor movies, re-ranked in float32
+QUANT_SERVING         = os.getenv("ML_QUANT_SERVING", "0") == "1"  # recommender_service scans quantized factors
+
+# Fold-in of users outside the trained model (recommender_service.py)
+# "projection": r · V (consistent with the zero-filled SVD), "ridge": regularized least squares
+FOLD_IN_METHOD        = os.getenv("FOLD_IN_METHOD", "projection")
+FOLD_IN_REG           = 0.1
+# Seconds between merges of folded-in users into the stored factors (0 = only on request)
+FOLD_IN_MERGE_INTERVAL = int(os.getenv("FOLD_IN_MERGE_INTERVAL", "0"))
 
 # ──────────────────────────────────────────────────────────────
 # MongoDB configuration
@@ -36,54 +94,132 @@ DB_NAME = "movie_recommendation"
 MOVIES_COLLECTION = "movies"
 RATINGS_COLLECTION = "rating"
 
-client = None
-db = None
+MONGO_TIMEOUT_MS = 5000  # server selection timeout of the first connection check
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", "10"))  # connections per process
+
+# The client is created on first use, not at import: scripts that only read the
+# snapshot or the models never wait for MongoDB (or import pymongo). MongoClient
+# is a connection pool shared by every caller in the process. It is not
+# fork-safe: close it before starting worker processes (train_models.py does).
+_client = None
+_db = None
+_connect_failed = False  # not retried until close_mongodb_connection()
+_client_lock = threading.Lock()
+
+
+def get_mongo_client():
+    """The process-wide MongoClient, connected and checked on first call; None if MongoDB is unreachable."""
+    global _client, _db, _connect_failed
+    with _client_lock:
+        if _client is None and not _connect_failed:
+            from pymongo import MongoClient
+
+            client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS, maxPoolSize=MONGO_POOL_SIZE)
+            try:
+                client.server_info()  # Force connection test
+            except Exception as e:
+                print("❌ MongoDB connection failed:", e)
+                client.close()
+                _connect_failed = True
+            else:
+                _client, _db = client, client[DB_NAME]
+                print("✓ MongoDB connected")
+        return _client
+
+
+def get_db():
+    """The recommendation database, or None if MongoDB is unreachable."""
+    get_mongo_client()
+    return _db
 
-try:
-    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-    client.server_info()  # Force connection test
-    db = client[DB_NAME]
-    print("✓ MongoDB connected")
-except Exception as e:
-    print("❌ MongoDB connection failed:", e)
-    client = None
-    db = None
 
 def is_mongodb_available():
-    """Check if MongoDB connection is active."""
-    return db is not None
+    """Check if MongoDB is reachable (connects on the first call)."""
+    return get_db() is not None
 
 def get_movies_collection():
     """Get movies collection if connected."""
-    return db[MOVIES_COLLECTION] if is_mongodb_available() else None
+    db = get_db()
+    return db[MOVIES_COLLECTION] if db is not None else None
 
 def get_ratings_collection():
     """Get ratings collection if connected."""
-    return db[RATINGS_COLLECTION] if is_mongodb_available() else None
+    db = get_db()
+    return db[RATINGS_COLLECTION] if db is not None else None
 
 def close_mongodb_connection():
-    """Safely close MongoDB client."""
-    global client
-    if client:
-        try:
-            client.close()
-            print("MongoDB connection closed")
-        except Exception as e:
-            print("Warning: Error closing MongoDB connection:", e)
-        finally:
-            client = None
-            db = None  # optional - clear reference
+    """Safely close the MongoDB client; the next accessor call connects again."""
+    global _client, _db, _connect_failed
+    with _client_lock:
+        if _client is not None:
+            try:
+                _client.close()
+                print("MongoDB connection closed")
+            except Exception as e:
+                print("Warning: Error closing MongoDB connection:", e)
+        _client = None
+        _db = None
+        _connect_failed = False
 
 # ──────────────────────────────────────────────────────────────
 # ML / Recommendation parameters
 # ──────────────────────────────────────────────────────────────
-CONTENT_WEIGHT         = 0.6
+# Hybrid blending weights (score-level, see hybrid.py)
+CONTENT_WEIGHT         = 0.4
 COLLAB_WEIGHT          = 0.4
+TFIDF_WEIGHT           = 0.2
 N_FACTORS              = 50
+
+# Collaborative engine: "svd" (randomized SVD of the rating matrix, top MAX_USERS_TO_SAVE users)
+# or "als" (implicit-feedback ALS over every user, see als.py); same artifact layout
+COLLAB_ENGINE          = os.getenv("ML_COLLAB_ENGINE", "svd")
+ALS_ITERATIONS         = 15
+ALS_REG                = 0.1
+ALS_ALPHA              = 10.0   # confidence = 1 + alpha · rating
+ALS_SOLVER             = "cg"   # "cg" (warm-started conjugate gradient) or "cholesky" (exact)
+ALS_CG_STEPS           = 3
 TOP_N_SIMILAR          = 20
 TOP_N_USER             = 20
 MAX_USERS_TO_SAVE      = 20000
 
+# Similarity engine (rows processed per block → peak memory ≈ block × N floats)
+SIMILARITY_BLOCK_SIZE  = 2048
+
+# TF-IDF similarity: "sparse" keeps sparse × sparseᵀ products, "dense" streams dense blocks
+TFIDF_SIMILARITY_MODE  = "sparse"
+TFIDF_MIN_SIMILARITY   = 0.0   # sparse mode only: drop pairs scoring <= this
+
+# Parallel execution: worker processes for similarity/scoring row blocks
+# (1 = serial, <= 0 = all cores)
+N_JOBS                 = int(os.getenv("ML_N_JOBS", "1"))
+USER_BLOCK_SIZE        = 1024  # users scored per block in collaborative_svd
+
+# Sharding (shards.py): users by hash of userId, items by movieId range.
+# 0 user shards = monolithic model only; otherwise every user with 20+ ratings
+# is folded into a user shard and gets recommendations, beyond MAX_USERS_TO_SAVE
+USER_SHARDS            = int(os.getenv("ML_USER_SHARDS", "0"))
+ITEM_SHARDS            = int(os.getenv("ML_ITEM_SHARDS", "1"))
+
+# Training pipeline: stages run concurrently (separate processes) when independent
+PIPELINE_JOBS          = int(os.getenv("ML_PIPELINE_JOBS", "2"))
+
+# Incremental retraining: only new / changed movies are rescored (content, TF-IDF)
+INCREMENTAL_TRAINING   = os.getenv("ML_INCREMENTAL", "0") == "1"
+
+# Instrumentation (instrumentation.py): ML_TRACE=1 writes a span trace per stage,
+# ML_PROFILE=cprofile also profiles each stage
+TRACE_ENABLED          = os.getenv("ML_TRACE", "0") == "1"
+PROFILE_MODE           = os.getenv("ML_PROFILE", "").lower()
+
+# MongoDB ingestion: documents decoded per cursor batch (loader.py)
+LOAD_BATCH_SIZE        = 50000
+# Ratings are read as key-range partitions by concurrent threads, one pooled
+# connection each; 0 = the server's core count (hostInfo), capped by MONGO_POOL_SIZE
+LOAD_WORKERS           = int(os.getenv("ML_LOAD_WORKERS", "0"))
+LOAD_PARTITION_FIELD   = os.getenv("ML_LOAD_PARTITION_FIELD", "userId")  # indexed field to split on, else _id
+LOAD_PARTITIONS_PER_WORKER = 4  # more partitions than threads evens out skewed ranges
+
 # Hybrid-specific tuning
-TOP_N_COLLAB_SEEDS     = 8
-TOP_N_CONTENT_PER_SEED = 12
\ No newline at end of file
+TOP_N_COLLAB_SEEDS     = 8    # most recently rated movies used as content / TF-IDF seeds
+TOP_N_CONTENT_PER_SEED = 12   # neighbours contributed per seed
+HYBRID_BLOCK_SIZE      = 512  # users blended per block
\ No newline at end of file
@@ -1,20 +1,30 @@
 import json
-import warnings
+from pathlib import Path
+
 import joblib
 import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import MultiLabelBinarizer
 
+from instrumentation import span, count, traced, stage_trace
+from incremental import source_digest, feature_hashes, load_state, save_state, plan_update, update_neighbors
+from snapshot import get_movies, snapshot_watermark
+from neighbor_table import write_outputs, write_neighbor_table, indices_to_ids
+from movie_index import write_movie_index
+from neighbors import top_k_block, effective_k, neighbors_to_dict
+from parallel import map_row_blocks, resolve_n_jobs
 from config import (
     OUT_MOVIES_JSON,
+    OUT_MOVIE_INDEX,
     OUT_CONTENT_BASED,
-    TFIDF_VECTORIZER_PATH,
-    TFIDF_MATRIX_PATH,
+    OUT_CONTENT_BASED_BIN,
+    OUTPUT_FORMAT,
     TOP_N_SIMILAR,
-    is_mongodb_available,
-    get_movies_collection,
+    SIMILARITY_BLOCK_SIZE,
+    CONTENT_NEIGHBORS_PATH,
+    CONTENT_SCALER_PATH,
+    INCREMENTAL_TRAINING,
+    MOVIES_COLLECTION,
 )
 
 # ──────────────────────────────────────────────────────────────
@@ -23,6 +33,10 @@ from config import (
 # ──────────────────────────────────────────────────────────────
 
 MIN_VOTE_COUNT = 100  # Only use popular movies
+NUMERIC_COLUMNS = ["vote_average", "vote_count", "popularity"]
+FEATURE_COLUMNS = ["genres"] + NUMERIC_COLUMNS  # hashed per movie for incremental runs
+GENRE_WEIGHT = 0.6    # Jaccard similarity on genres
+NUMERIC_WEIGHT = 0.4  # Cosine similarity on numeric features
 
 
 def jaccard_similarity(set1, set2):
@@ -32,19 +46,247 @@ def jaccard_similarity(set1, set2):
     return intersection / union if union > 0 else 0.0
 
 
-def run():
+# ──────────────────────────────────────────────────────────────
+# Vectorized similarity engine
+# Genres become a sparse binary matrix G, so for a block of rows:
+#   intersection = G[block] @ G.T
+#   union        = |A| + |B| - intersection
+# Numeric features are L2-normalized once, so cosine is a plain dot product.
+# ──────────────────────────────────────────────────────────────
+
+def build_genre_matrix(genre_sets):
+    """Encode genre sets as a sparse binary CSR matrix (movies × genre tokens)."""
+    mlb = MultiLabelBinarizer(sparse_output=True)
+    genre_matrix = mlb.fit_transform(genre_sets).tocsr().astype(np.float64)
+    return genre_matrix
+
+
+@traced("features")
+def prepare_similarity_features(genre_sets, numeric_normalized):
+    """
+    Precompute everything the block kernels need: genre matrix, genre counts
+    per movie, unit-length numeric rows and the genre signature index.
+    """
+    genre_matrix = build_genre_matrix(genre_sets)
+    genre_counts = np.asarray(genre_matrix.sum(axis=1)).ravel()
+
+    # Same convention as sklearn's cosine_similarity: zero vectors stay zero
+    numeric = np.asarray(numeric_normalized, dtype=np.float64)
+    norms = np.linalg.norm(numeric, axis=1)
+    norms[norms == 0] = 1.0
+    numeric_unit = numeric / norms[:, None]
+
+    features = {
+        "genre_matrix": genre_matrix,
+        "genre_counts": genre_counts,
+        "numeric_unit": numeric_unit,
+    }
+    return add_genre_signatures(features, genre_sets)
+
+
+def similarity_block(features, start, stop):
+    """
+    Combined similarity for rows [start, stop) against every movie.
+    Returns a dense float32 array of shape (stop - start, n_movies).
+    """
+    return similarity_rows(features, slice(start, stop))
+
+
+@traced("similarity")
+def similarity_rows(features, rows):
+    """Combined similarity for `rows` (a slice or an index array) against every movie."""
+    genre_counts = features["genre_counts"]
+    numeric_unit = features["numeric_unit"]
+
+    genre_matrix = features["genre_matrix"]
+
+    intersection = (genre_matrix[rows] @ genre_matrix.T).toarray()
+    union = genre_counts[rows][:, None] + genre_counts[None, :] - intersection
+    jaccard = np.divide(
+        intersection, union,
+        out=np.zeros_like(intersection),
+        where=union > 0,
+    )
+
+    cosine = numeric_unit[rows] @ numeric_unit.T
+
+    combined = GENRE_WEIGHT * jaccard + NUMERIC_WEIGHT * cosine
+    count("pairs", combined.size)
+    return combined.astype(np.float32)
+
+
+def iter_similarity_blocks(features, block_size=SIMILARITY_BLOCK_SIZE):
+    """Yield (start, stop, block) over the full row space in blocks of `block_size` rows."""
+    n_movies = features["numeric_unit"].shape[0]
+    block_size = max(1, int(block_size))
+    for start in range(0, n_movies, block_size):
+        stop = min(start + block_size, n_movies)
+        yield start, stop, similarity_block(features, start, stop)
+
+
+def top_k_worker(features, start, stop, k=TOP_N_SIMILAR):
+    """Row-block worker: similarity block reduced to its top-K neighbours."""
+    block = similarity_block(features, start, stop)
+    return top_k_block(block, k, row_offset=start)
+
+
+# ──────────────────────────────────────────────────────────────
+# Genre candidate generation
+# Movies with the same genre set share one row of Jaccard scores, so the
+# inverted index is kept per distinct genre signature: signature × genre
+# matrix, plus the member movies of every signature. A pair scores at most
+# GENRE_WEIGHT · J + NUMERIC_WEIGHT (cosine ≤ 1), so once a row's K-th best
+# score τ is known, only movies with J ≥ (τ − NUMERIC_WEIGHT) / GENRE_WEIGHT
+# can still enter its top-K. Per signature:
+#   1. score the movies of the highest Jaccard levels until K are covered
+#   2. rescore with every movie above the bound set by the worst K-th score
+# Rows whose bound drops to J = 0 (weak overlaps, empty genre sets) are
+# scored against every movie from the numeric features.
+# ──────────────────────────────────────────────────────────────
+
+def add_genre_signatures(features, genre_sets):
+    """Add the signature inverted index (see above) to `features` in place."""
+    keys = [" ".join(sorted(genres)) for genres in genre_sets]
+    signature, uniques = pd.factorize(pd.Series(keys, dtype=object))
+    _, first = np.unique(signature, return_index=True)
+
+    members = np.argsort(signature, kind="stable").astype(np.int32)
+    offsets = np.zeros(len(uniques) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(signature, minlength=len(uniques)), out=offsets[1:])
+
+    features.update(
+        signature=signature.astype(np.int32),
+        signature_matrix=features["genre_matrix"][first],
+        signature_counts=features["genre_counts"][first],
+        signature_members=members,
+        signature_offsets=offsets,
+    )
+    return features
+
+
+def signature_jaccard(features, sig):
+    """Jaccard similarity of signature `sig` against every signature."""
+    matrix, counts = features["signature_matrix"], features["signature_counts"]
+    intersection = np.asarray((matrix[sig] @ matrix.T).todense()).ravel()
+    union = counts[sig] + counts - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def signature_candidates(features, sigs):
+    """Member movies of the signatures `sigs`."""
+    offsets = features["signature_offsets"]
+    return np.concatenate([features["signature_members"][offsets[sig]:offsets[sig + 1]] for sig in sigs])
+
+
+def _score_candidates(features, rows, candidates, jaccard, k):
+    """Top-K of `rows` over `candidates`; returns (indices, scores, K-th score floor)."""
+    with span("similarity"):
+        cosine = features["numeric_unit"][rows] @ features["numeric_unit"][candidates].T
+        block = GENRE_WEIGHT * jaccard[features["signature"][candidates]][None, :] + NUMERIC_WEIGHT * cosine
+        block[rows[:, None] == candidates[None, :]] = -np.inf
+        count("pairs", block.size)
+    top, scores = top_k_block(block, k, exclude_self=False)
+    return candidates[top], scores.astype(np.float32), float(scores[:, k - 1].min())
+
+
+def candidate_top_k_worker(features, start, stop, k=TOP_N_SIMILAR):
+    """
+    Row-block worker: exact top-K neighbours scored over genre candidates only.
+    Returns (indices, scores, (pairs scored, rows scored against every movie)).
+    """
+    n_movies = features["numeric_unit"].shape[0]
+    k = effective_k(k, n_movies)
+    indices = np.full((stop - start, k), -1, dtype=np.int32)
+    scores = np.zeros((stop - start, k), dtype=np.float32)
+    if k == 0:
+        return indices, scores, (0, 0)
+
+    signature = np.asarray(features["signature"][start:stop])
+    sizes = np.diff(features["signature_offsets"])
+    pairs = fallback = 0
+    for sig in np.unique(signature):
+        local = np.flatnonzero(signature == sig)
+        rows = local + start
+        jaccard = signature_jaccard(features, sig)
+
+        # 1. Highest Jaccard levels covering K movies besides the row itself
+        levels = np.unique(jaccard[jaccard > 0])[::-1]
+        covered = np.array([sizes[jaccard >= level].sum() for level in levels], dtype=np.int64)
+        enough = np.flatnonzero(covered > k)
+        bound = 0.0
+        if len(enough):
+            candidates = signature_candidates(features, np.flatnonzero(jaccard >= levels[enough[0]]))
+            top, top_scores, floor = _score_candidates(features, rows, candidates, jaccard, k)
+            pairs += len(rows) * len(candidates)
+            bound = (floor - NUMERIC_WEIGHT) / GENRE_WEIGHT
+            next_level = levels[enough[0] + 1] if enough[0] + 1 < len(levels) else 0.0
+            if next_level < bound:
+                indices[local], scores[local] = top, top_scores
+                continue
+
+        # 2. Every movie that can still beat the worst K-th score
+        if bound > 0:
+            candidates = signature_candidates(features, np.flatnonzero(jaccard >= bound - 1e-12))
+        else:
+            candidates = np.arange(n_movies, dtype=np.int32)
+            fallback += len(rows)
+        indices[local], scores[local], _ = _score_candidates(features, rows, candidates, jaccard, k)
+        pairs += len(rows) * len(candidates)
+
+    return indices, scores, (pairs, fallback)
+
+
+@traced("neighbors")
+def compute_neighbors(features, k=TOP_N_SIMILAR, block_size=SIMILARITY_BLOCK_SIZE, n_jobs=None,
+                      candidates=True):
+    """
+    Top-K (indices, scores) for every movie, optionally across a process pool.
+    `candidates` scores only the genre candidates that can reach the top-K (same result).
+    """
+    n_movies = features["numeric_unit"].shape[0]
+    results = map_row_blocks(
+        candidate_top_k_worker if candidates else top_k_worker,
+        features,
+        n_rows=n_movies,
+        block_size=block_size,
+        n_jobs=n_jobs,
+        k=k,
+    )
+    indices = np.vstack([result[0] for result in results])
+    scores = np.vstack([result[1] for result in results])
+    if candidates and results:
+        pairs = sum(result[2][0] for result in results)
+        fallback = sum(result[2][1] for result in results)
+        count("candidate_pairs", pairs)
+        count("fallback_rows", fallback)
+        print(f"→ Scored {pairs:,} candidate pairs ({pairs / max(n_movies ** 2, 1):.1%} of all), "
+              f"{fallback:,} movies against every movie")
+    return indices, scores
+
+
+def incremental_params():
+    """Settings an incremental update must share with the state it starts from."""
+    return {"k": TOP_N_SIMILAR, "min_vote_count": MIN_VOTE_COUNT,
+            "genre_weight": GENRE_WEIGHT, "numeric_weight": NUMERIC_WEIGHT,
+            "source": source_digest(__file__)}
+
+
+def run(incremental=INCREMENTAL_TRAINING):
+    """
+    Train content-based neighbours. With `incremental`, only movies added or
+    changed since the last run are rescored (falls back to a full run when
+    no usable state exists).
+    """
     print("Content-based model training started...")
     print("→ Using Jaccard similarity for genres + cosine for numeric features")
     print(f"→ Filtering to popular movies (vote_count > {MIN_VOTE_COUNT})")
 
-    if not is_mongodb_available():
-        print("❌ MongoDB not available. Cannot continue.")
-        return
-
-    movies_col = get_movies_collection()
-    print("Loading movies from MongoDB...")
+    print("Loading movies from snapshot...")
 
-    df = pd.DataFrame(list(movies_col.find({}, {"_id": 0})))
+    df = get_movies()
+    if df is None:
+        print("❌ MongoDB not available and no movies snapshot found. Cannot continue.")
+        return
     if df.empty:
         print("❌ No movies found in collection.")
         return
@@ -68,61 +310,66 @@ def run():
     # Parse genres into sets for Jaccard similarity
     df["genre_set"] = df["genres"].apply(lambda x: set(x.split()) if x else set())
 
+    hashes = feature_hashes(df, FEATURE_COLUMNS)
+    watermark = snapshot_watermark(MOVIES_COLLECTION)
+    state = load_state("content", incremental_params()) if incremental else None
+    if state is not None and not (df["movieId"].is_unique and Path(CONTENT_SCALER_PATH).exists()):
+        state = None
+    if incremental and state is None:
+        print("⚠️  No usable incremental state — running a full rebuild")
+
+    if state is not None and state["watermark"] == watermark:
+        # Nothing to rescore, but outputs may be missing or due in another
+        # OUTPUT_FORMAT: the empty update below rewrites them from the saved state
+        print("→ Movies snapshot unchanged since the last run — rewriting outputs from the saved state")
+
     # Normalize numeric features for cosine similarity
-    numeric_features = df[["vote_average", "vote_count", "popularity"]].values
     # Min-max normalization
     from sklearn.preprocessing import MinMaxScaler
-    scaler = MinMaxScaler()
-    numeric_normalized = scaler.fit_transform(numeric_features)
 
-    # ── Build similarity matrix ──────────────────────────────────
-    print("Building hybrid similarity matrix (Jaccard + Cosine)...")
-    n_movies = len(df)
-    similarity_matrix = np.zeros((n_movies, n_movies), dtype=np.float32)
+    if state is not None:
+        # ── Incremental update ───────────────────────────────────
+        plan = plan_update(state, df["movieId"].to_numpy(), hashes)
+        df, hashes = df.iloc[plan["order"]].copy(), hashes[plan["order"]]
+        print(f"→ Incremental update: {len(plan['changed']):,} new/changed, "
+              f"{plan['removed']:,} removed, {len(plan['stale']):,} lists to rebuild")
+
+        # The saved scaler keeps every unchanged movie's features identical
+        scaler = joblib.load(CONTENT_SCALER_PATH)
+        numeric_normalized = scaler.transform(df[NUMERIC_COLUMNS].values)
+        features = prepare_similarity_features(df["genre_set"].tolist(), numeric_normalized)
+        neighbor_idx, neighbor_scores = update_neighbors(
+            lambda rows: similarity_rows(features, rows), plan, TOP_N_SIMILAR
+        )
+    else:
+        scaler = MinMaxScaler()
+        numeric_normalized = scaler.fit_transform(df[NUMERIC_COLUMNS].values)
+
+        # ── Build similarity + top-K neighbours ─────────────────────
+        print("Building hybrid similarity (Jaccard + Cosine) with streaming top-K...")
+        print(f"→ Block size: {SIMILARITY_BLOCK_SIZE:,} rows, workers: {resolve_n_jobs()}")
+
+        features = prepare_similarity_features(df["genre_set"].tolist(), numeric_normalized)
+        neighbor_idx, neighbor_scores = compute_neighbors(features)
+        joblib.dump(scaler, CONTENT_SCALER_PATH)
 
     movie_ids = df["movieId"].tolist()
-    genre_sets = df["genre_set"].tolist()
-
-    # Calculate combined similarity
-    for i in range(n_movies):
-        for j in range(i, n_movies):
-            # Jaccard similarity for genres (weight: 0.6)
-            jaccard_sim = jaccard_similarity(genre_sets[i], genre_sets[j])
-            
-            # Cosine similarity for numeric features (weight: 0.4)
-            cosine_sim = cosine_similarity(
-                numeric_normalized[i:i+1],
-                numeric_normalized[j:j+1]
-            )[0][0]
-            
-            # Weighted combination
-            combined_sim = 0.6 * jaccard_sim + 0.4 * cosine_sim
-            
-            similarity_matrix[i, j] = combined_sim
-            similarity_matrix[j, i] = combined_sim
-
-    print(f"→ Similarity matrix shape: {similarity_matrix.shape}")
+    save_state("content", movie_ids, hashes, neighbor_idx, neighbor_scores, watermark, incremental_params())
+    print(f"→ Neighbour table shape: {neighbor_idx.shape}")
 
     # ── Generate recommendations ─────────────────────────────────
     print("Generating recommendations...")
-    recommendations = {}
-
-    for idx, movie_id in enumerate(movie_ids):
-        # Get similarity scores for this movie
-        sim_scores = similarity_matrix[idx]
-        
-        # Get indices of most similar movies (excluding itself)
-        similar_indices = np.argsort(sim_scores)[::-1][1:TOP_N_SIMILAR + 1]
-        
-        # Get movie IDs of similar movies
-        similar_movie_ids = [movie_ids[i] for i in similar_indices]
-        
-        recommendations[str(movie_id)] = similar_movie_ids
+    recommendations = neighbors_to_dict(movie_ids, neighbor_idx)
 
     # ── Save outputs ─────────────────────────────────────────────
-    print("Saving content-based recommendations...")
-    with open(OUT_CONTENT_BASED, "w", encoding="utf-8") as f:
-        json.dump(recommendations, f, indent=2)
+    print(f"Saving content-based recommendations ({OUTPUT_FORMAT})...")
+    neighbor_ids = indices_to_ids(movie_ids, neighbor_idx)
+    write_outputs(
+        OUT_CONTENT_BASED, OUT_CONTENT_BASED_BIN, recommendations,
+        keys=movie_ids, neighbors=neighbor_ids, scores=neighbor_scores,
+    )
+    # Scored neighbour table for the hybrid blender (always written)
+    write_neighbor_table(CONTENT_NEIGHBORS_PATH, movie_ids, neighbor_ids, neighbor_scores)
 
     print("Saving movies.json...")
     # Remove genre_set column (contains sets which are not JSON serializable)
@@ -139,14 +386,21 @@ def run():
             elif isinstance(value, (np.integer, np.floating)):
                 movie[key] = value.item()
     
-    with open(OUT_MOVIES_JSON, "w", encoding="utf-8") as f:
+    with span("write.movies_json"), open(OUT_MOVIES_JSON, "w", encoding="utf-8") as f:
         json.dump(movies_data, f, indent=2)
 
+    # Genre / year / rating posting lists over the same rows, for filtered browsing
+    print("Saving movie serving index...")
+    facet_terms = write_movie_index(OUT_MOVIE_INDEX, df_to_save)
+
     print(f"✅ Content-based model complete!")
     print(f"   → {len(recommendations):,} movies with recommendations")
     print(f"   → Saved to: {OUT_CONTENT_BASED}")
     print(f"   → Movies saved to: {OUT_MOVIES_JSON}")
+    print(f"   → Serving index saved to: {OUT_MOVIE_INDEX} "
+          f"({', '.join(f'{count} {facet} terms' for facet, count in facet_terms.items())})")
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    with stage_trace("content"):
+        run()
\ No newline at end of file
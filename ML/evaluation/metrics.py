@@ -0,0 +1,127 @@
+"""
+Ranking metrics over whole recommendation tables, vectorized over users.
+
+A table is an (n_users × K) int array of catalogue column indices, best
+first, padded with -1. `relevant` is an (n_users × n_items) CSR holding the
+held-out relevant movies of the same users. Nothing loops over users:
+hits come from one sorted-key lookup, the other metrics from row sums and
+sparse products.
+
+    precision@K   hits / K
+    recall@K      hits / |relevant|
+    NDCG@K        DCG of the hits / DCG of an ideal list of min(|relevant|, K) hits
+    hit rate@K    share of users with at least one hit
+    coverage      share of the catalogue recommended to anyone
+    entropy       Shannon entropy of how often each movie is recommended,
+                  normalized by log(n_items): 1 = every movie equally often
+    diversity     mean intra-list dissimilarity, 1 − cosine of the genre
+                  vectors of each pair of movies in a list
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def _keys(rows, cols, n_items):
+    return rows.astype(np.int64) * n_items + cols
+
+
+def hit_matrix(recs, relevant):
+    """Boolean (n_users × K): recs[u, i] is one of user u's relevant movies."""
+    relevant = relevant.tocsr()
+    relevant.sort_indices()
+    n_items = relevant.shape[1]
+    relevant_keys = _keys(np.repeat(np.arange(relevant.shape[0]), np.diff(relevant.indptr)),
+                          relevant.indices, n_items)  # sorted: CSR rows in order, sorted columns
+
+    recs = np.asarray(recs)
+    valid = recs >= 0
+    rec_keys = _keys(np.arange(len(recs))[:, None], np.maximum(recs, 0), n_items)
+    if len(relevant_keys) == 0:
+        return np.zeros(recs.shape, dtype=bool)
+    pos = np.minimum(np.searchsorted(relevant_keys, rec_keys), len(relevant_keys) - 1)
+    return valid & (relevant_keys[pos] == rec_keys)
+
+
+def ranking_metrics(recs, relevant, k=None):
+    """precision / recall / NDCG / hit rate @k averaged over the users of `relevant` with ≥ 1 relevant movie."""
+    recs = np.asarray(recs)
+    k = recs.shape[1] if k is None else min(k, recs.shape[1])
+    recs = recs[:, :k]
+
+    n_relevant = np.diff(relevant.tocsr().indptr)
+    users = n_relevant > 0
+    if not users.any():
+        return {"users": 0, f"precision@{k}": 0.0, f"recall@{k}": 0.0, f"ndcg@{k}": 0.0, f"hit_rate@{k}": 0.0}
+
+    hits = hit_matrix(recs, relevant)[users]
+    n_relevant = n_relevant[users]
+    n_hits = hits.sum(axis=1)
+
+    discount = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = hits @ discount
+    ideal = np.concatenate([[0.0], np.cumsum(discount)])[np.minimum(n_relevant, k)]
+    return {
+        "users": int(users.sum()),
+        f"precision@{k}": float(np.mean(n_hits / k)),
+        f"recall@{k}": float(np.mean(n_hits / n_relevant)),
+        f"ndcg@{k}": float(np.mean(dcg / ideal)),
+        f"hit_rate@{k}": float(np.mean(n_hits > 0)),
+    }
+
+
+def exposure(recs, n_items):
+    """How many lists recommend each catalogue movie."""
+    recs = np.asarray(recs)
+    return np.bincount(recs[recs >= 0], minlength=n_items)
+
+
+def coverage(recs, n_items):
+    return float(np.count_nonzero(exposure(recs, n_items)) / max(n_items, 1))
+
+
+def exposure_entropy(recs, n_items):
+    counts = exposure(recs, n_items)
+    total = counts.sum()
+    if total == 0 or n_items < 2:
+        return 0.0
+    p = counts[counts > 0] / total
+    return float(-(p * np.log(p)).sum() / np.log(n_items))
+
+
+def intra_list_diversity(recs, features):
+    """
+    Mean over lists of 1 − the average pairwise cosine of their movies'
+    `features` rows (items × features CSR, e.g. genres). For a list with
+    feature-sum S of unit rows, the sum over ordered pairs i ≠ j of
+    cos(i, j) is ‖S‖² − Σᵢ ‖fᵢ‖², so every list costs two sparse products.
+    Movies without features count as dissimilar to everything.
+    """
+    recs = np.asarray(recs)
+    features = csr_matrix(features, dtype=np.float64)
+    norms = np.sqrt(np.asarray(features.multiply(features).sum(axis=1)).ravel())
+    unit = csr_matrix(features.multiply(1.0 / np.where(norms > 0, norms, 1.0)[:, None]))
+    self_similarity = (norms > 0).astype(np.float64)
+
+    valid = recs >= 0
+    rows = np.repeat(np.arange(len(recs)), valid.sum(axis=1))
+    lists = csr_matrix((np.ones(len(rows)), (rows, recs[valid])), shape=(len(recs), features.shape[0]))
+
+    sums = lists @ unit
+    pair_similarity = np.asarray(sums.multiply(sums).sum(axis=1)).ravel() - lists @ self_similarity
+    n = valid.sum(axis=1)
+    scored = n >= 2
+    if not scored.any():
+        return 0.0
+    return float(np.mean(1.0 - pair_similarity[scored] / (n[scored] * (n[scored] - 1))))
+
+
+def evaluate(recs, relevant, n_items, features=None, k=None):
+    """Every metric above for one recommendation table (its first `k` columns)."""
+    recs = np.asarray(recs)[:, :k]
+    report = ranking_metrics(recs, relevant)
+    report["coverage"] = coverage(recs, n_items)
+    report["entropy"] = exposure_entropy(recs, n_items)
+    if features is not None:
+        report["diversity"] = intra_list_diversity(recs, features)
+    return report
@@ -0,0 +1,482 @@
+"""
+Offline evaluation of the recommenders on a held-out split of the ratings.
+
+Splits of the source ratings snapshot (default: the pipeline's cache/):
+    leave-last-out   the --holdout most recent ratings of every user with at
+                     least --min-ratings ratings
+    time             every rating after the (1 − --test-fraction) quantile
+                     of the timestamps
+
+Held-out ratings ≥ --relevant are a user's relevant movies. A user is
+evaluated when they have at least one relevant movie and some training
+history. The training part becomes the ratings snapshot below ML_EVAL_DIR
+(default evaluation/work/), next to a copy of the movies snapshot. Cache,
+models and outputs are redirected there before config is imported, so the
+real models and backend data are never touched. The train_models stages then
+train on it; stages whose inputs did not change are skipped (--force retrains).
+
+Every algorithm ranks the whole catalogue for every test user, one block of
+SCORE_BLOCK users per GEMM / sparse product, with N_JOBS workers:
+    content, tfidf   neighbour scores summed over each user's seed movies
+                     (hybrid.py's seeds: most recent ratings, weighted by rating)
+    svd              recommender_service.py as served: trained users by row,
+                     the others folded in; ML_ANN_SERVING / ML_QUANT_SERVING apply
+    hybrid           hybrid.py's blend of the three for the same users
+Movies rated in training are never recommended.
+
+Reported per algorithm (metrics.py): precision / recall / NDCG / hit rate @K,
+coverage, exposure entropy and genre diversity, with the wall time of the
+algorithm's training stage and of the scoring. Results are written as JSON
+and can be gated against an earlier run:
+
+    python evaluation/run_evaluation.py
+    python evaluation/run_evaluation.py --split time --test-fraction 0.1 --k 20
+    python evaluation/run_evaluation.py --source benchmarks/work/cache --users 5000
+    ML_QUANT_SERVING=1 python evaluation/run_evaluation.py --baseline evaluation/results/<previous>.json
+
+An algorithm regresses when a ranking metric falls more than --max-drop
+(default 2%) below the baseline; the exit code is then 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+
+EVAL_DIR = os.getenv("ML_EVAL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "work"))
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The split is read from wherever the pipeline reads its snapshot; everything
+# evaluation writes goes below EVAL_DIR, whatever the environment says
+SOURCE_CACHE_DIR = os.getenv("ML_CACHE_DIR", os.path.join(ML_DIR, "cache"))
+for _var, _sub in (("ML_CACHE_DIR", "cache"), ("ML_MODEL_DIR", "models"), ("ML_OUTPUT_DIR", "output")):
+    os.environ[_var] = os.path.join(EVAL_DIR, _sub)
+sys.path.insert(0, ML_DIR)
+
+import numpy as np  # noqa: E402
+from scipy.sparse import csr_matrix  # noqa: E402
+
+import metrics  # noqa: E402
+import train_models  # noqa: E402
+from artifacts import ids_to_index  # noqa: E402
+from content_based import build_genre_matrix  # noqa: E402
+from hybrid import build_seed_matrix, neighbor_matrix, blend_users, load_svd  # noqa: E402
+from neighbor_table import NeighborTable, indices_to_ids  # noqa: E402
+from neighbors import top_k_block, mask_rated  # noqa: E402
+from parallel import map_row_blocks  # noqa: E402
+from recommender_service import RecommenderService  # noqa: E402
+from reports import compare, git_revision, save_json  # noqa: E402
+from snapshot import read_meta, read_snapshot, write_snapshot, snapshot_dir  # noqa: E402
+from config import (  # noqa: E402
+    N_JOBS,
+    COLLAB_ENGINE,
+    ANN_SERVING,
+    QUANT_SERVING,
+    FACTOR_QUANTIZATION,
+    CONTENT_WEIGHT,
+    COLLAB_WEIGHT,
+    TFIDF_WEIGHT,
+    TOP_N_CONTENT_PER_SEED,
+    CONTENT_NEIGHBORS_PATH,
+    TFIDF_NEIGHBORS_PATH,
+    MOVIES_COLLECTION,
+    RATINGS_COLLECTION,
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SPLIT_FILE = os.path.join(EVAL_DIR, "split.json")
+TRAINING_FILE = os.path.join(EVAL_DIR, "training.json")
+TEST_SNAPSHOT = "rating.test"
+SPLITS = ("leave-last-out", "time")
+# Algorithm → training stages it needs (its own stage last)
+ALGORITHMS = {
+    "content": ("content",),
+    "tfidf": ("tfidf",),
+    "svd": ("collab",),
+    "hybrid": ("content", "tfidf", "collab", "hybrid"),
+}
+K = 10
+HOLDOUT = 1
+MIN_RATINGS = 5
+TEST_FRACTION = 0.2
+RELEVANT_RATING = 3.5
+SCORE_BLOCK = 1024          # test users scored per block
+MAX_DROP = 0.02
+GATED_METRICS = ("precision@", "recall@", "ndcg@")
+
+
+# ──────────────────────────────────────────────────────────────
+# Split
+# ──────────────────────────────────────────────────────────────
+
+def leave_last_out(ratings, holdout=HOLDOUT, min_ratings=MIN_RATINGS):
+    """Test mask: the `holdout` newest ratings of every user with at least `min_ratings` ratings."""
+    users = np.asarray(ratings["userId"])
+    order = np.lexsort((np.asarray(ratings["movieId"]), -np.asarray(ratings["timestamp"]), users))
+    _, first, sizes = np.unique(users[order], return_index=True, return_counts=True)
+    rank = np.arange(len(order)) - np.repeat(first, sizes)
+
+    test = np.zeros(len(users), dtype=bool)
+    test[order] = (rank < holdout) & (np.repeat(sizes, sizes) >= min_ratings)
+    return test
+
+
+def time_split(ratings, test_fraction=TEST_FRACTION):
+    """Test mask: every rating newer than the (1 − test_fraction) quantile of the timestamps."""
+    timestamps = np.asarray(ratings["timestamp"])
+    return timestamps > np.quantile(timestamps, 1 - test_fraction)
+
+
+def prepare_split(source, split, holdout, min_ratings, test_fraction):
+    """Write the training / test snapshots below EVAL_DIR, unless the same split is already there."""
+    root = os.path.join(os.path.abspath(source), "snapshots")
+    metas = [read_meta(name, root) for name in (MOVIES_COLLECTION, RATINGS_COLLECTION)]
+    if not all(metas):
+        raise SystemExit(f"❌ No movies / ratings snapshot in {root}. Run snapshot.py first.")
+
+    params = {"source": root, "source_created": [meta["created"] for meta in metas], "split": split}
+    params.update({"holdout": holdout, "min_ratings": min_ratings} if split == "leave-last-out"
+                  else {"test_fraction": test_fraction})
+    if os.path.exists(SPLIT_FILE) and read_meta(RATINGS_COLLECTION) and read_meta(TEST_SNAPSHOT):
+        with open(SPLIT_FILE, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous.get("params") == params:
+            print(f"→ Reusing {split} split in {EVAL_DIR}")
+            return previous
+
+    print(f"Splitting {root} ({split})...")
+    ratings = read_snapshot(RATINGS_COLLECTION, root=root)
+    if "timestamp" not in ratings:
+        raise SystemExit("❌ The ratings snapshot has no timestamps: cannot split by recency.")
+    if split == "leave-last-out":
+        test = leave_last_out(ratings, holdout, min_ratings)
+    else:
+        test = time_split(ratings, test_fraction)
+
+    key = {"evaluation": params}
+    write_snapshot(RATINGS_COLLECTION, {column: np.asarray(values)[~test] for column, values in ratings.items()}, key)
+    write_snapshot(TEST_SNAPSHOT, {column: np.asarray(values)[test] for column, values in ratings.items()}, key)
+    # Movies are not split: the copy keeps the file contents, so content / TF-IDF stay up to date
+    shutil.rmtree(snapshot_dir(MOVIES_COLLECTION), ignore_errors=True)
+    shutil.copytree(snapshot_dir(MOVIES_COLLECTION, root), snapshot_dir(MOVIES_COLLECTION))
+
+    result = {"params": params, "train_ratings": int((~test).sum()), "test_ratings": int(test.sum())}
+    save_json(SPLIT_FILE, result)
+    print(f"→ {result['train_ratings']:,} training / {result['test_ratings']:,} held-out ratings")
+    return result
+
+
+# ──────────────────────────────────────────────────────────────
+# Training
+# ──────────────────────────────────────────────────────────────
+
+def train(algorithms, force=False):
+    """
+    Run the stages the algorithms need on the training split (plus the ANN /
+    quantization stage when serving uses it). Returns {stage: result}; stages
+    skipped as up to date keep the timings of their last run.
+    """
+    names = {stage for name in algorithms for stage in ALGORITHMS[name]}
+    if "collab" in names:
+        names |= {"ann"} if ANN_SERVING else set()
+        names |= {"quantize"} if QUANT_SERVING else set()
+    stages = [stage for stage in train_models.STAGES if stage.name in names]
+    results = train_models.run_pipeline(stages, jobs=1, force=force)
+
+    timings = {}
+    if os.path.exists(TRAINING_FILE):
+        with open(TRAINING_FILE, "r", encoding="utf-8") as f:
+            timings = json.load(f)
+    for name, result in results.items():
+        if result["status"] == "ran":
+            timings[name] = result
+        elif result["status"] != "skipped":
+            timings.pop(name, None)
+    save_json(TRAINING_FILE, timings)
+    return {name: {**timings.get(name, {}), "status": result["status"]} for name, result in results.items()}
+
+
+# ──────────────────────────────────────────────────────────────
+# Test set
+# ──────────────────────────────────────────────────────────────
+
+def _user_matrix(ratings, users, movie_ids, keep=None):
+    """CSR (users × catalogue) of the ratings of `users`."""
+    rows = ids_to_index(users, np.asarray(ratings["userId"]))
+    cols = ids_to_index(movie_ids, np.asarray(ratings["movieId"]))
+    keep = (rows >= 0) if keep is None else keep & (rows >= 0)
+    R = csr_matrix(
+        (np.asarray(ratings["rating"], dtype=np.float32)[keep], (rows[keep], cols[keep])),
+        shape=(len(users), len(movie_ids)),
+        dtype=np.float32,
+    )
+    R.sum_duplicates()
+    return R
+
+
+def load_test_set(relevant_rating=RELEVANT_RATING, n_users=None, seed=0):
+    """
+    Test users with their training ratings and relevant held-out movies, over
+    the catalogue (every movie of the movies snapshot or of any rating).
+    """
+    train_ratings = read_snapshot(RATINGS_COLLECTION)
+    test_ratings = read_snapshot(TEST_SNAPSHOT)
+    movies = read_snapshot(MOVIES_COLLECTION, ["movieId", "genres"])
+    movie_ids = np.unique(np.concatenate([
+        np.asarray(movies["movieId"], dtype=np.int64),
+        np.asarray(train_ratings["movieId"], dtype=np.int64),
+        np.asarray(test_ratings["movieId"], dtype=np.int64),
+    ]))
+
+    relevant = np.asarray(test_ratings["rating"]) >= relevant_rating
+    candidates = np.unique(np.asarray(test_ratings["userId"])[relevant])
+    users = candidates[np.isin(candidates, np.asarray(train_ratings["userId"]))]
+    if n_users and len(users) > n_users:
+        users = np.sort(np.random.default_rng(seed).choice(users, n_users, replace=False))
+
+    genre_sets = [set() for _ in movie_ids]
+    for row, genres in zip(ids_to_index(movie_ids, np.asarray(movies["movieId"])), movies.get("genres", [])):
+        if isinstance(genres, str):
+            genre_sets[row] = set(genres.split())
+
+    return {
+        "users": users,
+        "cold_start_users": int(len(candidates) - np.isin(candidates, np.asarray(train_ratings["userId"])).sum()),
+        "movie_ids": movie_ids,
+        "train": train_ratings,
+        "R": _user_matrix(train_ratings, users, movie_ids),
+        "relevant": _user_matrix(test_ratings, users, movie_ids, keep=relevant),
+        "genres": build_genre_matrix(genre_sets),
+    }
+
+
+def _model_matrix(data, model_movie_ids):
+    """The test users' training ratings over a model's movie columns."""
+    R = data["R"].tocoo()
+    cols = ids_to_index(model_movie_ids, data["movie_ids"][R.col])
+    keep = cols >= 0
+    return csr_matrix((R.data[keep], (R.row[keep], cols[keep])),
+                      shape=(R.shape[0], len(model_movie_ids)), dtype=np.float32)
+
+
+def _to_columns(data, movie_lists, k):
+    """(n_users × k) catalogue columns from ranked movieId lists, padded with -1."""
+    lengths = np.array([len(movies) for movies in movie_lists], dtype=np.int64)
+    flat = np.concatenate([np.asarray(movies, dtype=np.int64) for movies in movie_lists] + [np.zeros(0, np.int64)])
+    rows = np.repeat(np.arange(len(movie_lists)), lengths)
+    ranks = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    columns = np.full((len(movie_lists), k), -1, dtype=np.int64)
+    columns[rows, ranks] = ids_to_index(data["movie_ids"], flat)
+    return columns
+
+
+# ──────────────────────────────────────────────────────────────
+# Scoring
+# ──────────────────────────────────────────────────────────────
+
+def item_worker(arrays, start, stop, k):
+    """Row-block worker: top-k catalogue columns of the seed movies' summed neighbour scores."""
+    scores = np.asarray((arrays["seeds"][start:stop] @ arrays["items"]).toarray(), dtype=np.float32)
+    scores[scores <= 0] = -np.inf  # not a neighbour of any seed: no evidence for the movie
+    R = arrays["R"]
+    mask_rated(scores, R.indptr, R.indices, start, stop)
+    top, top_scores = top_k_block(scores, k, exclude_self=False)
+    top[~np.isfinite(top_scores)] = -1
+    return top
+
+
+def recommend_items(data, path, k):
+    """Content / TF-IDF lists from the neighbour table at `path`."""
+    items = neighbor_matrix(NeighborTable(path), data["movie_ids"], per_row=TOP_N_CONTENT_PER_SEED)
+    seeds = build_seed_matrix(data["train"], data["users"], data["movie_ids"])
+    blocks = map_row_blocks(
+        item_worker, {"seeds": seeds, "items": items, "R": data["R"]},
+        n_rows=len(data["users"]),
+        block_size=SCORE_BLOCK,
+        k=min(k, len(data["movie_ids"])),
+    )
+    return np.vstack(blocks)
+
+
+def recommend_svd(data, k):
+    """Collaborative lists as served: recommend_batch for trained users, fold-in for the rest."""
+    service = RecommenderService.load()
+    users = data["users"]
+    R = _model_matrix(data, service.idx_to_movie)
+    trained = ids_to_index(service.user_ids, users) >= 0
+
+    movie_lists = [None] * len(users)
+    for start in range(0, len(users), SCORE_BLOCK):
+        block = np.arange(start, min(start + SCORE_BLOCK, len(users)))
+        known, new = block[trained[block]], block[~trained[block]]
+        batch = service.recommend_batch(users[known], k)
+        for row in known:
+            movie_lists[row] = batch.get(int(users[row]), [])
+        if len(new):
+            for row, movies in zip(new, service.recommend_for_matrix(R[new], k)):
+                movie_lists[row] = movies
+    return _to_columns(data, movie_lists, k)
+
+
+def recommend_hybrid(data, k):
+    """hybrid.py's blend for every test user; users outside the SVD model are folded in."""
+    svd = load_svd()
+    users, model_ids = data["users"], svd["movie_ids"]
+    R = _model_matrix(data, model_ids)
+    rows = ids_to_index(svd["user_ids"], users)
+    trained = rows >= 0
+
+    US = np.empty((len(users), svd["US"].shape[1]), dtype=np.float32)
+    US[trained] = svd["US"][rows[trained]]
+    if not trained.all():
+        US[~trained] = RecommenderService.load().fold_in(R[np.flatnonzero(~trained)])
+
+    item_matrices = {
+        name: neighbor_matrix(NeighborTable(path), model_ids, per_row=TOP_N_CONTENT_PER_SEED)
+        for name, path in (("content", CONTENT_NEIGHBORS_PATH), ("tfidf", TFIDF_NEIGHBORS_PATH))
+        if os.path.exists(path)
+    }
+    weights = {"content": CONTENT_WEIGHT, "collab": COLLAB_WEIGHT, "tfidf": TFIDF_WEIGHT}
+    top, _ = blend_users(US, svd["Vt"], R, build_seed_matrix(data["train"], users, model_ids),
+                         item_matrices, weights, top_n=k, block_size=SCORE_BLOCK)
+    top_movies = indices_to_ids(model_ids, top)
+    return np.where(top_movies >= 0, ids_to_index(data["movie_ids"], top_movies), -1)
+
+
+SCORERS = {
+    "content": lambda data, k: recommend_items(data, CONTENT_NEIGHBORS_PATH, k),
+    "tfidf": lambda data, k: recommend_items(data, TFIDF_NEIGHBORS_PATH, k),
+    "svd": recommend_svd,
+    "hybrid": recommend_hybrid,
+}
+
+
+def evaluate(algorithms, training, data, k):
+    """{algorithm: metrics + timings}; algorithms whose stages failed are reported as failed."""
+    n_users = len(data["users"])
+    results = {}
+    for name in algorithms:
+        stages = ALGORITHMS[name]
+        failed = [stage for stage in stages if training.get(stage, {}).get("status") not in ("ran", "skipped")]
+        if failed:
+            print(f"❌ {name}: training stage {', '.join(failed)} did not complete")
+            results[name] = {"status": "failed", "failed_stages": failed}
+            continue
+
+        print(f"→ Scoring {name} for {n_users:,} users...")
+        start = time.perf_counter()
+        recs = SCORERS[name](data, k)
+        seconds = time.perf_counter() - start
+
+        result = metrics.evaluate(recs, data["relevant"], len(data["movie_ids"]), data["genres"], k)
+        result.update(
+            status="ok",
+            train_seconds=training[stages[-1]].get("wall_time"),
+            score_seconds=round(seconds, 3),
+            users_per_s=round(n_users / seconds, 1) if seconds > 0 else None,
+        )
+        results[name] = result
+    return results
+
+
+# ──────────────────────────────────────────────────────────────
+# Report
+# ──────────────────────────────────────────────────────────────
+
+def print_results(algorithms, k):
+    columns = (f"precision@{k}", f"recall@{k}", f"ndcg@{k}", f"hit_rate@{k}", "coverage", "entropy", "diversity")
+    print("\n" + "═" * 110)
+    print(" EVALUATION RESULTS ".center(110))
+    print("═" * 110)
+    print(f"{'':<8}" + "".join(f"{column:>12}" for column in columns) + f"{'train s':>10}{'score s':>10}{'users/s':>12}")
+    for name, result in algorithms.items():
+        if result["status"] != "ok":
+            print(f"{name:<8} ❌ failed")
+            continue
+        line = f"{name:<8}" + "".join(f"{result.get(column, 0.0):>12.4f}" for column in columns)
+        train_seconds = result["train_seconds"]
+        line += f"{train_seconds:>10.1f}" if train_seconds is not None else f"{'-':>10}"
+        line += f"{result['score_seconds']:>10.2f}{result['users_per_s'] or 0:>12,.0f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the recommenders on a held-out split of the ratings.")
+    parser.add_argument("--source", default=SOURCE_CACHE_DIR, help="cache directory holding the snapshots to split")
+    parser.add_argument("--split", choices=SPLITS, default="leave-last-out")
+    parser.add_argument("--holdout", type=int, default=HOLDOUT, help="leave-last-out: ratings held out per user")
+    parser.add_argument("--min-ratings", type=int, default=MIN_RATINGS, help="leave-last-out: users with fewer are not split")
+    parser.add_argument("--test-fraction", type=float, default=TEST_FRACTION, help="time: newest share of ratings held out")
+    parser.add_argument("--relevant", type=float, default=RELEVANT_RATING, help="held-out ratings ≥ this are relevant")
+    parser.add_argument("--k", type=int, default=K)
+    parser.add_argument("--users", type=int, help="evaluate a random sample of the test users")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--algorithms", default=",".join(ALGORITHMS), help="comma-separated subset of " + ", ".join(ALGORITHMS))
+    parser.add_argument("--force", action="store_true", help="retrain every stage")
+    parser.add_argument("--output", help="results JSON (default: evaluation/results/<split>-<time>.json)")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to gate against")
+    parser.add_argument("--max-drop", type=float, default=MAX_DROP, help="allowed relative drop of a ranking metric")
+    args = parser.parse_args()
+
+    algorithms = [name.strip() for name in args.algorithms.split(",") if name.strip()]
+    unknown = set(algorithms) - set(ALGORITHMS)
+    if unknown:
+        parser.error(f"unknown algorithms: {', '.join(sorted(unknown))}")
+
+    started = time.time()
+    split = prepare_split(args.source, args.split, args.holdout, args.min_ratings, args.test_fraction)
+    training = train(algorithms, force=args.force)
+
+    data = load_test_set(args.relevant, args.users, args.seed)
+    print(f"→ {len(data['users']):,} test users ({data['cold_start_users']:,} without training ratings skipped), "
+          f"catalogue {len(data['movie_ids']):,} movies, K = {args.k}")
+    results = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+        "split": split,
+        "k": args.k,
+        "relevant_rating": args.relevant,
+        "test_users": len(data["users"]),
+        "cold_start_users": data["cold_start_users"],
+        "catalogue": len(data["movie_ids"]),
+        "environment": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "n_jobs": N_JOBS,
+            "collab_engine": COLLAB_ENGINE,
+            "ann_serving": ANN_SERVING,
+            "quant_serving": QUANT_SERVING and FACTOR_QUANTIZATION,
+        },
+        "training": training,
+        "algorithms": evaluate(algorithms, training, data, args.k),
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{args.split}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    save_json(output, results)
+    print_results(results["algorithms"], args.k)
+    print(f"\nResults: {output}")
+
+    failed = [name for name, result in results["algorithms"].items() if result["status"] != "ok"]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.baseline} (max drop {args.max_drop:.0%}):")
+        if baseline.get("split", {}).get("params") != split["params"] or baseline.get("k") != args.k:
+            print("⚠️  The baseline used another split or K: metrics are not comparable")
+        ok = {name: result for name, result in results["algorithms"].items() if result["status"] == "ok"}
+        base = {name: result for name, result in baseline.get("algorithms", {}).items() if result.get("status") == "ok"}
+        regressions = compare(ok, base, GATED_METRICS, args.max_drop, direction=-1, width=13, number="8.4f")
+
+    if failed or regressions:
+        for name in failed:
+            print(f"❌ {name} did not complete")
+        for message in regressions:
+            print(f"❌ Regression: {message}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,129 +1,325 @@
 import json
 from pathlib import Path
 
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from artifacts import load_dense, load_ids, load_sparse, ids_to_index
+from instrumentation import span, count, traced, stage_trace
+from snapshot import get_ratings
+from neighbor_table import NeighborTable, write_outputs, indices_to_ids
+from neighbors import top_k_block, sparse_top_k_block, neighbors_to_dict, mask_rated
+from parallel import map_row_blocks, resolve_n_jobs
 from config import (
     OUT_USER_RECS,
-    OUT_CONTENT_BASED,
-    OUT_MOVIES_JSON,
+    OUT_USER_RECS_BIN,
+    OUT_HYBRID_BIN,
+    OUT_HYBRID_JSON,
+    OUTPUT_FORMAT,
+    CONTENT_WEIGHT,
+    COLLAB_WEIGHT,
+    TFIDF_WEIGHT,
+    TOP_N_SIMILAR,
+    TOP_N_USER,
+    TOP_N_COLLAB_SEEDS,
+    TOP_N_CONTENT_PER_SEED,
+    HYBRID_BLOCK_SIZE,
+    SVD_U_PATH,
+    SVD_SIGMA_PATH,
+    SVD_Vt_PATH,
+    SVD_RATINGS_PATH,
+    USER_IDS_PATH,
+    MOVIE_IDS_PATH,
+    CONTENT_NEIGHBORS_PATH,
+    TFIDF_NEIGHBORS_PATH,
 )
 
 # ──────────────────────────────────────────────────────────────
-# Hybrid: Weighted combination of all algorithms
-# Uses all data (ratings + movies)
+# Hybrid: Weighted combination of all algorithms, on real scores
+#
+# Per user (every user of the SVD model), over every movie j:
+#   COLLAB_WEIGHT  · svd(u, j)
+# + CONTENT_WEIGHT · Σ_seeds w(u, s) · content(s, j)
+# + TFIDF_WEIGHT   · Σ_seeds w(u, s) · tfidf(s, j)
+# Seeds are the user's TOP_N_COLLAB_SEEDS most recently rated movies,
+# w = rating / 5. Each source is scaled to [0, 1] per user before weighting.
+# A user block costs one GEMM plus two sparse products.
+#
+# Per movie the content / TF-IDF neighbour scores are blended the same way,
+# with the cosine of the SVD item factors as the collaborative part.
 # ──────────────────────────────────────────────────────────────
 
-CONTENT_WEIGHT = 0.4
-COLLABORATIVE_WEIGHT = 0.4
-TFIDF_WEIGHT = 0.2
+MAX_RATING = 5.0
+
+
+def neighbor_matrix(table, movie_ids, per_row=None):
+    """
+    Square CSR (len(movie_ids) × len(movie_ids)) of neighbour scores from a
+    NeighborTable; keys and neighbours not in `movie_ids` are dropped and
+    only the first `per_row` neighbours of each movie are kept.
+    """
+    n = len(movie_ids)
+    k = table.neighbors.shape[1]
+    if per_row is not None:
+        k = min(k, per_row)
+    if len(table) == 0 or k == 0 or table.scores is None:
+        return csr_matrix((n, n), dtype=np.float32)
+
+    neighbors = np.asarray(table.neighbors[:, :k])
+    rows = np.repeat(ids_to_index(movie_ids, np.asarray(table.keys)), k)
+    cols = ids_to_index(movie_ids, neighbors.ravel())
+    data = np.asarray(table.scores[:, :k], dtype=np.float32).ravel()
+
+    keep = (rows >= 0) & (cols >= 0) & (neighbors.ravel() >= 0)
+    matrix = csr_matrix((data[keep], (rows[keep], cols[keep])), shape=(n, n), dtype=np.float32)
+    matrix.sum_duplicates()
+    return matrix
+
+
+@traced("seeds")
+def build_seed_matrix(ratings, user_ids, movie_ids, n_seeds=TOP_N_COLLAB_SEEDS):
+    """
+    CSR user × movie matrix holding rating / 5 for each user's `n_seeds`
+    most recent ratings (ties broken by higher rating).
+    """
+    rows = ids_to_index(user_ids, np.asarray(ratings["userId"]))
+    cols = ids_to_index(movie_ids, np.asarray(ratings["movieId"]))
+    rating = np.asarray(ratings["rating"], dtype=np.float32)
+    timestamp = np.asarray(ratings.get("timestamp", np.zeros(len(rating))), dtype=np.int64)
+
+    keep = (rows >= 0) & (cols >= 0)
+    rows, cols, rating, timestamp = rows[keep], cols[keep], rating[keep], timestamp[keep]
+
+    # Group by user, newest first; rank = position within the user's group
+    order = np.lexsort((-rating, -timestamp, rows))
+    rows, cols, rating = rows[order], cols[order], rating[order]
+    row_starts = np.searchsorted(rows, np.arange(len(user_ids)))
+    rank = np.arange(len(rows)) - row_starts[rows]
+
+    top = rank < n_seeds
+    seeds = csr_matrix(
+        (rating[top] / MAX_RATING, (rows[top], cols[top])),
+        shape=(len(user_ids), len(movie_ids)),
+        dtype=np.float32,
+    )
+    seeds.sum_duplicates()
+    return seeds
+
+
+def scale_rows(scores):
+    """Min-max scale each row to [0, 1] in place (constant rows become 0)."""
+    low = scores.min(axis=1, keepdims=True)
+    span = scores.max(axis=1, keepdims=True) - low
+    np.subtract(scores, low, out=scores)
+    np.divide(scores, span, out=scores, where=span > 0)
+    scores[(span <= 0).ravel()] = 0.0
+    return scores
+
+
+def hybrid_worker(arrays, start, stop, top_n, weights):
+    """
+    Row-block worker: blended top-N (matrix indices, scores) for users [start, stop).
+    `arrays` holds US, Vt, R and seeds, plus "content" / "tfidf" item matrices when available.
+    """
+    R = arrays["R"]
+    with span("collab_scores"):
+        scores = np.asarray(arrays["US"][start:stop] @ arrays["Vt"], dtype=np.float32)
+        scale_rows(scores)
+        scores *= weights["collab"]
+        count("users", stop - start)
+
+    seeds = arrays["seeds"][start:stop]
+    with span("item_scores"):
+        for name in ("content", "tfidf"):
+            if name in arrays:
+                part = np.asarray((seeds @ arrays[name]).toarray(), dtype=np.float32)
+                scores += weights[name] * scale_rows(part)
+
+    mask_rated(scores, R.indptr, R.indices, start, stop)
+    return top_k_block(scores, top_n, exclude_self=False)
+
+
+@traced("blend_users")
+def blend_users(US, Vt, R, seeds, item_matrices, weights, top_n=TOP_N_USER,
+                block_size=HYBRID_BLOCK_SIZE, n_jobs=None):
+    """Top-N blended (matrix indices, scores) for every user row of R."""
+    arrays = {"US": US, "Vt": Vt, "R": R, "seeds": seeds}
+    arrays.update(item_matrices)
+    results = map_row_blocks(
+        hybrid_worker, arrays,
+        n_rows=R.shape[0],
+        block_size=block_size,
+        n_jobs=n_jobs,
+        top_n=min(top_n, R.shape[1]),
+        weights=weights,
+    )
+    indices = np.vstack([idx for idx, _ in results])
+    scores = np.vstack([sc for _, sc in results])
+
+    # Users who rated (almost) everything: drop masked slots
+    indices[~np.isfinite(scores)] = -1
+    scores[~np.isfinite(scores)] = 0.0
+    return indices, scores
+
+
+def item_factor_cosine(factors, rows, cols, chunk_size=1_000_000):
+    """Cosine of the factor rows for each (rows[i], cols[i]) pair (0 where a row is -1)."""
+    norms = np.linalg.norm(factors, axis=1)
+    norms[norms == 0] = 1.0
+    unit = (factors / norms[:, None]).astype(np.float32)
+
+    result = np.zeros(len(rows), dtype=np.float32)
+    valid = np.flatnonzero((rows >= 0) & (cols >= 0))
+    for start in range(0, len(valid), chunk_size):
+        pos = valid[start:start + chunk_size]
+        result[pos] = np.einsum("ij,ij->i", unit[rows[pos]], unit[cols[pos]])
+    return np.maximum(result, 0.0)
+
+
+@traced("blend_movies")
+def blend_movies(tables, weights, svd, k=TOP_N_SIMILAR):
+    """
+    Per-movie hybrid neighbours over the union of the content / TF-IDF movies.
+    Candidates are the neighbours of either table; each is scored with the
+    weighted content, TF-IDF and SVD item-factor cosine scores.
+    Returns (movie_ids, neighbour indices, scores).
+    """
+    movie_ids = np.unique(np.concatenate([np.asarray(t.keys, dtype=np.int64) for t in tables.values()]))
+    n = len(movie_ids)
+
+    blended = csr_matrix((n, n), dtype=np.float32)
+    for name, table in tables.items():
+        blended = blended + weights[name] * neighbor_matrix(table, movie_ids)
+    blended = blended.tocoo()
+    rows, cols, data = blended.row, blended.col, blended.data.astype(np.float32)
+
+    if svd is not None and weights["collab"] > 0:
+        factor_rows = ids_to_index(svd["movie_ids"], movie_ids)
+        data = data + weights["collab"] * item_factor_cosine(
+            svd["item_factors"], factor_rows[rows], factor_rows[cols]
+        )
+
+    matrix = csr_matrix((data, (rows, cols)), shape=(n, n), dtype=np.float32)
+    count("pairs", matrix.nnz)
+    indices, scores = sparse_top_k_block(matrix, min(k, max(n - 1, 0)))
+    return movie_ids, indices, scores
+
+
+@traced("load.svd")
+def load_svd():
+    """SVD artifacts needed for blending, or None if collaborative_svd.py has not run."""
+    try:
+        U = load_dense(SVD_U_PATH)
+        Sigma = load_dense(SVD_SIGMA_PATH)
+        Vt = load_dense(SVD_Vt_PATH)
+        return {
+            "US": np.ascontiguousarray(U * Sigma, dtype=np.float32),
+            "Vt": np.asarray(Vt, dtype=np.float32),
+            "item_factors": np.ascontiguousarray(Vt.T * Sigma, dtype=np.float32),
+            "R": load_sparse(SVD_RATINGS_PATH, mmap=False),
+            "user_ids": load_ids(USER_IDS_PATH),
+            "movie_ids": load_ids(MOVIE_IDS_PATH),
+        }
+    except FileNotFoundError:
+        return None
 
 
 def run():
     """
-    Creates hybrid recommendations by combining:
-    - Content-based (Jaccard + Cosine): 40%
-    - Collaborative (SVD with Pearson): 40%
-    - TF-IDF (Cosine similarity): 20%
-    
-    Uses all available data from all algorithms.
+    Creates hybrid recommendations by combining real scores of:
+    - Content-based (Jaccard + Cosine): CONTENT_WEIGHT
+    - Collaborative (SVD): COLLAB_WEIGHT
+    - TF-IDF (Cosine similarity): TFIDF_WEIGHT
+
+    Writes per-user `hybrid` lists for every SVD user and per-movie hybrid neighbours.
     """
+    weights = {"content": CONTENT_WEIGHT, "collab": COLLAB_WEIGHT, "tfidf": TFIDF_WEIGHT}
+
     print("Hybrid model training started...")
     print(f"→ Combining all algorithms with weighted scores:")
     print(f"   - Content-based (Jaccard+Cosine): {CONTENT_WEIGHT * 100}%")
-    print(f"   - Collaborative (SVD+Pearson): {COLLABORATIVE_WEIGHT * 100}%")
+    print(f"   - Collaborative (SVD): {COLLAB_WEIGHT * 100}%")
     print(f"   - TF-IDF (Cosine): {TFIDF_WEIGHT * 100}%")
 
     # ── Load all recommendation sources ───────────────────────────
-    content_recs = {}
-    collab_recs = {}
-    tfidf_recs = {}
-
-    # Load content-based recommendations
-    if Path(OUT_CONTENT_BASED).exists():
-        with open(OUT_CONTENT_BASED, "r", encoding="utf-8") as f:
-            content_recs = json.load(f)
-        print(f"→ Loaded content-based: {len(content_recs):,} movies")
-    else:
-        print("⚠️  Content-based recommendations not found")
-
-    # Load collaborative recommendations
-    if Path(OUT_USER_RECS).exists():
-        with open(OUT_USER_RECS, "r", encoding="utf-8") as f:
-            user_data = json.load(f)
-            # Extract collaborative recommendations from user data
-            for user_id, data in user_data.items():
-                if isinstance(data, dict) and "collaborative" in data:
-                    for movie_id in data["collaborative"]:
-                        if str(movie_id) not in collab_recs:
-                            collab_recs[str(movie_id)] = []
-        print(f"→ Loaded collaborative: {len(collab_recs):,} movies")
-    else:
-        print("⚠️  Collaborative recommendations not found")
-
-    # Load TF-IDF recommendations
-    tfidf_path = OUT_MOVIES_JSON.replace("movies.json", "tfidf_recommendations.json")
-    if Path(tfidf_path).exists():
-        with open(tfidf_path, "r", encoding="utf-8") as f:
-            tfidf_recs = json.load(f)
-        print(f"→ Loaded TF-IDF: {len(tfidf_recs):,} movies")
+    tables = {}
+    for name, path in (("content", CONTENT_NEIGHBORS_PATH), ("tfidf", TFIDF_NEIGHBORS_PATH)):
+        if Path(path).exists():
+            tables[name] = NeighborTable(path)
+            print(f"→ Loaded {name} neighbours: {len(tables[name]):,} movies")
+        else:
+            print(f"⚠️  {name} neighbour table not found ({path})")
+
+    svd = load_svd()
+    if svd is not None:
+        print(f"→ Loaded SVD model: {len(svd['user_ids']):,} users × {len(svd['movie_ids']):,} movies")
     else:
-        print("⚠️  TF-IDF recommendations not found")
+        print("⚠️  SVD model not found")
 
-    if not content_recs and not collab_recs and not tfidf_recs:
+    if not tables and svd is None:
         print("❌ No recommendation sources available. Run other models first.")
         return
 
-    # ── Combine recommendations with weighted scoring ─────────────
-    print("Combining recommendations with weighted scores...")
-    hybrid_recs = {}
-
-    # Get all unique movie IDs
-    all_movie_ids = set()
-    all_movie_ids.update(content_recs.keys())
-    all_movie_ids.update(collab_recs.keys())
-    all_movie_ids.update(tfidf_recs.keys())
-
-    print(f"→ Processing {len(all_movie_ids):,} unique movies...")
-
-    for movie_id in all_movie_ids:
-        movie_id_str = str(movie_id)
-        
-        # Collect recommendations from each source
-        content_list = content_recs.get(movie_id_str, [])
-        collab_list = collab_recs.get(movie_id_str, [])
-        tfidf_list = tfidf_recs.get(movie_id_str, [])
-
-        # Score each recommended movie
-        scores = {}
-
-        # Content-based scores (higher position = higher score)
-        for idx, rec_id in enumerate(content_list[:20]):
-            score = (20 - idx) * CONTENT_WEIGHT
-            scores[rec_id] = scores.get(rec_id, 0) + score
-
-        # Collaborative scores
-        for idx, rec_id in enumerate(collab_list[:20]):
-            score = (20 - idx) * COLLABORATIVE_WEIGHT
-            scores[rec_id] = scores.get(rec_id, 0) + score
-
-        # TF-IDF scores
-        for idx, rec_id in enumerate(tfidf_list[:20]):
-            score = (20 - idx) * TFIDF_WEIGHT
-            scores[rec_id] = scores.get(rec_id, 0) + score
-
-        # Sort by combined score and take top recommendations
-        sorted_recs = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        hybrid_recs[movie_id_str] = [int(rec_id) for rec_id, _ in sorted_recs[:20]]
-
-    # ── Save hybrid recommendations ───────────────────────────────
-    hybrid_output = OUT_MOVIES_JSON.replace("movies.json", "hybrid_recommendations.json")
-    print(f"Saving hybrid recommendations to {hybrid_output}...")
-    with open(hybrid_output, "w", encoding="utf-8") as f:
-        json.dump(hybrid_recs, f, indent=2)
+    # ── Per-user hybrid lists ─────────────────────────────────────
+    if svd is not None:
+        ratings = get_ratings()
+        if ratings is None:
+            print("⚠️  No ratings snapshot — seeds fall back to the SVD training ratings")
+            R = svd["R"].tocoo()
+            ratings = {"userId": svd["user_ids"][R.row], "movieId": svd["movie_ids"][R.col], "rating": R.data}
+
+        user_ids, movie_ids = svd["user_ids"], svd["movie_ids"]
+        seeds = build_seed_matrix(ratings, user_ids, movie_ids)
+        with span("item_matrices"):
+            item_matrices = {
+                name: neighbor_matrix(table, movie_ids, per_row=TOP_N_CONTENT_PER_SEED)
+                for name, table in tables.items()
+            }
+
+        print(f"Blending top-{TOP_N_USER} recommendations for {len(user_ids):,} users...")
+        print(f"→ Seeds per user: {TOP_N_COLLAB_SEEDS}, neighbours per seed: {TOP_N_CONTENT_PER_SEED}")
+        print(f"→ Block size: {HYBRID_BLOCK_SIZE:,} users, workers: {resolve_n_jobs()}")
+        top_indices, top_scores = blend_users(
+            svd["US"], svd["Vt"], svd["R"], seeds, item_matrices, weights
+        )
+        top_movies = indices_to_ids(movie_ids, top_indices)
+
+        def user_recs():
+            # Add the hybrid list next to the collaborative one written earlier
+            data = {}
+            if Path(OUT_USER_RECS).exists():
+                with open(OUT_USER_RECS, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            for row, uid in enumerate(user_ids):
+                movies = top_movies[row]
+                data.setdefault(str(int(uid)), {})["hybrid"] = movies[movies >= 0].astype(int).tolist()
+            return data
+
+        write_outputs(
+            OUT_USER_RECS, OUT_USER_RECS_BIN.format(kind="hybrid"), user_recs,
+            keys=user_ids, neighbors=top_movies, scores=top_scores, indent=None,
+        )
+        print(f"→ Saved hybrid recommendations for {len(user_ids):,} users ({OUTPUT_FORMAT})")
+
+    # ── Per-movie hybrid neighbours ───────────────────────────────
+    if tables:
+        print("Combining item neighbours with weighted scores...")
+        movie_ids, neighbor_idx, neighbor_scores = blend_movies(tables, weights, svd)
+        hybrid_recs = neighbors_to_dict(movie_ids.tolist(), neighbor_idx)
+
+        print(f"Saving hybrid recommendations to {OUT_HYBRID_JSON} ({OUTPUT_FORMAT})...")
+        write_outputs(
+            OUT_HYBRID_JSON, OUT_HYBRID_BIN, hybrid_recs,
+            keys=movie_ids,
+            neighbors=indices_to_ids(movie_ids, neighbor_idx),
+            scores=neighbor_scores,
+        )
+        print(f"   → {len(hybrid_recs):,} movies with hybrid recommendations")
+        print(f"   → Saved to: {OUT_HYBRID_JSON}")
 
     print(f"✅ Hybrid model complete!")
-    print(f"   → {len(hybrid_recs):,} movies with hybrid recommendations")
-    print(f"   → Saved to: {hybrid_output}")
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    with stage_trace("hybrid"):
+        run()
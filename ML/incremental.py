@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from artifacts import save_dense, load_dense
+from instrumentation import traced
+from neighbors import top_k_block
+from config import INCREMENTAL_DIR, SIMILARITY_BLOCK_SIZE
+
+# ──────────────────────────────────────────────────────────────
+# Incremental neighbour updates
+# After a full run each item stage stores its row order, one feature hash
+# per movie, its exact (float32) top-K table and the snapshot watermark.
+# The next run diffs the catalogue against that state:
+#   changed = new movies + movies whose feature hash differs
+#   stale   = unchanged movies whose list points at a changed / removed movie
+# Only changed ∪ stale rows are scored against the full catalogue; the
+# changed rows' scores are then merged into every other row's top-K
+# (similarities are symmetric), so a run costs O(changed × N), not O(N²).
+# ──────────────────────────────────────────────────────────────
+
+STATE_ARRAYS = ("ids", "hashes", "indices", "scores")
+
+
+def state_dir(stage):
+    return os.path.join(INCREMENTAL_DIR, stage)
+
+
+def source_digest(path):
+    """Digest of a stage's source file: a code change invalidates its saved state."""
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def feature_hashes(df, columns):
+    """One uint64 hash per row over the feature `columns`."""
+    return pd.util.hash_pandas_object(df[columns].astype(str), index=False).to_numpy(dtype=np.uint64)
+
+
+@traced("save_state")
+def save_state(stage, ids, hashes, indices, scores, watermark, params):
+    """Store the catalogue state of `stage` after a full or incremental run."""
+    directory = state_dir(stage)
+    tmp_dir = directory + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    arrays = {
+        "ids": np.asarray(ids, dtype=np.int64),
+        "hashes": np.asarray(hashes, dtype=np.uint64),
+        "indices": np.asarray(indices, dtype=np.int32),
+        "scores": np.asarray(scores, dtype=np.float32),
+    }
+    for name, array in arrays.items():
+        save_dense(os.path.join(tmp_dir, name), array)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"watermark": watermark, "params": params}, f, indent=2)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+
+
+def load_state(stage, params):
+    """Previous state of `stage`, or None if missing or built with different `params`."""
+    directory = state_dir(stage)
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("params") != params:
+        return None
+
+    state = {name: load_dense(os.path.join(directory, name), mmap=False) for name in STATE_ARRAYS}
+    state["watermark"] = meta.get("watermark")
+    return state
+
+
+def plan_update(state, ids, hashes):
+    """
+    Diff the current catalogue (`ids`, `hashes`, in DataFrame order) against `state`.
+
+    Returns a dict with
+      order    positions into the current rows: surviving movies in their old
+               order, then new movies — the row order of the updated tables
+      old_rows for each surviving row, its row in the previous state
+      changed  row indices (new order) of new / modified movies
+      stale    row indices of unchanged movies whose old list must be rebuilt
+      indices, scores  previous top-K remapped to the new order (-1 = empty)
+      removed  number of movies no longer in the catalogue
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    old_ids, old_hashes = state["ids"], state["hashes"]
+
+    # Position of every current movie in the old state (-1 = new)
+    sorter = np.argsort(old_ids, kind="stable")
+    pos = np.searchsorted(old_ids, ids, sorter=sorter)
+    pos = np.minimum(pos, max(len(old_ids) - 1, 0))
+    old_pos = sorter[pos] if len(old_ids) else np.full(len(ids), -1)
+    found = (old_ids[old_pos] == ids) if len(old_ids) else np.zeros(len(ids), dtype=bool)
+    old_pos = np.where(found, old_pos, -1)
+
+    survivors = np.flatnonzero(found)
+    survivors = survivors[np.argsort(old_pos[survivors], kind="stable")]
+    added = np.flatnonzero(~found)
+    order = np.concatenate([survivors, added])
+    old_rows = old_pos[survivors]
+
+    # Old row → new row (-1 = removed)
+    remap = np.full(len(old_ids) + 1, -1, dtype=np.int64)  # last slot maps padding (-1)
+    remap[old_rows] = np.arange(len(survivors))
+    n_removed = len(old_ids) - len(survivors)
+
+    modified = old_hashes[old_rows] != hashes[survivors]
+    changed = np.concatenate([np.flatnonzero(modified), np.arange(len(survivors), len(order))])
+
+    old_indices = state["indices"][old_rows].astype(np.int64)
+    indices = remap[np.where(old_indices >= 0, old_indices, len(old_ids))]
+    scores = state["scores"][old_rows].astype(np.float32)
+
+    # Lists that lost an entry (removed movie) or hold a changed movie's outdated score
+    is_changed = np.zeros(len(order), dtype=bool)
+    is_changed[changed] = True
+    lost = (old_indices >= 0) & (indices < 0)
+    outdated = (indices >= 0) & is_changed[np.maximum(indices, 0)]
+    stale = np.flatnonzero((lost | outdated).any(axis=1) & ~is_changed[:len(survivors)])
+
+    # Pad the remapped tables for the new rows
+    k = indices.shape[1]
+    indices = np.vstack([indices, np.full((len(added), k), -1, dtype=np.int64)])
+    scores = np.vstack([scores, np.zeros((len(added), k), dtype=np.float32)])
+
+    return {
+        "order": order,
+        "old_rows": old_rows,
+        "changed": changed,
+        "stale": stale,
+        "indices": indices.astype(np.int32),
+        "scores": scores,
+        "removed": n_removed,
+    }
+
+
+def merge_top_k(indices, scores, cand_indices, cand_scores, k):
+    """Merge candidate neighbours into padded top-K rows (-1 = empty slot)."""
+    all_indices = np.hstack([indices, cand_indices])
+    all_scores = np.hstack([np.where(indices >= 0, scores, -np.inf), cand_scores]).astype(np.float32)
+    top, top_scores = top_k_block(all_scores, k, exclude_self=False)
+
+    merged = np.take_along_axis(all_indices, top.astype(np.int64), axis=1).astype(np.int32)
+    empty = ~np.isfinite(top_scores)
+    merged[empty] = -1
+    top_scores[empty] = 0.0
+    return merged, top_scores
+
+
+def merge_candidates(indices, scores, cand_block, cand_rows, skip, k):
+    """
+    Merge similarities of the `cand_rows` movies (rows of `cand_block`,
+    one column per movie) into the top-K of every row not in `skip`.
+    Only entries beating a row's current K-th score are considered.
+    """
+    kth = np.where(indices[:, k - 1] >= 0, scores[:, k - 1], -np.inf)
+    kth[skip] = np.inf
+    cand_pos, targets = np.nonzero(cand_block > kth[None, :])
+    if len(targets) == 0:
+        return
+
+    # Per target row: its best K candidates, padded
+    values = cand_block[cand_pos, targets]
+    order = np.lexsort((-values, targets))
+    cand_pos, targets, values = cand_pos[order], targets[order], values[order]
+    affected, starts = np.unique(targets, return_index=True)
+    slot = np.arange(len(targets)) - np.repeat(starts, np.diff(np.append(starts, len(targets))))
+    keep = slot < k
+    row_of = np.searchsorted(affected, targets[keep])
+
+    cand_indices = np.full((len(affected), k), -1, dtype=np.int32)
+    cand_scores = np.full((len(affected), k), -np.inf, dtype=np.float32)
+    cand_indices[row_of, slot[keep]] = cand_rows[cand_pos[keep]]
+    cand_scores[row_of, slot[keep]] = values[keep]
+
+    indices[affected], scores[affected] = merge_top_k(
+        indices[affected], scores[affected], cand_indices, cand_scores, k
+    )
+
+
+@traced("incremental_update")
+def update_neighbors(rows_similarity, plan, k, threshold=None, block_size=SIMILARITY_BLOCK_SIZE):
+    """
+    Apply `plan` (see plan_update) to its remapped top-K tables.
+
+    `rows_similarity(rows)` returns the dense similarity of `rows` against the
+    whole updated catalogue. Scores <= `threshold` never become neighbours.
+    Returns the updated (indices, scores).
+    """
+    indices, scores = plan["indices"].copy(), plan["scores"].copy()
+    n_rows = len(indices)
+    k = min(k, max(n_rows - 1, 0))
+
+    # Widen / narrow the remapped tables to the current K
+    if indices.shape[1] != k:
+        pad = max(k - indices.shape[1], 0)
+        indices = np.hstack([indices, np.full((n_rows, pad), -1, dtype=np.int32)])[:, :k]
+        scores = np.hstack([scores, np.zeros((n_rows, pad), dtype=np.float32)])[:, :k]
+
+    changed = np.asarray(plan["changed"], dtype=np.int64)
+    rebuild = np.union1d(changed, plan["stale"]).astype(np.int64)
+    is_rebuilt = np.zeros(n_rows, dtype=bool)
+    is_rebuilt[rebuild] = True
+    is_changed = np.zeros(n_rows, dtype=bool)
+    is_changed[changed] = True
+
+    block_size = max(1, int(block_size))
+    for start in range(0, len(rebuild), block_size):
+        rows = rebuild[start:start + block_size]
+        block = np.asarray(rows_similarity(rows), dtype=np.float32)
+        block[np.arange(len(rows)), rows] = -np.inf  # never your own neighbour
+        if threshold is not None:
+            block[block <= threshold] = -np.inf
+
+        # Changed rows are new candidates for every untouched row
+        cand = is_changed[rows]
+        if cand.any() and k > 0:
+            merge_candidates(indices, scores, block[cand], rows[cand], is_rebuilt, k)
+
+        top, top_scores = top_k_block(block, k, exclude_self=False)
+        empty = ~np.isfinite(top_scores)
+        top[empty] = -1
+        top_scores[empty] = 0.0
+        indices[rows], scores[rows] = top, top_scores
+
+    return indices, scores
@@ -0,0 +1,222 @@
+"""
+Lightweight tracing for the training stages.
+
+    with span("similarity"):            # nested timing span
+        ...
+        count("pairs", n)               # counter on the innermost open span
+
+    @traced("load.movies")              # the same, as a decorator
+    def get_movies(...): ...
+
+    with stage_trace("content"):        # root of one stage: writes the trace
+        run()
+
+Spans with the same name under the same parent are merged (calls, total
+seconds, summed counters), so a per-block span stays a single node. Every
+span records the process' current and peak RSS when it closes. The tree
+is written to TRACE_DIR/<stage>.json and summarized on stdout.
+
+Enabled with ML_TRACE=1. ML_PROFILE=cprofile additionally runs each stage
+under cProfile (TRACE_DIR/<stage>.prof + top functions in the trace).
+When tracing is off, span() returns a shared no-op context and count()
+returns immediately. Spans opened inside process-pool workers (N_JOBS > 1)
+stay in the worker and are not part of the trace.
+"""
+
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+from config import TRACE_ENABLED, PROFILE_MODE, TRACE_DIR
+
+PROFILE_TOP = 25  # functions listed in the trace by cumulative time
+
+_enabled = TRACE_ENABLED
+_stack = []       # open spans, innermost last
+_NOOP = nullcontext()
+
+
+def enable(flag=True):
+    """Switch tracing on or off at runtime (e.g. for one benchmark run)."""
+    global _enabled
+    _enabled = bool(flag)
+
+
+def is_enabled():
+    return _enabled
+
+
+# ──────────────────────────────────────────────────────────────
+# Memory
+# ──────────────────────────────────────────────────────────────
+
+def current_rss_mb():
+    """Resident set size now (Linux /proc; None elsewhere)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    """Process high-water RSS (None where `resource` is unavailable)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10  # bytes on macOS, KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+# ──────────────────────────────────────────────────────────────
+# Spans
+# ──────────────────────────────────────────────────────────────
+
+class Span:
+    __slots__ = ("name", "calls", "seconds", "counters", "children", "rss_mb", "peak_rss_mb", "_start")
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.counters = {}
+        self.children = {}
+        self.rss_mb = None
+        self.peak_rss_mb = None
+        self._start = None
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = Span(name)
+        return node
+
+    def __enter__(self):
+        self.calls += 1
+        self._start = time.perf_counter()
+        _stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self._start
+        _stack.pop()
+        self.rss_mb = current_rss_mb()
+        self.peak_rss_mb = peak_rss_mb()
+        return False
+
+    def to_dict(self):
+        node = {"name": self.name, "calls": self.calls, "seconds": round(self.seconds, 6),
+                "rss_mb": self.rss_mb, "peak_rss_mb": self.peak_rss_mb}
+        if self.counters:
+            node["counters"] = self.counters
+        if self.children:
+            node["children"] = [child.to_dict() for child in self.children.values()]
+        return node
+
+
+def span(name):
+    """Context manager timing `name` under the innermost open span (no-op when off)."""
+    if not _enabled or not _stack:
+        return _NOOP
+    return _stack[-1].child(name)
+
+
+def count(name, value=1):
+    """Add `value` to counter `name` of the innermost open span."""
+    if not _enabled or not _stack:
+        return
+    counters = _stack[-1].counters
+    counters[name] = counters.get(name, 0) + int(value)
+
+
+def traced(name):
+    """Decorator form of span()."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled or not _stack:
+                return func(*args, **kwargs)
+            with _stack[-1].child(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ──────────────────────────────────────────────────────────────
+# Stage traces
+# ──────────────────────────────────────────────────────────────
+
+def trace_path(stage, suffix="json"):
+    return os.path.join(TRACE_DIR, f"{stage}.{suffix}")
+
+
+def _profile_summary(profiler):
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out).sort_stats("cumulative")
+    stats.print_stats(PROFILE_TOP)
+    rows = []
+    for (filename, line, function), (_, calls, total, cumulative, _) in stats.stats.items():
+        rows.append({"function": f"{os.path.basename(filename)}:{line}({function})",
+                     "calls": calls, "total_s": round(total, 6), "cumulative_s": round(cumulative, 6)})
+    rows.sort(key=lambda row: -row["cumulative_s"])
+    return rows[:PROFILE_TOP]
+
+
+def print_tree(node, depth=0, total=None):
+    total = total or node["seconds"] or 1.0
+    calls = f" ×{node['calls']:,}" if node["calls"] > 1 else ""
+    counters = "  " + ", ".join(f"{k}={v:,}" for k, v in node.get("counters", {}).items()) if node.get("counters") else ""
+    print(f"   {'  ' * depth}{node['name']:<{32 - 2 * depth}} {node['seconds']:>9.3f}s "
+          f"{100 * node['seconds'] / total:>5.1f}%{calls}{counters}")
+    for child in node.get("children", []):
+        print_tree(child, depth + 1, total)
+
+
+@contextmanager
+def stage_trace(stage):
+    """
+    Root span of one stage. Writes TRACE_DIR/<stage>.json (and .prof with
+    ML_PROFILE=cprofile) when it closes; yields the trace path or None.
+    """
+    profile = PROFILE_MODE == "cprofile"
+    if not (_enabled or profile) or _stack:
+        yield None
+        return
+
+    root = Span(stage)
+    profiler = cProfile.Profile() if profile else None
+    started = time.time()
+    enabled_before = _enabled
+    enable(True)
+    try:
+        with root:
+            if profiler:
+                profiler.enable()
+            try:
+                yield trace_path(stage)
+            finally:
+                if profiler:
+                    profiler.disable()
+    finally:
+        enable(enabled_before)
+        trace = {"stage": stage, "started": started, **root.to_dict()}
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        if profiler:
+            profiler.dump_stats(trace_path(stage, "prof"))
+            trace["profile"] = _profile_summary(profiler)
+        tmp_path = trace_path(stage) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, indent=2)
+        os.replace(tmp_path, trace_path(stage))
+
+        print(f"→ Trace ({stage}):")
+        print_tree(root.to_dict())
+        print(f"   → {trace_path(stage)}")
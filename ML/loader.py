@@ -0,0 +1,400 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    LOAD_BATCH_SIZE,
+    LOAD_WORKERS,
+    LOAD_PARTITION_FIELD,
+    LOAD_PARTITIONS_PER_WORKER,
+    MONGO_POOL_SIZE,
+)
+
+# ──────────────────────────────────────────────────────────────
+# Streaming MongoDB loader
+# Cursors are consumed in large batches and written straight into
+# preallocated NumPy column arrays, so a 25M-row collection never exists
+# as a list of Python dicts. Decoding path, fastest first:
+#   1. pymongoarrow (BSON → arrays in C), numeric columns only
+#   2. find_raw_batches + bson.decode_all, one batch at a time
+#   3. plain cursor with batch_size (mongomock / fixture stand-ins)
+# ──────────────────────────────────────────────────────────────
+
+RATING_COLUMNS = {
+    "userId": np.int32,
+    "movieId": np.int32,
+    "rating": np.float32,
+    "timestamp": np.int64,
+}
+
+IN_QUERY_CHUNK = 1000  # ids per {"$in": [...]} query
+PARTITION_SAMPLE = 100  # sampled keys per partition when choosing range bounds
+
+try:
+    import bson
+    from pymongo.collection import Collection
+except ImportError:
+    bson = None
+    Collection = ()
+
+_ARROW_API = None
+
+
+def _arrow_api():
+    """(pyarrow, Schema, find_numpy_all) when pymongoarrow is installed, else None."""
+    global _ARROW_API
+    if _ARROW_API is None:
+        try:
+            import pyarrow as pa
+            from pymongoarrow.api import Schema, find_numpy_all
+            _ARROW_API = (pa, Schema, find_numpy_all)
+        except ImportError:
+            _ARROW_API = False
+    return _ARROW_API or None
+
+
+class ColumnBuffer:
+    """Preallocated, geometrically growing column arrays filled batch by batch."""
+
+    def __init__(self, columns, capacity=0):
+        self.columns = dict(columns)
+        self.size = 0
+        capacity = max(int(capacity), 1)
+        self.arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.columns.items()}
+
+    def _reserve(self, n):
+        needed = self.size + n
+        capacity = len(next(iter(self.arrays.values())))
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        for name, array in self.arrays.items():
+            grown = np.empty(new_capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            self.arrays[name] = grown
+
+    def append_columns(self, batch):
+        """Append a dict of equal-length column arrays."""
+        n = len(next(iter(batch.values()))) if batch else 0
+        if n == 0:
+            return
+        self._reserve(n)
+        for name, dtype in self.columns.items():
+            self.arrays[name][self.size:self.size + n] = batch[name]
+        self.size += n
+
+    def append_documents(self, docs):
+        """Convert one batch of documents to columns and append them."""
+        if docs:
+            self.append_columns({
+                name: _to_column([doc.get(name) for doc in docs], dtype)
+                for name, dtype in self.columns.items()
+            })
+
+    def finish(self):
+        """Trimmed column arrays."""
+        return {name: array[:self.size] for name, array in self.arrays.items()}
+
+
+def _to_column(values, dtype):
+    """Convert a list of raw field values to one column (missing numerics → 0 / NaN)."""
+    if dtype is object:
+        return np.array(values, dtype=object)
+    try:
+        return np.asarray(values, dtype=dtype)
+    except (TypeError, ValueError):
+        numeric = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce")
+        if np.issubdtype(np.dtype(dtype), np.integer):
+            numeric = numeric.fillna(0)
+        return numeric.to_numpy(dtype=dtype)
+
+
+def _projection(columns):
+    projection = {name: 1 for name in columns}
+    projection["_id"] = 0
+    return projection
+
+
+def _read_into(buffer, collection, query, batch_size, hint=None):
+    """Append the documents matching `query`; `hint` (an index key list) is used by real servers only."""
+    columns = buffer.columns
+    numeric_only = all(dtype is not object for dtype in columns.values())
+    # Stand-ins such as mongomock expose find_raw_batches but do not implement it
+    raw_capable = bson is not None and isinstance(collection, Collection)
+    arrow = _arrow_api() if raw_capable and numeric_only else None
+
+    if arrow is not None:
+        pa, Schema, find_numpy_all = arrow
+        schema = Schema({name: pa.from_numpy_dtype(np.dtype(dtype)) for name, dtype in columns.items()})
+        options = {"hint": hint} if hint else {}
+        arrays = find_numpy_all(collection, query, schema=schema, projection=_projection(columns), **options)
+        buffer.append_columns({
+            name: np.nan_to_num(np.asarray(arrays[name], dtype=np.float64)).astype(dtype)
+            if np.issubdtype(np.dtype(dtype), np.integer) else np.asarray(arrays[name], dtype=dtype)
+            for name, dtype in columns.items()
+        })
+        return
+
+    if raw_capable:
+        cursor = collection.find_raw_batches(query, _projection(columns), batch_size=batch_size)
+        if hint:
+            cursor = cursor.hint(hint)
+        for raw_batch in cursor:
+            buffer.append_documents(bson.decode_all(raw_batch))
+        return
+
+    cursor = collection.find(query, _projection(columns)).batch_size(batch_size)
+    docs = []
+    for doc in cursor:
+        docs.append(doc)
+        if len(docs) >= batch_size:
+            buffer.append_documents(docs)
+            docs = []
+    buffer.append_documents(docs)
+
+
+def load_columns(collection, columns, query=None, batch_size=LOAD_BATCH_SIZE, expected=0):
+    """
+    Stream `collection.find(query)` into {field: array} using only the
+    projected `columns` ({field: dtype}; use `object` for strings).
+    `expected` preallocates the arrays when the row count is known.
+    """
+    buffer = ColumnBuffer(columns, capacity=expected)
+    _read_into(buffer, collection, query or {}, batch_size)
+    return buffer.finish()
+
+
+def _concat(columns, parts):
+    """Join ColumnBuffer results in order into one set of trimmed arrays."""
+    parts = [part for part in parts if len(next(iter(part.values()), ())) > 0]
+    if len(parts) == 1:
+        return parts[0]
+    if not parts:
+        return ColumnBuffer(columns).finish()
+    return {name: np.concatenate([part[name] for part in parts]) for name in columns}
+
+
+def _read_all(collection, columns, queries, batch_size, workers, hint=None, expected=0):
+    """
+    Read every query of `queries` into its own ColumnBuffer on a thread pool
+    and join them in query order. Each thread holds one pooled connection;
+    the GIL is released while it waits on the socket and while pymongoarrow /
+    bson decode, so reads overlap with decoding.
+    """
+    def read(query):
+        buffer = ColumnBuffer(columns, capacity=expected // max(len(queries), 1))
+        _read_into(buffer, collection, query, batch_size, hint=hint)
+        return buffer.finish()
+
+    if workers <= 1 or len(queries) <= 1:
+        return _concat(columns, [read(query) for query in queries])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return _concat(columns, list(pool.map(read, queries)))
+
+
+def load_columns_for_ids(collection, columns, field, ids, batch_size=LOAD_BATCH_SIZE,
+                         expected=0, chunk_size=IN_QUERY_CHUNK, workers=None):
+    """
+    Like load_columns, but for documents whose `field` is in `ids`.
+    Issues one {"$in": ...} query per `chunk_size` ids instead of one huge
+    query; the chunks are read concurrently by `workers` threads.
+    """
+    ids = [int(i) for i in ids]
+    queries = [{field: {"$in": ids[start:start + chunk_size]}} for start in range(0, len(ids), chunk_size)]
+    workers = resolve_load_workers(collection) if workers is None else workers
+    return _read_all(collection, columns, queries, batch_size, workers,
+                     hint=_hint(collection, field), expected=expected)
+
+
+# ──────────────────────────────────────────────────────────────
+# Range-partitioned parallel reads
+# A full collection scan is split into contiguous ranges of an indexed
+# field (userId for ratings, else _id). Bounds are quantiles of a server
+# side $sample, so partitions hold roughly equal document counts; each one
+# is an index range scan that a pool thread streams into its own buffer,
+# and the parts are joined in key order. Ingest then scales with the
+# number of server cores instead of one cursor's decode rate.
+# ──────────────────────────────────────────────────────────────
+
+def _is_server(collection):
+    """True for a real pymongo collection (stand-ins lack hostInfo, hints and $sample guarantees)."""
+    return bson is not None and isinstance(collection, Collection)
+
+
+def index_for(collection, field):
+    """Key pattern of an index whose first key is `field`, or None."""
+    if field == "_id":
+        return [("_id", 1)]
+    try:
+        indexes = collection.index_information()
+    except Exception:
+        return None
+    for info in indexes.values():
+        keys = [(name, direction) for name, direction in info["key"]]
+        if keys and keys[0][0] == field:
+            return keys
+    return None
+
+
+def _hint(collection, field):
+    return index_for(collection, field) if _is_server(collection) else None
+
+
+def server_cores(collection):
+    """CPU cores of the MongoDB host, or None when hostInfo is unavailable (e.g. no privileges)."""
+    if not _is_server(collection):
+        return None
+    try:
+        info = collection.database.client.admin.command("hostInfo")
+        return int(info["system"]["numCores"])
+    except Exception:
+        return None
+
+
+def resolve_load_workers(collection, workers=LOAD_WORKERS):
+    """Reader threads: `workers` if set, else the server's cores (this machine's as fallback), within the pool size."""
+    if workers and workers > 0:
+        return max(1, min(int(workers), MONGO_POOL_SIZE))
+    if not _is_server(collection):
+        return 1
+    cores = server_cores(collection) or os.cpu_count() or 1
+    return max(1, min(cores, MONGO_POOL_SIZE))
+
+
+def range_bounds(collection, field, n_partitions, query=None):
+    """
+    n_partitions + 1 ascending bounds for `field`, the first and last None
+    (open ends). Interior bounds are quantiles of n_partitions ×
+    PARTITION_SAMPLE sampled keys; duplicates collapse, so heavily skewed
+    keys yield fewer partitions.
+    """
+    if n_partitions <= 1:
+        return [None, None]
+    pipeline = ([{"$match": query}] if query else []) + [
+        {"$sample": {"size": n_partitions * PARTITION_SAMPLE}},
+        {"$project": {"_id": 0, "key": f"${field}"}},
+    ]
+    keys = [doc["key"] for doc in collection.aggregate(pipeline) if doc.get("key") is not None]
+    if not keys:
+        return [None, None]
+    try:
+        keys = sorted(keys)
+    except TypeError:  # mixed BSON types cannot be ordered here
+        return [None, None]
+    cuts = []
+    for i in range(1, n_partitions):
+        key = keys[i * len(keys) // n_partitions]
+        if not cuts or key > cuts[-1]:
+            cuts.append(key)
+    return [None, *cuts, None]
+
+
+def _range_query(field, low, high, query=None):
+    """[low, high) on `field`; the first range also catches documents with a missing / null key."""
+    if low is None and high is None:
+        condition = None
+    elif low is None:
+        condition = {"$not": {"$gte": high}}
+    elif high is None:
+        condition = {"$gte": low}
+    else:
+        condition = {"$gte": low, "$lt": high}
+    if condition is None:
+        return dict(query or {})
+    if query:
+        return {"$and": [query, {field: condition}]}
+    return {field: condition}
+
+
+def load_columns_partitioned(collection, columns, query=None, field=LOAD_PARTITION_FIELD,
+                             batch_size=LOAD_BATCH_SIZE, expected=0, workers=None):
+    """
+    load_columns over `workers` concurrent range partitions of `field`
+    (falls back to _id when `field` has no index, and to one sequential
+    read for a single worker or a non-pymongo stand-in).
+    Rows come back grouped by `field` range, not in natural order.
+    """
+    workers = resolve_load_workers(collection) if workers is None else workers
+    if workers <= 1:
+        return load_columns(collection, columns, query, batch_size=batch_size, expected=expected)
+
+    hint = index_for(collection, field)
+    if hint is None:
+        field, hint = "_id", index_for(collection, "_id")
+    bounds = range_bounds(collection, field, workers * LOAD_PARTITIONS_PER_WORKER, query)
+    queries = [_range_query(field, low, high, query) for low, high in zip(bounds[:-1], bounds[1:])]
+    return _read_all(collection, columns, queries, batch_size, workers,
+                     hint=hint if _is_server(collection) else None, expected=expected)
+
+
+def load_ratings(collection, user_ids=None, expected=0, batch_size=LOAD_BATCH_SIZE, workers=None):
+    """Ratings as int32/float32 columns (optionally only for `user_ids`), read in parallel partitions."""
+    if user_ids is None:
+        return load_columns_partitioned(collection, RATING_COLUMNS, batch_size=batch_size,
+                                        expected=expected, workers=workers)
+    return load_columns_for_ids(
+        collection, RATING_COLUMNS, "userId", user_ids,
+        batch_size=batch_size, expected=expected, workers=workers,
+    )
+
+
+# ──────────────────────────────────────────────────────────────
+# Server-side aggregation
+# ──────────────────────────────────────────────────────────────
+
+def active_user_counts(collection, min_ratings, limit=None):
+    """
+    (user ids, rating counts) of users with at least `min_ratings` ratings,
+    most ratings first and ties by ascending id — the order of
+    collaborative_svd.select_active_users — grouped on the server so only
+    one row per user crosses the wire. A userId index makes it a covered scan.
+    """
+    pipeline = [
+        {"$project": {"_id": 0, "userId": 1}},
+        {"$group": {"_id": "$userId", "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gte": int(min_ratings)}}},
+        {"$sort": {"n": -1, "_id": 1}},
+    ]
+    if limit is not None:
+        pipeline.append({"$limit": int(limit)})
+    options = {"allowDiskUse": True}
+    hint = _hint(collection, "userId")
+    if hint:
+        options["hint"] = hint
+    buffer = ColumnBuffer({"_id": np.int64, "n": np.int64})
+    docs = []
+    for doc in collection.aggregate(pipeline, batchSize=LOAD_BATCH_SIZE, **options):
+        docs.append(doc)
+        if len(docs) >= LOAD_BATCH_SIZE:
+            buffer.append_documents(docs)
+            docs = []
+    buffer.append_documents(docs)
+    result = buffer.finish()
+    return result["_id"], result["n"]
+
+
+def load_movies(collection, columns=None, batch_size=LOAD_BATCH_SIZE):
+    """
+    Movies as a DataFrame.
+    With `columns` only those fields are projected into column arrays;
+    without, every field is kept (needed for movies.json) and batches are
+    converted to frames one at a time.
+    """
+    if columns is not None:
+        return pd.DataFrame(load_columns(collection, columns, batch_size=batch_size))
+
+    frames = []
+    cursor = collection.find({}, {"_id": 0}).batch_size(batch_size)
+    docs = []
+    for doc in cursor:
+        docs.append(doc)
+        if len(docs) >= batch_size:
+            frames.append(pd.DataFrame(docs))
+            docs = []
+    if docs:
+        frames.append(pd.DataFrame(docs))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,213 @@
+"""
+Serving index for movies.json — filtered browsing without scanning the catalogue.
+
+Rows are positions in movies.json. The index holds:
+    ids          int32[n]  movie id of each row
+    id_keys      int32[n]  sorted movie ids, id_rows[i] is the row of id_keys[i]
+    id_rows      int32[n]
+    popularity   int32[n]  rows by popularity (then vote count) descending
+    postings     int32[…]  ascending row lists, one per facet term:
+                   genre   lower-cased genre tokens (as split for Jaccard)
+                   year    release year
+                   rating  floor(vote_average), 0–10
+
+A filter is the intersection of a few small sorted lists, a page a slice of it.
+
+Layout (little endian, every array 64-byte aligned):
+    8 bytes   magic  b"MRMI" + uint32 version
+    4 bytes   uint32 header length
+    N bytes   JSON header {"n", "arrays": {name: [offset, length]},
+                           "facets": {facet: {term: [offset, length]}}}
+    int32 arrays; offsets are relative to the data section, which starts at
+    the first 64-byte boundary after the header, and posting offsets index
+    into `postings`.
+"""
+
+import json
+import os
+import re
+import struct
+
+import numpy as np
+
+from instrumentation import traced
+
+MAGIC = b"MRMI"
+VERSION = 1
+ALIGN = 64
+
+ARRAYS = ("ids", "id_keys", "id_rows", "popularity", "postings")
+YEAR_COLUMNS = ("release_year", "year")
+DATE_COLUMNS = ("release_date", "releaseDate")
+RATING_BUCKETS = 10  # vote_average 0–10 → buckets 0…10
+
+_YEAR = re.compile(r"(\d{4})")
+
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def genre_tokens(value):
+    """Lower-cased genre tokens of a genres field (space separated string or list)."""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        value = " ".join(str(v) for v in value)
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return set()
+    return {token.lower() for token in str(value).split()}
+
+
+def _numeric(df, column):
+    import pandas as pd
+
+    if column not in df:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float64)
+
+
+def release_years(df):
+    """Release year per row (0 = unknown) from release_year / year, else the release date."""
+    years = np.zeros(len(df), dtype=np.int64)
+    for column in YEAR_COLUMNS:
+        values = _numeric(df, column)
+        fill = (years == 0) & np.isfinite(values) & (values > 0)
+        years[fill] = values[fill].astype(np.int64)
+    for column in DATE_COLUMNS:
+        if column not in df:
+            continue
+        for row in np.flatnonzero(years == 0):
+            match = _YEAR.match(str(df[column].iat[row] or ""))
+            if match:
+                years[row] = int(match.group(1))
+    return years
+
+
+def _postings(rows, values):
+    """{term: ascending rows} for parallel arrays of rows and term values."""
+    if len(rows) == 0:
+        return {}
+    terms, codes = np.unique(values, return_inverse=True)
+    order = np.lexsort((rows, codes))
+    rows, codes = rows[order], codes[order]
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(codes)) + 1, [len(codes)]])
+    return {term: rows[start:end] for term, start, end in zip(terms.tolist(), bounds[:-1], bounds[1:])}
+
+
+@traced("write.movie_index")
+def write_movie_index(path, df):
+    """Write the serving index of `df`, whose row order must match movies.json."""
+    n = len(df)
+    ids = np.nan_to_num(_numeric(df, "movieId"), nan=-1).astype(np.int64)
+    rows = np.arange(n, dtype=np.int64)
+
+    popularity = np.nan_to_num(_numeric(df, "popularity"), nan=0.0)
+    vote_count = np.nan_to_num(_numeric(df, "vote_count"), nan=0.0)
+    id_order = np.argsort(ids, kind="stable")
+
+    genre_rows, genre_terms = [], []
+    for row, value in enumerate(df["genres"] if "genres" in df else [None] * n):
+        for token in genre_tokens(value):
+            genre_rows.append(row)
+            genre_terms.append(token)
+
+    years = release_years(df)
+    has_year = years > 0
+    rating = _numeric(df, "vote_average")
+    has_rating = np.isfinite(rating)
+    buckets = np.clip(np.floor(rating[has_rating]), 0, RATING_BUCKETS).astype(np.int64)
+
+    facets = {
+        "genre": _postings(np.array(genre_rows, dtype=np.int64), np.array(genre_terms, dtype=str)),
+        "year": _postings(rows[has_year], years[has_year]),
+        "rating": _postings(rows[has_rating], buckets),
+    }
+
+    # Concatenate every posting list; the header maps each term to its slice
+    postings, header_facets, offset = [], {}, 0
+    for facet, lists in facets.items():
+        header_facets[facet] = {}
+        for term in sorted(lists, key=str):
+            postings.append(lists[term])
+            header_facets[facet][str(term)] = [offset, len(lists[term])]
+            offset += len(lists[term])
+
+    arrays = {
+        "ids": ids,
+        "id_keys": ids[id_order],
+        "id_rows": rows[id_order],
+        "popularity": np.lexsort((rows, -vote_count, -popularity)),
+        "postings": np.concatenate(postings) if postings else np.empty(0, dtype=np.int64),
+    }
+    arrays = {name: np.ascontiguousarray(array, dtype=np.int32) for name, array in arrays.items()}
+
+    layout, offset = {}, 0
+    for name in ARRAYS:
+        layout[name] = [offset, len(arrays[name])]
+        offset = _align(offset + arrays[name].nbytes)
+
+    header = json.dumps({"n": n, "arrays": layout, "facets": header_facets}).encode("utf-8")
+    data_offset = _align(12 + len(header))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", VERSION))
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for name in ARRAYS:
+            f.write(b"\0" * (data_offset + layout[name][0] - f.tell()))
+            f.write(arrays[name].tobytes())
+    os.replace(tmp_path, path)
+    return {facet: len(lists) for facet, lists in header_facets.items()}
+
+
+def intersect(lists):
+    """Intersection of ascending row arrays, smallest first."""
+    lists = sorted(lists, key=len)
+    result = np.asarray(lists[0])
+    for other in lists[1:]:
+        result = result[np.isin(result, other, assume_unique=True)]
+    return result
+
+
+class MovieIndex:
+    """Read-only, memory-mapped view of a movie index file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(8)[:4] != MAGIC:
+                raise ValueError(f"{path} is not a movie index")
+            (header_len,) = struct.unpack("<I", f.read(4))
+            self.header = json.loads(f.read(header_len))
+
+        data_offset = _align(12 + header_len)
+        self.arrays = {}
+        for name, (offset, length) in self.header["arrays"].items():
+            self.arrays[name] = (np.memmap(path, dtype=np.int32, mode="r", offset=data_offset + offset,
+                                           shape=(length,)) if length else np.empty(0, dtype=np.int32))
+
+    def __len__(self):
+        return self.header["n"]
+
+    def row(self, movie_id):
+        """Row of `movie_id` in movies.json (-1 if absent)."""
+        keys = self.arrays["id_keys"]
+        pos = int(np.searchsorted(keys, movie_id))
+        if pos < len(keys) and keys[pos] == movie_id:
+            return int(self.arrays["id_rows"][pos])
+        return -1
+
+    def postings(self, facet, term):
+        """Ascending rows of one facet term (empty if unknown)."""
+        offset, length = self.header["facets"].get(facet, {}).get(str(term), (0, 0))
+        return self.arrays["postings"][offset:offset + length]
+
+    def rows(self, genre=None, year=None):
+        """Ascending rows matching every given filter (all rows without filters)."""
+        lists = []
+        if genre is not None:
+            lists.append(self.postings("genre", str(genre).lower()))
+        if year is not None:
+            lists.append(self.postings("year", int(year)))
+        if not lists:
+            return np.arange(len(self), dtype=np.int32)
+        return intersect(lists)
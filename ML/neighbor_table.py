@@ -0,0 +1,170 @@
+"""
+Compact binary neighbour table — alternative to the large recommendation JSON files.
+
+Layout (little endian, every array 64-byte aligned):
+    8 bytes   magic  b"MRNT" + uint32 version
+    4 bytes   uint32 header length
+    N bytes   JSON header {"n", "k", "has_scores", "keys_offset", "neighbors_offset", "scores_offset"}
+    int32[n]        sorted keys (movieId or userId)
+    int32[n × k]    neighbour ids, row i belongs to keys[i], -1 = empty slot
+    float16[n × k]  scores (optional)
+
+Lookups are a binary search over the memory-mapped key array.
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+from instrumentation import traced, span
+from config import OUTPUT_FORMAT
+
+MAGIC = b"MRNT"
+VERSION = 1
+ALIGN = 64
+
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+@traced("write.table")
+def write_neighbor_table(path, keys, neighbors, scores=None):
+    """
+    Write a neighbour table. `keys` need not be sorted; rows are reordered with them.
+    `neighbors` holds ids (not matrix indices), padded with -1.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    neighbors = np.asarray(neighbors, dtype=np.int64)
+    if neighbors.ndim != 2:  # reshape(0, -1) is ambiguous, so 2-D input keeps its K
+        neighbors = neighbors.reshape(len(keys), -1)
+    order = np.argsort(keys, kind="stable")
+
+    keys = keys[order].astype(np.int32)
+    neighbors = np.ascontiguousarray(neighbors[order].astype(np.int32))
+    n, k = neighbors.shape
+    if scores is not None:
+        scores = np.ascontiguousarray(np.asarray(scores).reshape(n, k)[order].astype(np.float16))
+
+    # Header size depends on the offsets it contains; reserve a fixed-width slot
+    header = {"n": int(n), "k": int(k), "has_scores": scores is not None,
+              "keys_offset": 0, "neighbors_offset": 0, "scores_offset": 0}
+    header_len = len(json.dumps(header)) + 64
+    keys_offset = _align(12 + header_len)
+    neighbors_offset = _align(keys_offset + keys.nbytes)
+    scores_offset = _align(neighbors_offset + neighbors.nbytes) if scores is not None else 0
+    header.update(keys_offset=keys_offset, neighbors_offset=neighbors_offset, scores_offset=scores_offset)
+    header_bytes = json.dumps(header).encode("utf-8").ljust(header_len, b" ")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", VERSION))
+        f.write(struct.pack("<I", header_len))
+        f.write(header_bytes)
+        for offset, array in ((keys_offset, keys), (neighbors_offset, neighbors), (scores_offset, scores)):
+            if array is None:
+                continue
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def table_from_dict(recommendations, k=None):
+    """({str id: [ids]}) → (keys, padded neighbour matrix) for write_neighbor_table."""
+    keys = np.array([int(key) for key in recommendations], dtype=np.int64)
+    k = k or max((len(v) for v in recommendations.values()), default=0)
+    neighbors = np.full((len(keys), k), -1, dtype=np.int64)
+    for row, ids in enumerate(recommendations.values()):
+        ids = [int(i) for i in ids[:k]]
+        neighbors[row, :len(ids)] = ids
+    return keys, neighbors
+
+
+class NeighborTable:
+    """Read-only, memory-mapped view of a neighbour table file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic = f.read(8)
+            if magic[:4] != MAGIC:
+                raise ValueError(f"{path} is not a neighbour table")
+            (header_len,) = struct.unpack("<I", f.read(4))
+            self.header = json.loads(f.read(header_len))
+
+        n, k = self.header["n"], self.header["k"]
+        if n == 0 or k == 0:
+            self.keys = np.empty(n, dtype=np.int32)
+            self.neighbors = np.empty((n, k), dtype=np.int32)
+            self.scores = np.empty((n, k), dtype=np.float16) if self.header["has_scores"] else None
+            return
+
+        self.keys = np.memmap(path, dtype=np.int32, mode="r", offset=self.header["keys_offset"], shape=(n,))
+        self.neighbors = np.memmap(path, dtype=np.int32, mode="r",
+                                   offset=self.header["neighbors_offset"], shape=(n, k))
+        self.scores = None
+        if self.header["has_scores"]:
+            self.scores = np.memmap(path, dtype=np.float16, mode="r",
+                                    offset=self.header["scores_offset"], shape=(n, k))
+
+    def __len__(self):
+        return self.header["n"]
+
+    def row(self, key):
+        """Row index of `key` (-1 if absent)."""
+        pos = int(np.searchsorted(self.keys, key))
+        if pos < len(self.keys) and self.keys[pos] == key:
+            return pos
+        return -1
+
+    def get(self, key, with_scores=False):
+        """Neighbour ids of `key` ([] if absent); optionally (ids, scores)."""
+        pos = self.row(int(key))
+        if pos < 0:
+            return ([], []) if with_scores else []
+        ids = self.neighbors[pos]
+        valid = ids >= 0
+        if not with_scores:
+            return ids[valid].tolist()
+        scores = self.scores[pos][valid].astype(np.float32).tolist() if self.scores is not None else []
+        return ids[valid].tolist(), scores
+
+
+def indices_to_ids(ids, indices):
+    """Map a padded matrix-index table to ids, keeping -1 for empty slots."""
+    ids = np.asarray(ids)
+    indices = np.asarray(indices)
+    return np.where(indices >= 0, ids[np.maximum(indices, 0)], -1)
+
+
+def read_table_as_dict(path):
+    """{str key: [ids]} from a neighbour table — the shape of the JSON outputs."""
+    table = NeighborTable(path)
+    return {
+        str(int(key)): row[row >= 0].tolist()
+        for key, row in zip(table.keys, np.asarray(table.neighbors))
+    }
+
+
+def write_outputs(json_path, bin_path, recommendations, keys, neighbors, scores=None,
+                  output_format=None, indent=2):
+    """
+    Write recommendations in the configured OUTPUT_FORMAT:
+    "json" (compatibility), "binary" (neighbour table) or "both".
+    The file of the format not written is removed: the backend prefers a
+    .bin table over the JSON and would otherwise serve a stale one.
+    """
+    output_format = output_format or OUTPUT_FORMAT
+
+    if output_format in ("json", "both"):
+        # Build the payload before truncating the file: it may read the previous contents
+        payload = recommendations() if callable(recommendations) else recommendations
+        with span("write.json"), open(json_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=indent)
+    if output_format in ("binary", "both"):
+        write_neighbor_table(bin_path, keys, neighbors, scores)
+
+    stale = {"json": bin_path, "binary": json_path}.get(output_format)
+    if stale and os.path.exists(stale):
+        os.remove(stale)
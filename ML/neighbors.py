@@ -0,0 +1,184 @@
+import numpy as np
+
+from instrumentation import traced, span, count
+from parallel import map_row_blocks
+
+# ──────────────────────────────────────────────────────────────
+# Streaming top-K neighbour extraction
+# Similarity rows arrive in blocks; each block is reduced to its top-K
+# with argpartition and then discarded, so peak memory is block × N
+# instead of N × N.
+# ──────────────────────────────────────────────────────────────
+
+
+def effective_k(k, n_cols, exclude_self=True):
+    """Number of neighbours that can actually be returned per row."""
+    available = n_cols - 1 if exclude_self else n_cols
+    return max(0, min(int(k), available))
+
+
+@traced("top_k")
+def top_k_block(block, k, row_offset=0, exclude_self=True):
+    """
+    Reduce a dense similarity block to its top-K columns per row.
+
+    `block` holds rows [row_offset, row_offset + len(block)) of a square
+    similarity matrix; when `exclude_self` is set the diagonal entries are
+    ignored. The block is modified in place.
+
+    Returns (indices, scores) of shape (n_rows, k), sorted by descending score.
+    """
+    n_rows, n_cols = block.shape
+    count("rows", n_rows)
+    k = effective_k(k, n_cols, exclude_self)
+    if k == 0 or n_rows == 0:
+        return (
+            np.empty((n_rows, k), dtype=np.int32),
+            np.empty((n_rows, k), dtype=np.float32),
+        )
+
+    rows = np.arange(n_rows)
+    if exclude_self:
+        block[rows, rows + row_offset] = -np.inf
+
+    # Unordered top-K in O(N), then sort only those K entries
+    if k < n_cols:
+        part = np.argpartition(block, n_cols - k, axis=1)[:, n_cols - k:]
+    else:
+        part = np.broadcast_to(np.arange(n_cols), (n_rows, n_cols))
+    part_scores = np.take_along_axis(block, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+
+    indices = np.take_along_axis(part, order, axis=1).astype(np.int32)
+    scores = np.take_along_axis(part_scores, order, axis=1).astype(np.float32)
+    return indices, scores
+
+
+def mask_rated(scores, indptr, indices, start, stop):
+    """Set scores of already-rated items to -inf for users [start, stop), straight from CSR arrays."""
+    row_lengths = np.diff(indptr[start:stop + 1])
+    rows = np.repeat(np.arange(stop - start), row_lengths)
+    cols = indices[indptr[start]:indptr[stop]]
+    scores[rows, cols] = -np.inf
+    return scores
+
+
+def stream_top_k(blocks, n_rows, k, n_cols=None, exclude_self=True):
+    """
+    Consume (start, stop, block) tuples and collect per-row top-K neighbours.
+
+    Only the (n_rows × k) result arrays are kept; each block is dropped as
+    soon as it has been reduced.
+    """
+    n_cols = n_rows if n_cols is None else n_cols
+    k = effective_k(k, n_cols, exclude_self)
+
+    indices = np.full((n_rows, k), -1, dtype=np.int32)
+    scores = np.zeros((n_rows, k), dtype=np.float32)
+
+    for start, stop, block in blocks:
+        block_idx, block_scores = top_k_block(block, k, row_offset=start, exclude_self=exclude_self)
+        indices[start:stop] = block_idx
+        scores[start:stop] = block_scores
+        del block
+
+    return indices, scores
+
+
+@traced("to_dict")
+def neighbors_to_dict(movie_ids, indices):
+    """Map {movieId (str): [neighbour movieIds]} from a neighbour index matrix (-1 = empty slot)."""
+    ids = np.asarray(movie_ids)
+    recommendations = {}
+    for row, movie_id in enumerate(movie_ids):
+        row_idx = indices[row]
+        row_idx = row_idx[row_idx >= 0]
+        recommendations[str(movie_id)] = ids[row_idx].tolist()
+    return recommendations
+
+
+# ──────────────────────────────────────────────────────────────
+# Sparse cosine top-K
+# For sparse inputs (TF-IDF) the product X[block] @ X.T stays sparse,
+# and only its non-zero entries are ranked. Rows with fewer than K
+# non-zero neighbours are padded with -1.
+# ──────────────────────────────────────────────────────────────
+
+@traced("top_k")
+def sparse_top_k_block(product, k, row_offset=0, exclude_self=True, threshold=None):
+    """
+    Top-K per row of a sparse CSR similarity block.
+
+    Entries with score <= `threshold` are dropped before ranking.
+    Returns padded (indices, scores) of shape (n_rows, k).
+    """
+    product = product.tocsr()
+    n_rows = product.shape[0]
+    count("rows", n_rows)
+    count("nnz", product.nnz)
+    indices = np.full((n_rows, k), -1, dtype=np.int32)
+    scores = np.zeros((n_rows, k), dtype=np.float32)
+    if k == 0 or product.nnz == 0:
+        return indices, scores
+
+    rows = np.repeat(np.arange(n_rows), np.diff(product.indptr))
+    cols = product.indices
+    data = product.data
+
+    keep = np.ones(len(data), dtype=bool)
+    if exclude_self:
+        keep &= cols != rows + row_offset
+    if threshold is not None:
+        keep &= data > threshold
+    rows, cols, data = rows[keep], cols[keep], data[keep]
+
+    # Sort by row, then by descending score; rank = position within the row
+    order = np.lexsort((-data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    row_starts = np.searchsorted(rows, np.arange(n_rows))
+    rank = np.arange(len(rows)) - row_starts[rows]
+
+    top = rank < k
+    indices[rows[top], rank[top]] = cols[top]
+    scores[rows[top], rank[top]] = data[top]
+    return indices, scores
+
+
+def sparse_cosine_worker(arrays, start, stop, k, threshold=None, exclude_self=True):
+    """Row-block worker: sparse cosine products for rows [start, stop) reduced to top-K."""
+    matrix = arrays["matrix"]
+    with span("similarity"):
+        product = matrix[start:stop] @ matrix.T
+        count("nnz", product.nnz)
+    return sparse_top_k_block(
+        product, k, row_offset=start, exclude_self=exclude_self, threshold=threshold
+    )
+
+
+def sparse_cosine_top_k(matrix, k, block_size, threshold=None, exclude_self=True, n_jobs=None):
+    """
+    Cosine top-K neighbours of every row of a sparse matrix, computed as
+    L2-normalized sparse × sparseᵀ products `block_size` rows at a time.
+    """
+    from sklearn.preprocessing import normalize
+
+    matrix = normalize(matrix.tocsr(), norm="l2", copy=True)
+    n_rows = matrix.shape[0]
+    k = effective_k(k, n_rows, exclude_self)
+
+    results = map_row_blocks(
+        sparse_cosine_worker,
+        {"matrix": matrix},
+        n_rows=n_rows,
+        block_size=block_size,
+        n_jobs=n_jobs,
+        k=k,
+        threshold=threshold,
+        exclude_self=exclude_self,
+    )
+    if not results:
+        return np.full((0, k), -1, dtype=np.int32), np.zeros((0, k), dtype=np.float32)
+
+    indices = np.vstack([idx for idx, _ in results])
+    scores = np.vstack([sc for _, sc in results])
+    return indices, scores
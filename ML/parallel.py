@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from scipy.sparse import issparse
+
+from artifacts import save_dense, load_dense, save_sparse, load_sparse
+from instrumentation import span, count, enable
+from config import CACHE_DIR, N_JOBS
+
+# ──────────────────────────────────────────────────────────────
+# Parallel row-block execution
+# The row space is split into blocks and handed to a process pool.
+# Feature matrices are written once as .npy files and memory-mapped by
+# every worker (sparse matrices as data/indices/indptr), so nothing large
+# is pickled and all workers share one page-cache copy.
+#
+# A worker is a module-level function: worker(arrays, start, stop, **kwargs)
+# With n_jobs == 1 it is called in-process on the original arrays.
+# ──────────────────────────────────────────────────────────────
+
+_SHARED_CACHE = {}  # per-process: shared dir → loaded arrays
+
+
+def resolve_n_jobs(n_jobs=None):
+    """Translate the configured worker count (<= 0 means all cores) into a positive integer."""
+    n_jobs = N_JOBS if n_jobs is None else int(n_jobs)
+    if n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+    return n_jobs
+
+
+def share_arrays(arrays, directory):
+    """Write dense/CSR arrays to `directory` as .npy files and return a picklable spec."""
+    spec = {"dir": directory, "arrays": {}}
+    for name, value in arrays.items():
+        path = os.path.join(directory, name)
+        if issparse(value):
+            save_sparse(path, value)
+            spec["arrays"][name] = "csr"
+        else:
+            save_dense(path, value)
+            spec["arrays"][name] = "dense"
+    return spec
+
+
+def load_shared(spec):
+    """Memory-map the arrays described by `spec` (cached per process)."""
+    directory = spec["dir"]
+    if directory in _SHARED_CACHE:
+        return _SHARED_CACHE[directory]
+
+    arrays = {}
+    for name, kind in spec["arrays"].items():
+        path = os.path.join(directory, name)
+        arrays[name] = load_sparse(path) if kind == "csr" else load_dense(path)
+
+    _SHARED_CACHE.clear()
+    _SHARED_CACHE[directory] = arrays
+    return arrays
+
+
+def _init_worker():
+    """Keep BLAS single-threaded inside workers to avoid oversubscribing cores."""
+    enable(False)  # forked workers inherit the parent's open spans; their timings are not collected
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+
+def _run_block(worker, spec, start, stop, kwargs):
+    return worker(load_shared(spec), start, stop, **kwargs)
+
+
+def row_blocks(n_rows, block_size):
+    """List of (start, stop) covering [0, n_rows) in blocks of `block_size`."""
+    block_size = max(1, int(block_size))
+    return [(start, min(start + block_size, n_rows)) for start in range(0, n_rows, block_size)]
+
+
+def map_row_blocks(worker, arrays, n_rows, block_size, n_jobs=None, **kwargs):
+    """
+    Run `worker` over every row block and return the results in block order.
+    Results are identical for any n_jobs; only wall-clock time changes.
+    """
+    blocks = row_blocks(n_rows, block_size)
+    n_jobs = min(resolve_n_jobs(n_jobs), len(blocks)) if blocks else 1
+    count("blocks", len(blocks))
+
+    if n_jobs <= 1:
+        return [worker(arrays, start, stop, **kwargs) for start, stop in blocks]
+
+    # Spans inside pool workers stay in the workers: only the pool as a whole is timed
+    directory = tempfile.mkdtemp(prefix="shared_", dir=CACHE_DIR)
+    try:
+        with span("share_arrays"):
+            spec = share_arrays(arrays, directory)
+        with span("pool"), ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker) as pool:
+            count("workers", n_jobs)
+            futures = [
+                pool.submit(_run_block, worker, spec, start, stop, kwargs)
+                for start, stop in blocks
+            ]
+            return [future.result() for future in futures]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
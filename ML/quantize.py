@@ -0,0 +1,255 @@
+"""
+Quantized SVD factors for serving.
+
+U·Σ (one row per user) and V = Vtᵀ (one row per movie) are stored next to
+the float32 artifacts in a smaller representation:
+    int8      per-row scale: x ≈ codes · scale, codes in [-127, 127]   (~4× smaller)
+    float16   half precision                                          (2× smaller)
+
+Files (MODEL_DIR/quantized/):
+    US.<mode>.codes.npy / US.<mode>.scales.npy   (scales for int8 only)
+    V.<mode>.codes.npy  / V.<mode>.scales.npy
+    report.json                                  overlap@20 vs float32, sizes, timings
+
+With ML_QUANT_SERVING=1, recommender_service.py scans every movie with the
+quantized factors (dequantizing SCAN_BLOCK movies per GEMM), keeps the best
+N × QUANT_RERANK_FACTOR and re-ranks only those with the float32 U, Σ and
+Vt, which stay memory-mapped and are read for the candidates alone.
+
+Run (from ML/, after collaborative_svd.py):
+    python quantize.py                   # FACTOR_QUANTIZATION (ML_FACTOR_QUANTIZATION) + report
+    python quantize.py --mode float16
+    python quantize.py --report          # overlap@20 report for the stored factors
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from artifacts import save_dense, load_dense, load_sparse, sparse_exists
+from instrumentation import traced, count, stage_trace
+from neighbors import top_k_block, mask_rated
+from config import (
+    QUANT_DIR,
+    FACTOR_QUANTIZATION,
+    QUANT_RERANK_FACTOR,
+    SVD_U_PATH,
+    SVD_SIGMA_PATH,
+    SVD_Vt_PATH,
+    SVD_RATINGS_PATH,
+)
+
+QUANT_MODES = ("int8", "float16")
+INT8_MAX = 127
+SCAN_BLOCK = 4096       # rows dequantized per GEMM: the float32 block stays in cache
+REPORT_USERS = 1000
+REPORT_K = 20
+
+
+def quant_prefix(name, mode=FACTOR_QUANTIZATION):
+    """MODEL_DIR/quantized/<name>.<mode> — name is "US" or "V"."""
+    return os.path.join(QUANT_DIR, f"{name}.{mode}")
+
+
+class QuantizedMatrix:
+    """Row-quantized matrix: X[i] ≈ codes[i] · scales[i] (int8) or codes[i] (float16)."""
+
+    def __init__(self, codes, scales=None):
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def mode(self):
+        return "int8" if self.codes.dtype == np.int8 else "float16"
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def quantize(cls, X, mode=FACTOR_QUANTIZATION, block_size=SCAN_BLOCK):
+        """Quantize the rows of a dense float matrix, `block_size` rows at a time."""
+        if mode not in QUANT_MODES:
+            raise ValueError(f"unknown quantization mode: {mode}")
+        n_rows = X.shape[0]
+        codes = np.empty(X.shape, dtype=np.int8 if mode == "int8" else np.float16)
+        scales = np.empty(n_rows, dtype=np.float32) if mode == "int8" else None
+
+        for start in range(0, n_rows, block_size):
+            block = np.asarray(X[start:start + block_size], dtype=np.float32)
+            if mode == "float16":
+                codes[start:start + len(block)] = block
+                continue
+            scale = np.abs(block).max(axis=1) / INT8_MAX
+            scale[scale == 0] = 1.0
+            codes[start:start + len(block)] = np.rint(block / scale[:, None])
+            scales[start:start + len(block)] = scale
+        return cls(codes, scales)
+
+    def rows(self, rows):
+        """Dequantized float32 rows."""
+        X = np.asarray(self.codes[rows], dtype=np.float32)
+        if self.scales is not None:
+            X *= np.asarray(self.scales[rows])[:, None]
+        return X
+
+    def scores(self, queries, block_size=SCAN_BLOCK):
+        """queries · rowsᵀ (len(queries) × n_rows float32), dequantizing one row block per GEMM."""
+        queries = np.asarray(queries, dtype=np.float32)
+        n_rows = self.shape[0]
+        out = np.empty((len(queries), n_rows), dtype=np.float32)
+        buffer = np.empty((min(block_size, n_rows), self.shape[1]), dtype=np.float32)
+        for start in range(0, n_rows, block_size):
+            stop = min(start + block_size, n_rows)
+            block = buffer[:stop - start]
+            np.copyto(block, self.codes[start:stop], casting="unsafe")
+            np.matmul(queries, block.T, out=out[:, start:stop])
+            if self.scales is not None:
+                out[:, start:stop] *= self.scales[start:stop]
+        count("scanned", len(queries) * n_rows)
+        return out
+
+    def save(self, prefix):
+        save_dense(prefix + ".codes", self.codes)
+        if self.scales is not None:
+            save_dense(prefix + ".scales", self.scales, dtype=np.float32)
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        """Memory-map codes written by save(); scales are small and read into memory."""
+        codes = load_dense(prefix + ".codes", mmap=mmap)
+        scales = np.asarray(load_dense(prefix + ".scales")) if codes.dtype == np.int8 else None
+        return cls(codes, scales)
+
+
+# ──────────────────────────────────────────────────────────────
+# Scoring
+# ──────────────────────────────────────────────────────────────
+
+@traced("quantized_top_k")
+def quantized_top_k(V_q, Vt, queries, exact, k, R=None, rerank_factor=QUANT_RERANK_FACTOR):
+    """
+    Top-k movie columns per query. All movies are scored with the quantized
+    item factors `V_q`; the best k × rerank_factor are re-scored with the
+    float32 U·Σ rows `exact` against the float32 `Vt` columns (rerank_factor
+    ≤ 1: no re-rank). `R` masks rated movies. Returns (indices, scores).
+    """
+    scores = V_q.scores(queries)
+    if R is not None:
+        mask_rated(scores, R.indptr, R.indices, 0, R.shape[0])
+    if rerank_factor <= 1:
+        return top_k_block(scores, k, exclude_self=False)
+
+    candidates, approx = top_k_block(scores, min(k * rerank_factor, scores.shape[1]), exclude_self=False)
+    count("reranked", candidates.size)
+    columns = np.asarray(Vt[:, candidates.ravel()], dtype=np.float32).reshape(Vt.shape[0], *candidates.shape)
+    rescored = np.einsum("qf,fqc->qc", np.asarray(exact, dtype=np.float32), columns)
+    rescored[~np.isfinite(approx)] = -np.inf
+
+    order, top_scores = top_k_block(rescored, k, exclude_self=False)
+    return np.take_along_axis(candidates, order, axis=1), top_scores
+
+
+# ──────────────────────────────────────────────────────────────
+# Build + overlap report
+# ──────────────────────────────────────────────────────────────
+
+def overlap(a, b, k):
+    return float(np.mean([len(set(x.tolist()) & set(y.tolist())) for x, y in zip(a, b)])) / k
+
+
+@traced("overlap_report")
+def overlap_report(US, Vt, R, US_q, V_q, k=REPORT_K, n_users=REPORT_USERS, seed=0):
+    """
+    overlap@k of the quantized top-k (scan only, and re-ranked) with the
+    float32 top-k for a sample of users, plus the mean time per user.
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(US.shape[0], min(n_users, US.shape[0]), replace=False))
+    R_rows = R[rows] if R is not None else None
+    exact = np.asarray(US[rows], dtype=np.float32)
+    k = min(k, Vt.shape[1])
+
+    start = time.perf_counter()
+    scores = exact @ np.asarray(Vt, dtype=np.float32)
+    if R_rows is not None:
+        mask_rated(scores, R_rows.indptr, R_rows.indices, 0, len(rows))
+    reference, _ = top_k_block(scores, k, exclude_self=False)
+    float_ms = 1000 * (time.perf_counter() - start) / len(rows)
+
+    report = {"k": k, "users": len(rows), "float32_ms_per_user": round(float_ms, 3)}
+    for name, factor in (("scan", 1), ("rerank", QUANT_RERANK_FACTOR)):
+        start = time.perf_counter()
+        top, _ = quantized_top_k(V_q, Vt, US_q.rows(rows), exact, k, R_rows, rerank_factor=factor)
+        elapsed = 1000 * (time.perf_counter() - start) / len(rows)
+        report[f"{name}_overlap_at_k"] = round(overlap(top, reference, k), 4)
+        report[f"{name}_ms_per_user"] = round(elapsed, 3)
+    report["rerank_factor"] = QUANT_RERANK_FACTOR
+    return report
+
+
+def run(build=True, mode=FACTOR_QUANTIZATION):
+    """Quantize the trained SVD factors and report overlap@K against float32."""
+    print(f"Factor quantization ({mode}) started..." if build else f"Quantized factor report ({mode})...")
+    try:
+        U = load_dense(SVD_U_PATH)
+        Sigma = load_dense(SVD_SIGMA_PATH, mmap=False)
+        Vt = load_dense(SVD_Vt_PATH)
+    except FileNotFoundError:
+        print("❌ SVD model not found. Run collaborative_svd.py first.")
+        return
+    R = load_sparse(SVD_RATINGS_PATH) if sparse_exists(SVD_RATINGS_PATH) else None
+    US = np.asarray(U * Sigma, dtype=np.float32)
+
+    if build:
+        start = time.time()
+        US_q = QuantizedMatrix.quantize(US, mode)
+        V_q = QuantizedMatrix.quantize(np.asarray(Vt).T, mode)
+        os.makedirs(QUANT_DIR, exist_ok=True)
+        US_q.save(quant_prefix("US", mode))
+        V_q.save(quant_prefix("V", mode))
+        print(f"→ Quantized {US_q.shape[0]:,} users and {V_q.shape[0]:,} movies in {time.time() - start:.1f}s")
+    else:
+        try:
+            US_q = QuantizedMatrix.load(quant_prefix("US", mode))
+            V_q = QuantizedMatrix.load(quant_prefix("V", mode))
+        except FileNotFoundError:
+            print(f"❌ No {mode} factors found. Run quantize.py --mode {mode} first.")
+            return
+
+    float_bytes = US.nbytes + Vt.shape[0] * Vt.shape[1] * 4
+    quant_bytes = US_q.nbytes + V_q.nbytes
+    report = overlap_report(US, Vt, R, US_q, V_q)
+    report.update(mode=mode, float32_mb=round(float_bytes / 2 ** 20, 2), quantized_mb=round(quant_bytes / 2 ** 20, 2))
+
+    print(f"→ U·Σ + V: {report['float32_mb']:,.1f} MB float32 → {report['quantized_mb']:,.1f} MB {mode} "
+          f"({float_bytes / quant_bytes:.1f}× smaller)")
+    print(f"→ overlap@{report['k']} vs float32 ({report['users']:,} users): "
+          f"scan {report['scan_overlap_at_k']:.3f}, re-ranked ×{QUANT_RERANK_FACTOR} {report['rerank_overlap_at_k']:.3f}")
+    print(f"→ ms/user: float32 {report['float32_ms_per_user']:.3f}, scan {report['scan_ms_per_user']:.3f}, "
+          f"scan + re-rank {report['rerank_ms_per_user']:.3f}")
+
+    os.makedirs(QUANT_DIR, exist_ok=True)
+    with open(os.path.join(QUANT_DIR, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Quantized factors ready → {QUANT_DIR}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize the SVD factors and report overlap@K vs float32.")
+    parser.add_argument("--mode", choices=QUANT_MODES, default=FACTOR_QUANTIZATION)
+    parser.add_argument("--report", action="store_true", help="only report for the stored factors")
+    args = parser.parse_args()
+    with stage_trace("quantize"):
+        run(build=not args.report, mode=args.mode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,554 @@
+"""
+Long-lived collaborative recommender.
+
+Loads the SVD artifacts once and serves single or batch requests from memory.
+Can run as a local JSON endpoint for the Node backend:
+
+    python recommender_service.py --http --port 8765
+        GET  /recommend?userId=1&n=20
+        POST /recommend/batch   {"userIds": [1, 2, 3], "n": 20}
+        POST /fold-in           {"userId": 99, "ratings": {"1": 4.5, "50": 3}, "n": 20}
+                                {"users": {"99": {"1": 4.5}, "100": {"2": 5}}, "n": 20}
+        POST /merge             append folded-in users to the stored factors
+        GET  /health
+
+    python recommender_service.py --stdio
+        one JSON request per line: {"userId": 1, "n": 20}, {"userIds": [1, 2], "n": 20}
+        or a fold-in request as above, or {"merge": true}
+
+Users outside the trained model (new signups, users beyond MAX_USERS_TO_SAVE)
+are folded in: their rating vector r is projected into the latent space
+(r · V, the U·Σ row the SVD would give them) or solved by ridge regression,
+without retraining. Folded-in users are served from memory and can be merged
+into the stored factors periodically (--merge-interval) or on request.
+
+With --user-shards / --item-shards the service loads only those shards of a
+sharded model (shards.py): it answers for the users hashed to its user
+shards, over the movies of its item shards. Folded-in users are then kept in
+memory only; the shard files are rewritten by collaborative_svd.py.
+
+With ML_ANN_SERVING=1 and an index built by ann.py, top-N lists come from
+the IVF index over the item factors instead of scoring every movie. With
+ML_QUANT_SERVING=1 and factors written by quantize.py, every movie is scored
+with the int8 / float16 factors and only the best candidates are re-ranked
+with the float32 ones (which then stay memory-mapped instead of copied).
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+from artifacts import (
+    load_dense, load_ids, load_sparse, sparse_exists, ids_to_index,
+    save_dense, save_ids, save_sparse,
+)
+from neighbors import top_k_block, mask_rated
+from ann import IVFIndex, index_dir
+from shards import load_shards, read_manifest
+from als import fold_in as als_fold_in
+from quantize import QuantizedMatrix, quant_prefix, quantized_top_k
+from config import (
+    TOP_N_USER,
+    SVD_U_PATH,
+    SVD_SIGMA_PATH,
+    SVD_Vt_PATH,
+    SVD_RATINGS_PATH,
+    SVD_META_PATH,
+    USER_IDS_PATH,
+    MOVIE_IDS_PATH,
+    RECOMMENDER_HOST,
+    RECOMMENDER_PORT,
+    FOLD_IN_METHOD,
+    FOLD_IN_REG,
+    FOLD_IN_MERGE_INTERVAL,
+    ANN_NPROBE,
+    ANN_SERVING,
+    QUANT_SERVING,
+)
+
+FOLD_IN_CHUNK = 256  # users per batched ridge solve
+
+
+class RecommenderService:
+    """In-memory SVD recommender: precomputed U·Σ, memory-mapped Vt and sorted id arrays."""
+
+    sharded = False  # loaded from shards: merged users are not written back
+
+    def __init__(self, U, Sigma, Vt, user_ids, movie_ids, R=None, ann=None, quantized=None, model=None):
+        self.Sigma = np.asarray(Sigma, dtype=np.float32)
+        self.model = model or {"engine": "svd"}  # svd_meta.json: engine + hyper-parameters
+
+        # Optional quantized (U·Σ, V) pair: scanned instead of the float32 factors,
+        # which are then only read (memory-mapped) to re-rank candidates
+        self.US_q, self.V_q = quantized or (None, None)
+        self.U = U
+        self.US = None if self.V_q is not None else np.ascontiguousarray(U * Sigma, dtype=np.float32)
+        self.Vt = Vt if Vt.dtype == np.float32 else np.asarray(Vt, dtype=np.float32)
+
+        # Sorted id arrays: userId → row by binary search, column → movieId by indexing
+        self.user_ids = np.asarray(user_ids)
+        self.idx_to_movie = np.asarray(movie_ids)
+
+        self.R = R.tocsr() if R is not None else None
+
+        # Folded-in users: userId → (U·Σ row, rated-movie CSR row), until merged
+        self.folded = {}
+        self._lock = threading.Lock()
+
+        # Optional IVF index over Vt.T·Σ; PQ codes are re-ranked with the exact factors
+        self.ann = ann
+        self.ann_rerank = None
+        if ann is not None and ann.codes is not None:
+            self.ann_rerank = np.ascontiguousarray(self.Vt.T * self.Sigma, dtype=np.float32)
+
+    @classmethod
+    def load(cls, user_shards=None, item_shards=None):
+        """
+        Memory-map the trained SVD artifacts from MODEL_DIR, or only the given
+        user / item shards of the sharded model (None for both = monolithic).
+        """
+        sharded = user_shards is not None or item_shards is not None
+        model = None
+        try:
+            if sharded:
+                U, Sigma, Vt, user_ids, movie_ids, R = load_shards(user_shards, item_shards)
+                model = read_manifest().get("model")
+            else:
+                U = load_dense(SVD_U_PATH)
+                Sigma = load_dense(SVD_SIGMA_PATH)
+                Vt = load_dense(SVD_Vt_PATH)
+                user_ids = load_ids(USER_IDS_PATH)
+                movie_ids = load_ids(MOVIE_IDS_PATH)
+                # Older models have no rating matrix: serve without masking rated items
+                R = load_sparse(SVD_RATINGS_PATH) if sparse_exists(SVD_RATINGS_PATH) else None
+                if os.path.exists(SVD_META_PATH):
+                    with open(SVD_META_PATH, "r", encoding="utf-8") as f:
+                        model = json.load(f)
+        except FileNotFoundError as e:
+            if sharded:
+                raise RuntimeError(f"Sharded SVD model incomplete: {e}. Run collaborative_svd.py with ML_USER_SHARDS.")
+            raise RuntimeError("SVD model not found. Run collaborative_svd.py first.")
+
+        ann = None
+        if ANN_SERVING and not sharded:
+            try:
+                ann = IVFIndex.load(index_dir("svd_items"))
+            except FileNotFoundError:
+                print("⚠️  ANN index not found — scoring every movie. Run ann.py first.", file=sys.stderr)
+
+        quantized = None
+        if QUANT_SERVING and not sharded:
+            try:
+                quantized = (QuantizedMatrix.load(quant_prefix("US")), QuantizedMatrix.load(quant_prefix("V")))
+            except FileNotFoundError:
+                print("⚠️  Quantized factors not found — scoring float32 factors. Run quantize.py first.",
+                      file=sys.stderr)
+            else:
+                if quantized[0].shape != U.shape or quantized[1].shape != Vt.T.shape:
+                    print("⚠️  Quantized factors do not match the SVD model — scoring float32 factors. "
+                          "Run quantize.py again.", file=sys.stderr)
+                    quantized = None
+
+        service = cls(U, Sigma, Vt, user_ids, movie_ids, R, ann, quantized, model)
+        service.sharded = sharded
+        return service
+
+    @property
+    def n_users(self):
+        return len(self.user_ids)
+
+    @property
+    def n_movies(self):
+        return self.Vt.shape[1]
+
+    def _user_state(self):
+        """
+        (user_ids, U, US, US_q, R) as one consistent set. merge_folded swaps
+        them together under the lock, so request threads score from a snapshot
+        and never mix rows of the old and the merged model.
+        """
+        with self._lock:
+            return self._user_state_locked()
+
+    def _user_state_locked(self):
+        return self.user_ids, self.U, self.US, self.US_q, self.R
+
+    def _user_vectors(self, rows, state):
+        """Float32 U·Σ rows (from the memory-mapped U when serving quantized factors)."""
+        _, U, US, _, _ = state
+        if US is not None:
+            return US[rows]
+        return np.asarray(U[rows], dtype=np.float32) * self.Sigma
+
+    def _score_rows(self, rows, state, exclude_rated=True):
+        _, _, US, _, R = state
+        return self._score_vectors(US[rows], R[rows] if exclude_rated and R is not None else None)
+
+    def _top_movies(self, scores, top_n):
+        """Ranked movieId lists for each score row (masked -inf entries dropped)."""
+        return self._to_movies(*top_k_block(scores, min(top_n, self.n_movies), exclude_self=False))
+
+    def _to_movies(self, top, top_scores):
+        return [self.idx_to_movie[idx[np.isfinite(sc)]].tolist() for idx, sc in zip(top, top_scores)]
+
+    def _quantized_top_movies(self, queries, US, R, top_n):
+        """Ranked movieId lists: quantized scan with `queries`, float32 re-rank with the U·Σ rows `US`."""
+        return self._to_movies(*quantized_top_k(self.V_q, self.Vt, queries, US, min(top_n, self.n_movies), R))
+
+    def _ann_top_movies(self, US, R, top_n):
+        """
+        Ranked movieId lists from the ANN index for U·Σ rows. Queries are U rows
+        (the index holds Vt.T·Σ); extra results are fetched to drop rated movies.
+        """
+        Sigma = np.where(self.Sigma == 0, 1.0, self.Sigma)
+        n_rated = np.diff(R.indptr) if R is not None else np.zeros(len(US), dtype=np.int64)
+        k = min(self.n_movies, top_n + int(n_rated.max(initial=0)))
+        ids, _ = self.ann.search(US / Sigma, k, ANN_NPROBE, rerank=self.ann_rerank)
+
+        results = []
+        for row, movies in enumerate(ids):
+            movies = movies[movies >= 0]
+            if R is not None:
+                rated = self.idx_to_movie[R.indices[R.indptr[row]:R.indptr[row + 1]]]
+                movies = movies[~np.isin(movies, rated)]
+            results.append(movies[:top_n].tolist())
+        return results
+
+    def _recommend_vectors(self, US, R, top_n):
+        """Top-N movieId lists for U·Σ rows, excluding the movies rated in `R` (if given)."""
+        if self.ann is not None:
+            return self._ann_top_movies(US, R, top_n)
+        if self.V_q is not None:
+            return self._quantized_top_movies(US, US, R, top_n)
+        return self._top_movies(self._score_vectors(US, R), top_n)
+
+    def recommend(self, user_id, top_n=TOP_N_USER, exclude_rated=True):
+        """Top-N movieIds for one user ([] if the user is unknown)."""
+        return self.recommend_batch([user_id], top_n, exclude_rated).get(int(user_id), [])
+
+    def recommend_batch(self, user_ids, top_n=TOP_N_USER, exclude_rated=True):
+        """
+        {userId: [movieIds]} for every known user in `user_ids`, scored with one GEMM.
+        Folded-in users are served from memory (taking precedence over their
+        trained row until merged); unknown users are left out.
+        """
+        requested = np.asarray([int(uid) for uid in user_ids], dtype=np.int64)
+        with self._lock:
+            folded = [(uid, self.folded[uid]) for uid in requested.tolist() if uid in self.folded]
+            state = self._user_state_locked()
+        user_index, _, _, US_q, R_all = state
+        is_folded = np.isin(requested, [uid for uid, _ in folded])
+        positions = ids_to_index(user_index, requested)
+        found = (positions >= 0) & ~is_folded
+
+        results = {}
+        if found.any():
+            rows = positions[found]
+            R = R_all[rows] if exclude_rated and R_all is not None else None
+            if self.ann is not None:
+                movies = self._ann_top_movies(self._user_vectors(rows, state), R, top_n)
+            elif self.V_q is not None:
+                movies = self._quantized_top_movies(US_q.rows(rows), self._user_vectors(rows, state), R, top_n)
+            else:
+                movies = self._top_movies(self._score_rows(rows, state, exclude_rated), top_n)
+            results.update(zip(requested[found].tolist(), movies))
+
+        if folded:
+            US = np.vstack([row for _, (row, _) in folded])
+            R = vstack([rated for _, (_, rated) in folded]).tocsr() if exclude_rated else None
+            results.update(zip([uid for uid, _ in folded], self._recommend_vectors(US, R, top_n)))
+        return results
+
+    # ── Fold-in ─────────────────────────────────────────────────
+
+    def ratings_matrix(self, ratings):
+        """CSR (len(ratings) × n_movies) from [{movieId: rating}, ...]; unknown movies are ignored."""
+        rows, movies, values = [], [], []
+        for row, user_ratings in enumerate(ratings):
+            for movie_id, rating in user_ratings.items():
+                rows.append(row)
+                movies.append(int(movie_id))
+                values.append(float(rating))
+
+        cols = ids_to_index(self.idx_to_movie, np.asarray(movies, dtype=np.int64))
+        known = cols >= 0
+        R = csr_matrix(
+            (np.asarray(values, dtype=np.float32)[known], (np.asarray(rows, dtype=np.int64)[known], cols[known])),
+            shape=(len(ratings), self.n_movies),
+            dtype=np.float32,
+        )
+        R.sum_duplicates()
+        return R
+
+    def fold_in(self, R, method=FOLD_IN_METHOD, reg=FOLD_IN_REG):
+        """
+        Latent U·Σ rows for the rating rows of `R` (users × movies CSR), without retraining.
+          projection: r · V — exactly the row the SVD assigns a training user
+          ridge:      argmin_p ‖r_obs − V_obs·p‖² + reg·‖p‖², one batched solve per chunk
+        ALS models always use the exact implicit-ALS user solve, the step training repeats.
+        """
+        if self.model.get("engine") == "als":
+            return als_fold_in(R, self.Vt, self.model["reg"], self.model["alpha"])
+        V = self.Vt.T
+        if method == "projection":
+            return np.asarray(R @ V, dtype=np.float32)
+        if method != "ridge":
+            raise ValueError(f"unknown fold-in method: {method}")
+
+        n_factors = V.shape[1]
+        US = np.zeros((R.shape[0], n_factors), dtype=np.float32)
+        for start in range(0, R.shape[0], FOLD_IN_CHUNK):
+            chunk = R[start:start + FOLD_IN_CHUNK]
+            rated = np.flatnonzero(np.diff(chunk.indptr))
+            if len(rated) == 0:
+                continue
+            factors = np.asarray(V[chunk.indices], dtype=np.float64)          # nnz × k
+            outer = factors[:, :, None] * factors[:, None, :]                # nnz × k × k
+            gram = np.add.reduceat(outer, chunk.indptr[rated], axis=0)       # users × k × k
+            gram += reg * np.eye(n_factors)
+            rhs = np.asarray(chunk[rated] @ V, dtype=np.float64)
+            US[start + rated] = np.linalg.solve(gram, rhs[:, :, None])[:, :, 0]
+        return US
+
+    def _score_vectors(self, US, R=None):
+        scores = US @ self.Vt
+        if R is not None:
+            mask_rated(scores, R.indptr, R.indices, 0, R.shape[0])
+        return scores
+
+    def recommend_for_matrix(self, R, top_n=TOP_N_USER, method=FOLD_IN_METHOD):
+        """Fold in the rating rows of `R` (users × n_movies CSR) and return their ranked movieId lists."""
+        return self._recommend_vectors(self.fold_in(R, method), R, top_n)
+
+    def recommend_for_ratings(self, ratings, top_n=TOP_N_USER, user_ids=None, method=FOLD_IN_METHOD):
+        """
+        Fold in one rating dict per user and return their ranked movieId lists.
+        With `user_ids` the folded users are also kept for recommend() until merged.
+        """
+        R = self.ratings_matrix(ratings)
+        US = self.fold_in(R, method)
+        recommendations = self._recommend_vectors(US, R, top_n)
+
+        if user_ids is not None:
+            with self._lock:
+                for row, uid in enumerate(user_ids):
+                    self.folded[int(uid)] = (US[row:row + 1], R[row])
+        return recommendations
+
+    def merge_folded(self, save=True):
+        """
+        Append folded-in users to the model (replacing rows of users already in it)
+        and, with `save`, rewrite the user-side artifacts. Returns the number merged.
+        """
+        with self._lock:
+            if not self.folded:
+                return 0
+            new_ids = np.array(sorted(self.folded), dtype=np.int64)
+            US_new = np.vstack([self.folded[uid][0] for uid in new_ids.tolist()])
+            R_new = vstack([self.folded[uid][1] for uid in new_ids.tolist()]).tocsr()
+
+            keep = ~np.isin(self.user_ids, new_ids)
+            ids = np.concatenate([np.asarray(self.user_ids, dtype=np.int64)[keep], new_ids])
+            order = np.argsort(ids, kind="stable")
+            US = np.vstack([self._user_vectors(np.flatnonzero(keep), self._user_state_locked()), US_new])[order]
+            R = vstack([self.R[np.flatnonzero(keep)], R_new]).tocsr()[order] if self.R is not None else None
+            Sigma = np.where(self.Sigma == 0, 1.0, self.Sigma)
+            US_q = QuantizedMatrix.quantize(US, self.US_q.mode) if self.US_q is not None else None
+
+            if save and not self.sharded:
+                save_dense(SVD_U_PATH, US / Sigma, dtype=np.float32)
+                save_ids(USER_IDS_PATH, ids[order])
+                if R is not None:
+                    save_sparse(SVD_RATINGS_PATH, R)
+                if US_q is not None:
+                    US_q.save(quant_prefix("US", US_q.mode))
+
+            # Every user-side array changes in this one locked step (see _user_state)
+            if US_q is not None:
+                self.U, self.US_q = (US / Sigma).astype(np.float32), US_q
+            else:
+                self.U, self.US = (US / Sigma).astype(np.float32), np.ascontiguousarray(US)
+            self.user_ids, self.R = ids[order], R
+            merged = len(new_ids)
+            self.folded.clear()
+        return merged
+
+    def handle(self, request):
+        """
+        Answer one JSON request dict (single or batch, lookup or fold-in).
+        Raises ValueError for a request of the wrong shape.
+        """
+        if not isinstance(request, dict):
+            raise ValueError("expected a JSON object")
+        top_n = int(request.get("n", TOP_N_USER))
+        if request.get("merge"):
+            return {"merged": self.merge_folded()}
+        if "users" in request:
+            users = request["users"]
+            if not isinstance(users, dict) or not all(isinstance(r, dict) for r in users.values()):
+                raise ValueError('"users" must map userId to {movieId: rating}')
+            user_ids = [int(uid) for uid in users]
+            recs = self.recommend_for_ratings(list(users.values()), top_n, user_ids=user_ids)
+            return {"recommendations": dict(zip(map(str, user_ids), recs))}
+        if "ratings" in request:
+            if not isinstance(request["ratings"], dict):
+                raise ValueError('"ratings" must map movieId to rating')
+            user_ids = [int(request["userId"])] if "userId" in request else None
+            movies = self.recommend_for_ratings([request["ratings"]], top_n, user_ids=user_ids)[0]
+            return {"userId": user_ids[0] if user_ids else None, "movies": movies}
+        if "userIds" in request:
+            if not isinstance(request["userIds"], list):
+                raise ValueError('"userIds" must be a list')
+            recs = self.recommend_batch(request["userIds"], top_n)
+            return {"recommendations": {str(uid): movies for uid, movies in recs.items()}}
+        if "userId" in request:
+            user_id = int(request["userId"])
+            return {"userId": user_id, "movies": self.recommend(user_id, top_n)}
+        return {"error": "expected userId or userIds"}
+
+
+# ──────────────────────────────────────────────────────────────
+# Local endpoints
+# ──────────────────────────────────────────────────────────────
+
+def serve_stdio(service, stdin=sys.stdin, stdout=sys.stdout):
+    """Read one JSON request per line and write one JSON response per line."""
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            response = service.handle(json.loads(line))
+        except Exception as e:
+            response = {"error": str(e)}
+        stdout.write(json.dumps(response) + "\n")
+        stdout.flush()
+
+
+# Errors a malformed request raises from handle(): answered 400, anything else 500
+BAD_REQUEST_ERRORS = (ValueError, TypeError, KeyError, AttributeError)
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _answer(self, call):
+            try:
+                self._send(200, call())
+            except BAD_REQUEST_ERRORS as e:
+                self._send(400, {"error": str(e)})
+            except Exception as e:
+                print(f"⚠️  Request failed: {e!r}", file=sys.stderr)
+                self._send(500, {"error": "internal error"})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path == "/health":
+                self._send(200, {"status": "ok", "users": service.n_users, "movies": service.n_movies})
+            elif url.path == "/recommend" and "userId" in query:
+                self._answer(lambda: service.handle(query))
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            if path == "/merge":
+                self._answer(lambda: {"merged": service.merge_folded()})
+                return
+            if path not in ("/recommend/batch", "/fold-in"):
+                self._send(404, {"error": "not found"})
+                return
+
+            def answer():
+                length = int(self.headers.get("Content-Length", 0))
+                return service.handle(json.loads(self.rfile.read(length) or b"{}"))
+
+            self._answer(answer)
+
+        def log_message(self, format, *args):
+            pass  # keep stdout quiet
+
+    return Handler
+
+
+def start_merge_loop(service, interval):
+    """Merge folded-in users into the stored factors every `interval` seconds (daemon thread)."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                merged = service.merge_folded()
+                if merged:
+                    print(f"→ Merged {merged:,} folded-in users into the SVD model", file=sys.stderr)
+            except Exception as e:
+                print(f"⚠️  Merge of folded-in users failed: {e}", file=sys.stderr)
+
+    thread = threading.Thread(target=loop, name="fold-in-merge", daemon=True)
+    thread.start()
+    return thread
+
+
+def serve_http(service, host=RECOMMENDER_HOST, port=RECOMMENDER_PORT):
+    """Serve the recommender over local HTTP until interrupted."""
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"✓ Recommender service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def parse_shards(value):
+    """"0,2,5" → [0, 2, 5]"""
+    return sorted({int(part) for part in value.split(",") if part.strip()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve collaborative recommendations from the trained SVD model.")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--http", action="store_true", help="serve JSON over local HTTP")
+    mode.add_argument("--stdio", action="store_true", help="serve JSON lines over stdin/stdout")
+    parser.add_argument("--host", default=RECOMMENDER_HOST)
+    parser.add_argument("--port", type=int, default=RECOMMENDER_PORT)
+    parser.add_argument("--user-shards", type=parse_shards, metavar="0,1,…",
+                        help="serve only these user shards of the sharded model")
+    parser.add_argument("--item-shards", type=parse_shards, metavar="0,1,…",
+                        help="score only these item shards of the sharded model")
+    parser.add_argument("--merge-interval", type=int, default=FOLD_IN_MERGE_INTERVAL,
+                        help="seconds between merges of folded-in users into the stored factors (0 = off)")
+    args = parser.parse_args()
+
+    start = time.time()
+    service = RecommenderService.load(args.user_shards, args.item_shards)
+    print(f"→ Loaded SVD model in {time.time() - start:.2f}s "
+          f"({service.n_users:,} users × {service.n_movies:,} movies)", file=sys.stderr)
+
+    if args.merge_interval > 0:
+        start_merge_loop(service, args.merge_interval)
+
+    if args.stdio:
+        serve_stdio(service)
+    else:
+        serve_http(service, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+JSON result files shared by the pipeline and the benchmark / evaluation
+harnesses: atomic writes, the git revision they were produced at, and the
+regression gate against a baseline results file.
+"""
+
+import json
+import os
+import subprocess
+
+
+def save_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def git_revision():
+    """Short hash of the checked-out commit (None outside a git checkout)."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, metrics, max_change, direction=1, width=12, number="10.2f"):
+    """
+    Regression messages of `results` against `baseline`, both {name: {metric: value}}.
+
+    Only metrics starting with one of `metrics` are gated. A metric regresses
+    when its relative change exceeds `max_change` in `direction`: +1 for costs
+    (wall time, RSS), -1 for scores (NDCG). Entries or values missing on
+    either side are skipped.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, new in result.items():
+            old = base.get(metric)
+            if not metric.startswith(metrics) or new is None or not old:
+                continue
+            change = new / old - 1
+            regressed = change * direction > max_change
+            marker = "❌" if regressed else "✓"
+            print(f"   {marker} {name:<8} {metric:<{width}} {old:>{number}} → {new:>{number}} ({change:+.1%})")
+            if regressed:
+                regressions.append(f"{name} {metric} {change:+.1%}")
+    return regressions
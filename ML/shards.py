@@ -0,0 +1,202 @@
+"""
+Sharded collaborative model.
+
+The SVD is still trained once on the most active users (MAX_USERS_TO_SAVE).
+Its item side is split into ITEM_SHARDS contiguous movieId ranges, and
+every user with enough ratings (not only the trained sample) is assigned
+to one of USER_SHARDS shards by a hash of userId:
+
+    shard = (userId · 0x9E3779B1 mod 2³²) mod USER_SHARDS
+
+A user shard holds its users' U rows, folded in from their ratings (r · V,
+the row the SVD assigns a trained user), their ids and rated movies. It is
+generated, stored and loaded on its own: a process holds one user shard
+and reads the item shards one at a time. Layout:
+
+    MODEL_DIR/shard_manifest.json        shard counts, hash, item ranges, paths
+    MODEL_DIR/shards/svd_Sigma.npy
+    MODEL_DIR/shards/items-000/          svd_Vt.npy, svd_movie_ids.npy
+    MODEL_DIR/shards/users-000/          svd_U.npy, svd_user_ids.npy, svd_R.*, meta.json
+
+meta.json is written last, so a shard without it is incomplete. Per-shard
+recommendations go to BACKEND_DIR/user_recommendations.collaborative.shard-000.bin.
+The backend finds them through user_recommendations.shards.json.
+"""
+
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from scipy.sparse import vstack
+
+from artifacts import save_dense, load_dense, save_sparse, load_sparse, save_ids, load_ids
+from config import (
+    SHARD_DIR,
+    SHARD_MANIFEST_PATH,
+    OUT_USER_RECS_BIN,
+    OUT_USER_SHARDS_INDEX,
+    USER_SHARDS,
+    ITEM_SHARDS,
+)
+
+USER_HASH = 0x9E3779B1  # Knuth's multiplicative hash; the backend uses Math.imul with the same constant
+
+
+def user_shard(user_ids, n_shards=USER_SHARDS):
+    """Shard number of each userId (stable across runs, machines and the Node backend)."""
+    ids = np.asarray(user_ids, dtype=np.int64).astype(np.uint64)
+    hashed = (ids * np.uint64(USER_HASH)) & np.uint64(0xFFFFFFFF)
+    return (hashed % np.uint64(n_shards)).astype(np.int32)
+
+
+def item_ranges(n_movies, n_shards=ITEM_SHARDS):
+    """(start, stop) column ranges of the sorted movie ids, as equal as possible."""
+    bounds = np.linspace(0, n_movies, max(1, min(n_shards, n_movies)) + 1).round().astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def user_shard_dir(shard):
+    return os.path.join(SHARD_DIR, f"users-{shard:03d}")
+
+
+def item_shard_dir(shard):
+    return os.path.join(SHARD_DIR, f"items-{shard:03d}")
+
+
+def recommendations_path(shard):
+    return OUT_USER_RECS_BIN.format(kind=f"collaborative.shard-{shard:03d}")
+
+
+def _save_json(path, payload):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# ──────────────────────────────────────────────────────────────
+# Manifest + item shards
+# ──────────────────────────────────────────────────────────────
+
+def write_item_shards(Sigma, Vt, movie_ids, n_user_shards=USER_SHARDS, n_item_shards=ITEM_SHARDS, model=None):
+    """
+    Split Vt by movieId range, write Σ and the manifest, and drop the user
+    shards of the previous model (they were folded in against the old V).
+    `model` (engine and hyper-parameters) tells shard generation how to fold users in.
+    """
+    movie_ids = np.asarray(movie_ids)
+    shutil.rmtree(SHARD_DIR, ignore_errors=True)
+    os.makedirs(SHARD_DIR)
+    save_dense(os.path.join(SHARD_DIR, "svd_Sigma"), Sigma, dtype=np.float32)
+
+    items = []
+    for shard, (start, stop) in enumerate(item_ranges(len(movie_ids), n_item_shards)):
+        directory = item_shard_dir(shard)
+        os.makedirs(directory)
+        save_dense(os.path.join(directory, "svd_Vt"), np.asarray(Vt)[:, start:stop], dtype=np.float32)
+        save_ids(os.path.join(directory, "svd_movie_ids"), movie_ids[start:stop])
+        items.append({
+            "shard": shard,
+            "dir": os.path.relpath(directory, SHARD_DIR),
+            "columns": [start, stop],
+            "first_movie_id": int(movie_ids[start]),
+            "last_movie_id": int(movie_ids[stop - 1]),
+        })
+
+    manifest = {
+        "created": time.time(),
+        "n_factors": int(len(Sigma)),
+        "n_movies": int(len(movie_ids)),
+        "model": {key: value for key, value in (model or {"engine": "svd"}).items() if key != "history"},
+        "user_shards": int(n_user_shards),
+        "user_hash": f"(userId * {USER_HASH:#x} mod 2^32) mod user_shards",
+        "items": items,
+        "users": [
+            {"shard": shard, "dir": os.path.relpath(user_shard_dir(shard), SHARD_DIR),
+             "recommendations": os.path.basename(recommendations_path(shard))}
+            for shard in range(n_user_shards)
+        ],
+    }
+    _save_json(SHARD_MANIFEST_PATH, manifest)
+    return manifest
+
+
+def read_manifest():
+    if not os.path.exists(SHARD_MANIFEST_PATH):
+        return None
+    with open(SHARD_MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_item_shards(manifest, shards=None):
+    """(Σ, [Vt per shard], [movie ids per shard], [(start, stop) columns]) for the selected item shards."""
+    selected = [item for item in manifest["items"] if shards is None or item["shard"] in shards]
+    Sigma = np.asarray(load_dense(os.path.join(SHARD_DIR, "svd_Sigma")))
+    Vts = [load_dense(os.path.join(SHARD_DIR, item["dir"], "svd_Vt")) for item in selected]
+    movie_ids = [load_ids(os.path.join(SHARD_DIR, item["dir"], "svd_movie_ids")) for item in selected]
+    return Sigma, Vts, movie_ids, [tuple(item["columns"]) for item in selected]
+
+
+# ──────────────────────────────────────────────────────────────
+# User shards
+# ──────────────────────────────────────────────────────────────
+
+def write_user_shard(shard, U, user_ids, R):
+    directory = user_shard_dir(shard)
+    os.makedirs(directory, exist_ok=True)
+    save_dense(os.path.join(directory, "svd_U"), U, dtype=np.float32)
+    save_ids(os.path.join(directory, "svd_user_ids"), user_ids)
+    save_sparse(os.path.join(directory, "svd_R"), R)
+    _save_json(os.path.join(directory, "meta.json"), {"shard": shard, "n_users": int(len(user_ids)),
+                                                      "created": time.time()})
+
+
+def load_user_shard(shard):
+    """(U, user ids, R) of a complete user shard; FileNotFoundError if it was not generated."""
+    directory = user_shard_dir(shard)
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        raise FileNotFoundError(f"user shard {shard} has not been generated ({directory})")
+    return (load_dense(os.path.join(directory, "svd_U")),
+            load_ids(os.path.join(directory, "svd_user_ids")),
+            load_sparse(os.path.join(directory, "svd_R")))
+
+
+def load_shards(user_shards=None, item_shards=None):
+    """
+    (U, Σ, Vt, user ids, movie ids, R) for the selected shards (None = all),
+    in the layout of the monolithic artifacts. User shards are concatenated
+    in userId order; R keeps only the columns of the selected item shards.
+    """
+    manifest = read_manifest()
+    if manifest is None:
+        raise FileNotFoundError(f"no shard manifest at {SHARD_MANIFEST_PATH}")
+    user_shards = range(manifest["user_shards"]) if user_shards is None else user_shards
+    Sigma, Vts, movie_ids, columns = load_item_shards(manifest, item_shards)
+
+    parts = [load_user_shard(shard) for shard in user_shards]
+    if len(parts) == 1:
+        U, user_ids, R = parts[0]  # stays memory-mapped
+    else:
+        user_ids = np.concatenate([np.asarray(ids) for _, ids, _ in parts])
+        order = np.argsort(user_ids, kind="stable")
+        user_ids = user_ids[order]
+        U = np.vstack([np.asarray(u) for u, _, _ in parts])[order]
+        R = vstack([r for _, _, r in parts]).tocsr()[order]
+
+    keep = np.concatenate([np.arange(start, stop) for start, stop in columns])
+    if len(keep) < manifest["n_movies"]:
+        R = R[:, keep]
+
+    Vt = Vts[0] if len(Vts) == 1 else np.hstack([np.asarray(v) for v in Vts])
+    return U, Sigma, Vt, user_ids, np.concatenate([np.asarray(ids) for ids in movie_ids]), R
+
+
+def write_recommendations_index(manifest):
+    """user_recommendations.shards.json: how the backend finds a user's shard table."""
+    _save_json(OUT_USER_SHARDS_INDEX, {
+        "user_shards": manifest["user_shards"],
+        "user_hash": manifest["user_hash"],
+        "tables": {"collaborative": [user["recommendations"] for user in manifest["users"]]},
+    })
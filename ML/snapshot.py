@@ -0,0 +1,292 @@
+"""
+Local columnar snapshot of the movies and ratings collections.
+
+The first run exports each collection once to SNAPSHOT_DIR/<collection>/:
+numeric columns as .npy, text columns as a UTF-8 blob + int64 offsets.
+Every later stage and run reads the snapshot instead of MongoDB.
+With refresh=True (`--refresh`) the snapshot key — document count and max
+_id — is compared with the live collection and the snapshot is re-exported
+only when it changed.
+
+Run:
+    python snapshot.py            # export if missing
+    python snapshot.py --refresh  # re-export if the collections changed
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+# pandas and loader (pymongo) are imported where they are used: reading a
+# snapshot's arrays, as the models and the service do, needs neither
+from instrumentation import traced, count
+from config import (
+    SNAPSHOT_DIR,
+    MOVIES_COLLECTION,
+    RATINGS_COLLECTION,
+    is_mongodb_available,
+    get_movies_collection,
+    get_ratings_collection,
+)
+
+META_FILE = "meta.json"
+# Ratings per user, grouped on the server whenever the ratings snapshot is
+# (re)validated, so training selects its users without a pass over every rating
+USER_COUNTS = f"{RATINGS_COLLECTION}.user_counts"
+
+
+# ──────────────────────────────────────────────────────────────
+# Column encoding
+# ──────────────────────────────────────────────────────────────
+
+def _is_missing(value):
+    import pandas as pd
+
+    if isinstance(value, (list, tuple, dict, np.ndarray)):
+        return False
+    return value is None or bool(pd.isna(value))
+
+
+def _encode_text(values):
+    """Object column → (utf8 blob, offsets, valid mask, kind)."""
+    valid = np.array([not _is_missing(v) for v in values], dtype=bool)
+    is_plain = all(isinstance(v, str) for v, ok in zip(values, valid) if ok)
+    kind = "string" if is_plain else "json"
+
+    encoded = [
+        (v if kind == "string" else json.dumps(v, default=str)).encode("utf-8") if ok else b""
+        for v, ok in zip(values, valid)
+    ]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets, valid, kind
+
+
+def _decode_text(blob, offsets, valid, kind):
+    data = blob.tobytes()
+    values = np.empty(len(valid), dtype=object)
+    for i in range(len(valid)):
+        if not valid[i]:
+            values[i] = None
+            continue
+        text = data[offsets[i]:offsets[i + 1]].decode("utf-8")
+        values[i] = text if kind == "string" else json.loads(text)
+    return values
+
+
+def _is_numeric(series):
+    import pandas as pd
+
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
+# ──────────────────────────────────────────────────────────────
+# Snapshot read / write
+# ──────────────────────────────────────────────────────────────
+
+def snapshot_dir(name, root=SNAPSHOT_DIR):
+    return os.path.join(root, name)
+
+
+def read_meta(name, root=SNAPSHOT_DIR):
+    path = os.path.join(snapshot_dir(name, root), META_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_snapshot(name, columns, key):
+    """Write {column: array} as a snapshot; replaces any previous one atomically."""
+    import pandas as pd
+
+    final_dir = snapshot_dir(name)
+    tmp_dir = final_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    meta = {"collection": name, "key": key, "created": time.time(), "rows": 0, "columns": {}}
+    for column, values in columns.items():
+        series = pd.Series(values)
+        meta["rows"] = len(series)
+        if _is_numeric(series):
+            array = series.to_numpy()
+            np.save(os.path.join(tmp_dir, f"{column}.npy"), array)
+            meta["columns"][column] = {"kind": "numeric", "dtype": str(array.dtype)}
+        else:
+            blob, offsets, valid, kind = _encode_text(series.astype(object).tolist())
+            np.save(os.path.join(tmp_dir, f"{column}.utf8.npy"), blob)
+            np.save(os.path.join(tmp_dir, f"{column}.offsets.npy"), offsets)
+            np.save(os.path.join(tmp_dir, f"{column}.valid.npy"), valid)
+            meta["columns"][column] = {"kind": kind}
+
+    with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(tmp_dir, final_dir)
+    return meta
+
+
+def read_snapshot(name, columns=None, root=SNAPSHOT_DIR):
+    """
+    {column: array} from a snapshot (numeric columns memory-mapped), or None if missing.
+    `root` reads the snapshots of another cache directory.
+    """
+    meta = read_meta(name, root)
+    if meta is None:
+        return None
+
+    directory = snapshot_dir(name, root)
+    wanted = columns if columns is not None else list(meta["columns"])
+    result = {}
+    for column in wanted:
+        info = meta["columns"].get(column)
+        if info is None:
+            continue
+        if info["kind"] == "numeric":
+            result[column] = np.load(os.path.join(directory, f"{column}.npy"), mmap_mode="r")
+        else:
+            result[column] = _decode_text(
+                np.load(os.path.join(directory, f"{column}.utf8.npy"), mmap_mode="r"),
+                np.load(os.path.join(directory, f"{column}.offsets.npy")),
+                np.load(os.path.join(directory, f"{column}.valid.npy")),
+                info["kind"],
+            )
+    return result
+
+
+def snapshot_watermark(name):
+    """Creation time of the current snapshot — changes exactly when it is re-exported."""
+    meta = read_meta(name)
+    return meta["created"] if meta else None
+
+
+def collection_key(collection):
+    """Change marker for a collection: document count + max _id."""
+    last = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return {
+        "count": collection.count_documents({}),
+        "max_id": str(last["_id"]) if last else None,
+    }
+
+
+# ──────────────────────────────────────────────────────────────
+# Public API
+# ──────────────────────────────────────────────────────────────
+
+def _export_movies(collection):
+    from loader import load_movies
+
+    df = load_movies(collection)
+    return {column: df[column].to_numpy() for column in df.columns}
+
+
+def _export_ratings(collection):
+    from loader import load_ratings
+
+    return load_ratings(collection, expected=collection.estimated_document_count())
+
+
+def _export_user_counts(collection):
+    from loader import active_user_counts
+
+    user_ids, counts = active_user_counts(collection, min_ratings=1)
+    return {"userId": user_ids, "n": counts}
+
+
+_SOURCES = {
+    MOVIES_COLLECTION: (get_movies_collection, _export_movies),
+    RATINGS_COLLECTION: (get_ratings_collection, _export_ratings),
+}
+
+
+def ensure_snapshot(name, refresh=False):
+    """
+    Make sure a snapshot for collection `name` exists and return its meta.
+    Without `refresh` an existing snapshot is used as-is and MongoDB is not touched.
+    """
+    meta = read_meta(name)
+    if meta is not None and not refresh:
+        return meta
+
+    if not is_mongodb_available():
+        if meta is not None:
+            print(f"⚠️  MongoDB not available — using existing {name} snapshot")
+        return meta
+
+    get_collection, export = _SOURCES[name]
+    collection = get_collection()
+    key = collection_key(collection)
+    if meta is not None and meta.get("key") == key:
+        print(f"→ {name} snapshot is up to date ({key['count']:,} documents)")
+    else:
+        print(f"Exporting {name} collection to snapshot ({key['count']:,} documents)...")
+        start = time.time()
+        meta = write_snapshot(name, export(collection), key)
+        print(f"→ {name} snapshot written in {time.time() - start:.1f}s → {snapshot_dir(name)}")
+
+    counts_meta = read_meta(USER_COUNTS)
+    if name == RATINGS_COLLECTION and (counts_meta is None or counts_meta.get("key") != key):
+        write_snapshot(USER_COUNTS, _export_user_counts(collection), key)
+    return meta
+
+
+@traced("load.movies")
+def get_movies(columns=None, refresh=False):
+    """Movies DataFrame from the snapshot (exported first if needed), or None if unavailable."""
+    import pandas as pd
+
+    if ensure_snapshot(MOVIES_COLLECTION, refresh) is None:
+        return None
+    df = pd.DataFrame(read_snapshot(MOVIES_COLLECTION, columns))
+    count("rows", len(df))
+    return df
+
+
+@traced("load.ratings")
+def get_ratings(refresh=False):
+    """Rating columns {userId, movieId, rating, timestamp} from the snapshot, or None if unavailable."""
+    if ensure_snapshot(RATINGS_COLLECTION, refresh) is None:
+        return None
+    ratings = read_snapshot(RATINGS_COLLECTION)
+    count("rows", len(ratings["userId"]))
+    return ratings
+
+
+def get_user_counts():
+    """
+    (user ids, rating counts) of every user in the ratings snapshot, most
+    ratings first and ties by ascending id, as grouped on the server at export;
+    None when the snapshot has no counts of the same collection state.
+    """
+    ratings_meta, counts_meta = read_meta(RATINGS_COLLECTION), read_meta(USER_COUNTS)
+    if ratings_meta is None or counts_meta is None or counts_meta.get("key") != ratings_meta.get("key"):
+        return None
+    counts = read_snapshot(USER_COUNTS)
+    return counts["userId"], counts["n"]
+
+
+def refresh_all():
+    """Re-validate both snapshots against MongoDB (re-exporting changed collections)."""
+    for name in (MOVIES_COLLECTION, RATINGS_COLLECTION):
+        ensure_snapshot(name, refresh=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export movies/ratings to the local snapshot cache.")
+    parser.add_argument("--refresh", action="store_true", help="re-export collections that changed in MongoDB")
+    args = parser.parse_args()
+
+    for name in (MOVIES_COLLECTION, RATINGS_COLLECTION):
+        if ensure_snapshot(name, refresh=args.refresh) is None:
+            print(f"❌ No {name} snapshot: MongoDB not available.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Run from any directory with the flat ML/ imports, and keep config.py's
+# cache / model / output directories out of the real tree
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+_WORK_DIR = tempfile.mkdtemp(prefix="ml-tests-")
+for name in ("ML_CACHE_DIR", "ML_MODEL_DIR", "ML_OUTPUT_DIR"):
+    os.environ.setdefault(name, os.path.join(_WORK_DIR, name.lower()))
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from scipy.sparse import random as sparse_random
+
+from als import confidence, fold_in, implicit_loss, solve_cg, solve_exact, train_als
+
+N_USERS, N_MOVIES, K, REG, ALPHA = 40, 60, 6, 0.1, 10.0
+
+
+@pytest.fixture
+def ratings():
+    R = sparse_random(N_USERS, N_MOVIES, density=0.1, format="csr", dtype=np.float32, random_state=0)
+    R.data = np.ceil(R.data * 5)
+    R.data[R.indptr[3]:R.indptr[4]] = 0  # a user without ratings
+    R.eliminate_zeros()
+    return R
+
+
+def dense_solution(R, Y):
+    """Per user: (Yᵀ Cᵤ Y + λI) x = Yᵀ Cᵤ pᵤ with the full confidence diagonal."""
+    C, P = 1 + ALPHA * R.toarray(), (R.toarray() > 0).astype(float)
+    Y = Y.astype(np.float64)
+    return np.stack([np.linalg.solve(Y.T @ (c[:, None] * Y) + REG * np.eye(K), Y.T @ (c * p)) for c, p in zip(C, P)])
+
+
+def test_exact_solve_matches_dense_normal_equations(ratings):
+    Y = np.random.default_rng(1).standard_normal((N_MOVIES, K)).astype(np.float32)
+    X = solve_exact(confidence(ratings, ALPHA), Y, Y.T @ Y, REG, chunk_size=7)
+    np.testing.assert_allclose(X, dense_solution(ratings, Y), rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(fold_in(ratings[:5], Y.T, REG, ALPHA), X[:5], rtol=1e-5, atol=1e-6)
+    assert not X[3].any()
+
+
+def test_conjugate_gradient_converges_to_exact_solve(ratings):
+    Y = np.random.default_rng(1).standard_normal((N_MOVIES, K)).astype(np.float32)
+    C = confidence(ratings, ALPHA)
+    exact = solve_exact(C, Y, Y.T @ Y, REG)
+    start = np.zeros((N_USERS, K), dtype=np.float32)
+    few = solve_cg(C, Y, Y.T @ Y, REG, start, steps=2)
+    many = solve_cg(C, Y, Y.T @ Y, REG, start, steps=3 * K)
+    np.testing.assert_allclose(many, exact, rtol=1e-3, atol=1e-4)
+    assert np.abs(many - exact).max() < np.abs(few - exact).max()
+
+
+def test_implicit_loss_matches_dense_sum(ratings):
+    rng = np.random.default_rng(2)
+    X, Y = rng.standard_normal((N_USERS, K)), rng.standard_normal((N_MOVIES, K))
+    C, P = 1 + ALPHA * ratings.toarray(), (ratings.toarray() > 0).astype(float)
+    expected = np.sum(C * (P - X @ Y.T) ** 2) + REG * (np.sum(X ** 2) + np.sum(Y ** 2))
+    assert implicit_loss(confidence(ratings, ALPHA), X, Y, REG) == pytest.approx(expected, rel=1e-6)
+
+
+def test_cg_training_tracks_cholesky(ratings):
+    kwargs = dict(factors=K, iterations=8, reg=REG, alpha=ALPHA, n_jobs=1)
+    _, _, exact = train_als(ratings, solver="cholesky", **kwargs)
+    _, _, cg = train_als(ratings, solver="cg", cg_steps=3, **kwargs)
+
+    losses = [entry["loss"] for entry in exact]
+    assert all(later <= earlier * (1 + 1e-6) for earlier, later in zip(losses, losses[1:]))  # ALS never goes up
+    assert cg[-1]["loss"] == pytest.approx(exact[-1]["loss"], rel=0.05)
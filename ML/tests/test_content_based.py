@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import MinMaxScaler
+
+from content_based import (
+    GENRE_WEIGHT,
+    NUMERIC_WEIGHT,
+    compute_neighbors,
+    jaccard_similarity,
+    prepare_similarity_features,
+)
+
+GENRES = ["Action", "Comedy", "Drama", "Horror", "Romance", "Thriller"]
+K = 5
+
+
+def make_movies(n=70, seed=0):
+    """Random genre sets (every 7th one empty) and min-max scaled numeric features."""
+    rng = np.random.default_rng(seed)
+    genre_sets = [set() if i % 7 == 0 else set(rng.choice(GENRES, rng.integers(1, 4), replace=False))
+                  for i in range(n)]
+    numeric = rng.random((n, 3)) * [10, 5000, 100]
+    return genre_sets, MinMaxScaler().fit_transform(numeric)
+
+
+def baseline_similarity(genre_sets, numeric):
+    """The original pairwise loop: Jaccard on genre sets + sklearn cosine on numeric rows."""
+    n = len(genre_sets)
+    similarity = np.zeros((n, n))
+    for i in range(n):
+        for j in range(n):
+            cosine = cosine_similarity(numeric[i:i + 1], numeric[j:j + 1])[0][0]
+            similarity[i, j] = GENRE_WEIGHT * jaccard_similarity(genre_sets[i], genre_sets[j]) + NUMERIC_WEIGHT * cosine
+    return similarity
+
+
+@pytest.mark.parametrize("candidates", [False, True])
+def test_compute_neighbors_matches_pairwise_baseline(candidates):
+    genre_sets, numeric = make_movies()
+    reference = baseline_similarity(genre_sets, numeric)
+    np.fill_diagonal(reference, -np.inf)
+    expected = -np.sort(-reference, axis=1)[:, :K]
+
+    features = prepare_similarity_features(genre_sets, numeric)
+    indices, scores = compute_neighbors(features, k=K, block_size=16, n_jobs=1, candidates=candidates)
+
+    assert indices.shape == scores.shape == (len(genre_sets), K)
+    assert not (indices == np.arange(len(genre_sets))[:, None]).any()
+    np.testing.assert_allclose(scores, expected, atol=1e-6)
+    # Every listed neighbour carries its true pairwise score
+    np.testing.assert_allclose(scores, np.take_along_axis(reference, indices, axis=1), atol=1e-6)
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse import random as sparse_random, vstack
+from sklearn.preprocessing import normalize
+
+import content_based
+import tfidf_model
+from incremental import feature_hashes, load_state, plan_update, save_state, update_neighbors
+
+K = 6
+PARAMS = {"k": K}
+
+
+def assert_same_neighbors(actual, expected):
+    (indices, scores), (expected_indices, expected_scores) = actual, expected
+    np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+    # Zero-similarity neighbours tie, so their order is arbitrary; empty slots must match
+    ranked = (expected_scores > 0) | (expected_indices < 0)
+    np.testing.assert_array_equal(np.where(ranked, indices, 0), np.where(ranked, expected_indices, 0))
+
+
+def make_frame(rng, n, first_id=1):
+    genres = ["Action", "Comedy", "Drama", "Horror", "Romance"]
+    return pd.DataFrame({
+        "movieId": np.arange(first_id, first_id + n),
+        "genres": [" ".join(rng.choice(genres, rng.integers(0, 3), replace=False)) for _ in range(n)],
+        "vote_average": rng.random(n) * 10,
+        "vote_count": rng.integers(100, 5000, n).astype(float),
+        "popularity": rng.random(n) * 100,
+    })
+
+
+def edit_catalogue(df, rng):
+    """Remove a few movies, modify a few others and append new ones."""
+    removed = rng.choice(len(df), 4, replace=False)
+    df = df.drop(index=df.index[removed]).reset_index(drop=True)
+    modified = rng.choice(len(df), 5, replace=False)
+    added = make_frame(rng, 6, first_id=10_000)
+    df.loc[modified, added.columns[1:]] = make_frame(rng, len(modified)).iloc[:, 1:].to_numpy()
+    return pd.concat([df, added], ignore_index=True).sample(frac=1, random_state=1).reset_index(drop=True)
+
+
+def content_features(df):
+    genre_sets = [set(genres.split()) for genres in df["genres"]]
+    numeric = df[content_based.NUMERIC_COLUMNS].to_numpy() / [10, 5000, 100]  # fixed scale, as the saved scaler
+    return content_based.prepare_similarity_features(genre_sets, numeric)
+
+
+def incremental_update(stage, before, after, full_neighbors, rows_similarity, threshold=None):
+    """Save the full state of `before`, plan `after` against it and apply the update."""
+    save_state(stage, before["movieId"], feature_hashes(before, before.columns[1:].tolist()),
+               *full_neighbors(before), watermark=1, params=PARAMS)
+    state = load_state(stage, PARAMS)
+    plan = plan_update(state, after["movieId"].to_numpy(), feature_hashes(after, after.columns[1:].tolist()))
+    assert len(plan["changed"]) == 11 and plan["removed"] == 4 and len(plan["stale"]) > 0
+    ordered = after.iloc[plan["order"]].reset_index(drop=True)
+    return ordered, update_neighbors(rows_similarity(ordered), plan, K, threshold=threshold, block_size=4)
+
+
+def test_content_update_matches_full_recompute():
+    rng = np.random.default_rng(0)
+    before = make_frame(rng, 80)
+    after = edit_catalogue(before, rng)
+
+    def full(df):
+        return content_based.compute_neighbors(content_features(df), k=K, n_jobs=1, candidates=False)
+
+    def rows_similarity(df):
+        features = content_features(df)
+        return lambda rows: content_based.similarity_rows(features, rows)
+
+    ordered, updated = incremental_update("content", before, after, full, rows_similarity)
+    assert_same_neighbors(updated, full(ordered))
+
+
+@pytest.mark.parametrize("mode", ["sparse", "dense"])
+def test_tfidf_update_matches_full_recompute(mode):
+    rng = np.random.default_rng(1)
+    before = make_frame(rng, 80)
+    after = edit_catalogue(before, rng)
+
+    def tfidf_rows(df):
+        """Stand-in for a fitted vectorizer: one fixed sparse row per feature hash (some all zero)."""
+        seeds = feature_hashes(df, df.columns[1:].tolist()) % np.uint64(2 ** 32)
+        return vstack([sparse_random(1, 60, density=0.04, random_state=int(seed)) for seed in seeds]).tocsr()
+
+    def full(df):
+        return tfidf_model.compute_neighbors(tfidf_rows(df), k=K, mode=mode, n_jobs=1)
+
+    def rows_similarity(df):
+        unit = normalize(tfidf_rows(df))
+        return lambda rows: (unit[rows] @ unit.T).toarray()
+
+    threshold = tfidf_model.TFIDF_MIN_SIMILARITY if mode == "sparse" else None
+    ordered, updated = incremental_update("tfidf", before, after, full, rows_similarity, threshold=threshold)
+    assert_same_neighbors(updated, full(ordered))
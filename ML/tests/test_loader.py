@@ -0,0 +1,103 @@
+import mongomock
+import numpy as np
+import pytest
+
+from loader import RATING_COLUMNS, active_user_counts, load_columns, load_columns_partitioned
+
+N_RATINGS = 257  # not a multiple of any batch size below
+
+
+@pytest.fixture
+def ratings():
+    collection = mongomock.MongoClient().db.ratings
+    collection.insert_many([
+        {"userId": i // 4, "movieId": 1000 + i, "rating": (i % 10) / 2 + 0.5, "timestamp": 1_600_000_000 + i}
+        for i in range(N_RATINGS)
+    ])
+    collection.create_index("userId")
+    return collection
+
+
+def sort_rows(columns):
+    order = np.argsort(columns["movieId"], kind="stable")
+    return {name: array[order] for name, array in columns.items()}
+
+
+@pytest.mark.parametrize("batch_size", [1, 16, N_RATINGS, 10_000])
+def test_load_columns_streams_every_batch(ratings, batch_size):
+    columns = load_columns(ratings, RATING_COLUMNS, batch_size=batch_size, expected=10)
+
+    assert {name: array.dtype for name, array in columns.items()} == {
+        name: np.dtype(dtype) for name, dtype in RATING_COLUMNS.items()}
+    assert len(columns["movieId"]) == N_RATINGS
+    np.testing.assert_array_equal(np.sort(columns["movieId"]), 1000 + np.arange(N_RATINGS))
+    rows = sort_rows(columns)
+    np.testing.assert_array_equal(rows["userId"], np.arange(N_RATINGS) // 4)
+    np.testing.assert_allclose(rows["rating"], (np.arange(N_RATINGS) % 10) / 2 + 0.5)
+    np.testing.assert_array_equal(rows["timestamp"], 1_600_000_000 + np.arange(N_RATINGS))
+
+
+def test_load_columns_query_and_projection(ratings):
+    columns = load_columns(ratings, {"movieId": np.int32}, query={"userId": {"$lt": 2}}, batch_size=3)
+    assert list(columns) == ["movieId"]
+    np.testing.assert_array_equal(np.sort(columns["movieId"]), 1000 + np.arange(8))
+
+
+def test_load_columns_fills_missing_fields():
+    collection = mongomock.MongoClient().db.movies
+    collection.insert_many([
+        {"movieId": 1, "vote_count": 10, "title": "A"},
+        {"movieId": 2},
+        {"movieId": 3, "vote_count": "n/a", "title": "C"},
+    ])
+    columns = load_columns(collection, {"movieId": np.int32, "vote_count": np.int64,
+                                        "vote_average": np.float32, "title": object}, batch_size=2)
+
+    np.testing.assert_array_equal(columns["vote_count"], [10, 0, 0])
+    assert columns["vote_count"].dtype == np.int64
+    assert np.isnan(columns["vote_average"]).all() and columns["vote_average"].dtype == np.float32
+    assert columns["title"].tolist() == ["A", None, "C"]
+
+
+def test_empty_collection():
+    collection = mongomock.MongoClient().db.empty
+    for columns in (load_columns(collection, RATING_COLUMNS),
+                    load_columns_partitioned(collection, RATING_COLUMNS, workers=3)):
+        assert {name: (len(array), array.dtype) for name, array in columns.items()} == {
+            name: (0, np.dtype(dtype)) for name, dtype in RATING_COLUMNS.items()}
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_load_columns_partitioned_matches_a_single_read(ratings, workers):
+    expected = sort_rows(load_columns(ratings, RATING_COLUMNS))
+    columns = load_columns_partitioned(ratings, RATING_COLUMNS, field="userId", batch_size=7, workers=workers)
+
+    assert {name: array.dtype for name, array in columns.items()} == {
+        name: array.dtype for name, array in expected.items()}
+    # Partitions come back in userId range order
+    assert (np.diff(columns["userId"]) >= 0).all()
+    for name, array in sort_rows(columns).items():
+        np.testing.assert_array_equal(array, expected[name])
+
+
+def test_load_columns_partitioned_with_query(ratings):
+    columns = load_columns_partitioned(ratings, RATING_COLUMNS, query={"rating": {"$gte": 4}},
+                                       field="userId", workers=2)
+    assert len(columns["rating"]) == sum((i % 10) / 2 + 0.5 >= 4 for i in range(N_RATINGS))
+    assert (columns["rating"] >= 4).all()
+
+
+def test_active_user_counts_match_local_selection():
+    from collaborative_svd import select_active_users
+
+    collection = mongomock.MongoClient().db.ratings
+    user_col = np.random.default_rng(0).integers(0, 40, size=600)
+    collection.insert_many([{"userId": int(user), "movieId": i} for i, user in enumerate(user_col)])
+
+    users, counts = active_user_counts(collection, min_ratings=1)
+    np.testing.assert_array_equal(counts, [np.count_nonzero(user_col == user) for user in users])
+    for min_ratings, limit in [(1, None), (15, None), (15, 5)]:
+        expected = select_active_users(user_col, min_ratings=min_ratings, limit=limit)
+        np.testing.assert_array_equal(active_user_counts(collection, min_ratings, limit)[0], expected)
+        np.testing.assert_array_equal(
+            select_active_users(None, min_ratings, limit, user_counts=(users, counts)), expected)
@@ -0,0 +1,89 @@
+import math
+
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+
+from evaluation import metrics
+
+N_ITEMS = 8
+
+# Four users' top-3 lists, padded with -1. User 1 and 3 have nothing held out
+RECS = np.array([[0, 1, 2],
+                 [3, -1, -1],
+                 [4, 5, 0],
+                 [3, 0, -1]])
+RELEVANT = csr_matrix(np.array([[0, 1, 0, 0, 0, 1, 0, 0],    # hit at rank 2, one relevant movie missed
+                                [0, 0, 0, 0, 0, 0, 0, 0],
+                                [1, 0, 1, 0, 0, 0, 0, 0],    # hit at rank 3
+                                [0, 0, 0, 0, 0, 0, 0, 0]]))
+GENRES = csr_matrix(np.array([[1, 0, 0],
+                              [1, 0, 0],
+                              [0, 1, 0],
+                              [1, 1, 0],
+                              [0, 0, 0],                     # no genres
+                              [0, 0, 1],
+                              [0, 1, 0],
+                              [0, 0, 1]]))
+
+
+def test_hit_matrix_marks_relevant_slots_only():
+    expected = np.array([[False, True, False],
+                         [False, False, False],
+                         [False, False, True],
+                         [False, False, False]])
+    np.testing.assert_array_equal(metrics.hit_matrix(RECS, RELEVANT), expected)
+    assert not metrics.hit_matrix(RECS, csr_matrix(RELEVANT.shape)).any()
+
+
+def test_ranking_metrics_by_hand():
+    ideal = 1 + 1 / math.log2(3)  # two relevant movies each
+    report = metrics.ranking_metrics(RECS, RELEVANT)
+    assert report["users"] == 2
+    assert report["precision@3"] == pytest.approx(1 / 3)
+    assert report["recall@3"] == pytest.approx(1 / 2)
+    assert report["ndcg@3"] == pytest.approx((1 / math.log2(3) + 1 / math.log2(4)) / 2 / ideal)
+    assert report["hit_rate@3"] == pytest.approx(1.0)
+
+    top1 = metrics.ranking_metrics(RECS, RELEVANT, k=1)
+    assert top1 == {"users": 2, "precision@1": 0.0, "recall@1": 0.0, "ndcg@1": 0.0, "hit_rate@1": 0.0}
+
+
+def test_ranking_metrics_ideal_list_is_capped_at_k():
+    recs = np.array([[5, 1, 7]])
+    relevant = csr_matrix(np.array([[0, 1, 1, 1, 1, 1, 0, 0]]))  # 5 relevant, K = 2
+    report = metrics.ranking_metrics(recs, relevant, k=2)
+    assert report["ndcg@2"] == pytest.approx(1.0)
+    assert report["recall@2"] == pytest.approx(2 / 5)
+
+
+def test_ranking_metrics_without_relevant_users():
+    report = metrics.ranking_metrics(RECS, csr_matrix(RELEVANT.shape))
+    assert report["users"] == 0 and report["ndcg@3"] == 0.0
+
+
+def test_coverage_and_entropy_by_hand():
+    # Recommended counts: movie 0 ×3, movie 3 ×2, movies 1, 2, 4, 5 once; 6 and 7 never
+    np.testing.assert_array_equal(metrics.exposure(RECS, N_ITEMS), [3, 1, 1, 2, 1, 1, 0, 0])
+    assert metrics.coverage(RECS, N_ITEMS) == pytest.approx(6 / 8)
+    p = np.array([3, 1, 1, 2, 1, 1]) / 9
+    assert metrics.exposure_entropy(RECS, N_ITEMS) == pytest.approx(-(p * np.log(p)).sum() / math.log(8))
+
+    uniform = np.arange(N_ITEMS).reshape(2, 4)
+    assert metrics.exposure_entropy(uniform, N_ITEMS) == pytest.approx(1.0)
+    assert metrics.exposure_entropy(np.full((2, 3), -1), N_ITEMS) == 0.0
+
+
+def test_intra_list_diversity_by_hand():
+    # [0, 1, 2]: cosines 1, 0, 0; [3] is too short to score;
+    # [4, 5, 0]: movie 4 has no genres, 5 and 0 are orthogonal; [3, 0]: cosine 1/√2
+    expected = np.mean([1 - 1 / 3, 1.0, 1 - 1 / math.sqrt(2)])
+    assert metrics.intra_list_diversity(RECS, GENRES) == pytest.approx(expected)
+    assert metrics.intra_list_diversity(RECS[:, :1], GENRES) == 0.0
+
+
+def test_evaluate_truncates_to_k():
+    report = metrics.evaluate(RECS, RELEVANT, N_ITEMS, features=GENRES, k=2)
+    assert report["precision@2"] == pytest.approx(1 / 4)
+    assert report["coverage"] == pytest.approx(metrics.coverage(RECS[:, :2], N_ITEMS))
+    assert report["diversity"] == pytest.approx(metrics.intra_list_diversity(RECS[:, :2], GENRES))
@@ -0,0 +1,105 @@
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from movie_index import ALIGN, MAGIC, MovieIndex, genre_tokens, intersect, write_movie_index
+
+MOVIES = pd.DataFrame({
+    "movieId":      [30, 10, 50, 20, 40, 60],
+    "genres":       ["Action Comedy", ["Drama"], None, "action drama", np.nan, "Comedy"],
+    "popularity":   [5.0, 9.0, 5.0, np.nan, 1.0, 5.0],
+    "vote_count":   [100, 10, 300, 50, 0, 100],
+    "vote_average": [7.4, 10.0, np.nan, 0.2, 6.9, 7.0],
+    "release_year": [1999, np.nan, 0, 2005, np.nan, 1999],
+    "release_date": ["1980-01-01", "2010-05-04", "unknown", None, "1999-12-31", None],
+})
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "movies.index.bin")
+    terms = write_movie_index(path, MOVIES)
+    assert terms == {"genre": 3, "year": 3, "rating": 4}
+    return path, MovieIndex(path)
+
+
+def brute_force(genre=None, year=None):
+    years = [1999, 2010, 0, 2005, 1999, 1999]  # release_year wins over the date
+    return [row for row in range(len(MOVIES))
+            if (genre is None or genre.lower() in genre_tokens(MOVIES["genres"].iat[row]))
+            and (year is None or years[row] == year)]
+
+
+def test_ids_and_row_lookup(index):
+    _, movie_index = index
+    assert len(movie_index) == len(MOVIES)
+    np.testing.assert_array_equal(movie_index.arrays["ids"], MOVIES["movieId"])
+    for row, movie_id in enumerate(MOVIES["movieId"]):
+        assert movie_index.row(movie_id) == row
+    assert movie_index.row(35) == -1 and movie_index.row(0) == -1 and movie_index.row(99) == -1
+
+
+def test_popularity_order(index):
+    _, movie_index = index
+    # popularity descending, then vote count descending, then row
+    assert movie_index.arrays["popularity"].tolist() == [1, 2, 0, 5, 4, 3]
+
+
+@pytest.mark.parametrize("genre, year", [
+    (None, None), ("action", None), ("COMEDY", None), ("drama", None), ("western", None),
+    (None, 1999), (None, 2010), (None, 1800), ("comedy", 1999), ("action", 2005), ("drama", 1999),
+])
+def test_filtered_rows_match_a_scan(index, genre, year):
+    _, movie_index = index
+    rows = movie_index.rows(genre=genre, year=year)
+    assert rows.tolist() == brute_force(genre, year)
+    assert np.all(np.diff(rows) > 0)
+
+
+def test_rating_buckets(index):
+    _, movie_index = index
+    buckets = {term: movie_index.postings("rating", term).tolist() for term in range(11)}
+    assert {term: rows for term, rows in buckets.items() if rows} == {0: [3], 6: [4], 7: [0, 5], 10: [1]}
+    assert movie_index.postings("rating", 3).tolist() == []
+    assert movie_index.postings("unknown", "x").tolist() == []
+
+
+def test_file_layout_is_aligned(index):
+    path, _ = index
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data[:4] == MAGIC
+    (header_len,) = struct.unpack("<I", data[8:12])
+    header = json.loads(data[12:12 + header_len])
+    data_offset = -(-(12 + header_len) // ALIGN) * ALIGN
+    for name, (offset, length) in header["arrays"].items():
+        assert (data_offset + offset) % ALIGN == 0
+        view = np.frombuffer(data, dtype="<i4", count=length, offset=data_offset + offset)
+        assert len(view) == length
+    ids_offset, n = header["arrays"]["ids"]
+    np.testing.assert_array_equal(np.frombuffer(data, dtype="<i4", count=n, offset=data_offset + ids_offset),
+                                  MOVIES["movieId"])
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"NOPE" + bytes(20))
+    with pytest.raises(ValueError):
+        MovieIndex(str(path))
+
+
+def test_empty_catalogue(tmp_path):
+    path = str(tmp_path / "empty.index.bin")
+    write_movie_index(path, MOVIES.iloc[:0])
+    movie_index = MovieIndex(path)
+    assert len(movie_index) == 0 and movie_index.row(10) == -1
+    assert movie_index.rows().tolist() == [] and movie_index.rows(genre="action").tolist() == []
+
+
+def test_intersect_is_order_independent():
+    lists = [np.array([1, 3, 5, 7, 9]), np.array([3, 9]), np.array([0, 3, 4, 9, 11])]
+    assert intersect(lists).tolist() == [3, 9]
+    assert intersect(lists[::-1]).tolist() == [3, 9]
@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import pytest
+
+from neighbor_table import (
+    ALIGN,
+    NeighborTable,
+    read_table_as_dict,
+    table_from_dict,
+    write_neighbor_table,
+    write_outputs,
+)
+
+
+def test_round_trip_with_unsorted_keys_and_empty_rows(tmp_path):
+    path = str(tmp_path / "table.bin")
+    keys = [30, 10, 20, 40]
+    neighbors = [[10, 20, -1], [30, -1, -1], [-1, -1, -1], [10, 30, 20]]
+    scores = np.array([[0.9, 0.5, 0], [0.75, 0, 0], [0, 0, 0], [0.25, 0.125, 0.0625]], dtype=np.float32)
+    write_neighbor_table(path, keys, neighbors, scores)
+
+    table = NeighborTable(path)
+    assert len(table) == 4 and table.header["k"] == 3
+    np.testing.assert_array_equal(table.keys, [10, 20, 30, 40])
+    for name in ("keys_offset", "neighbors_offset", "scores_offset"):
+        assert table.header[name] % ALIGN == 0
+    assert read_table_as_dict(path) == {"10": [30], "20": [], "30": [10, 20], "40": [10, 30, 20]}
+
+    ids, row_scores = table.get(30, with_scores=True)
+    assert ids == [10, 20] and row_scores == pytest.approx([0.9, 0.5], abs=1e-3)  # float16
+    assert table.get(40, with_scores=True) == ([10, 30, 20], [0.25, 0.125, 0.0625])
+    assert table.get(20, with_scores=True) == ([], [])
+    assert table.get(99) == [] and table.row(99) == -1 and table.row(5) == -1
+
+
+def test_round_trip_from_dict_without_scores(tmp_path):
+    path = str(tmp_path / "table.bin")
+    recommendations = {"7": [1, 2, 3], "3": [], "5": [9]}
+    write_neighbor_table(path, *table_from_dict(recommendations))
+
+    table = NeighborTable(path)
+    assert table.scores is None
+    assert read_table_as_dict(path) == {"3": [], "5": [9], "7": [1, 2, 3]}
+
+
+@pytest.mark.parametrize("k", [0, 2])
+def test_empty_tables(tmp_path, k):
+    path = str(tmp_path / "table.bin")
+    write_neighbor_table(path, np.empty(0), np.empty((0, k)), np.empty((0, k)))
+    assert len(NeighborTable(path)) == 0
+    assert read_table_as_dict(path) == {}
+
+
+def test_write_outputs_keeps_only_the_selected_format(tmp_path):
+    json_path, bin_path = str(tmp_path / "recs.json"), str(tmp_path / "recs.bin")
+    recommendations = {"1": [2], "2": [1]}
+    keys, neighbors = table_from_dict(recommendations)
+
+    write_outputs(json_path, bin_path, recommendations, keys, neighbors, output_format="both")
+    with open(json_path, encoding="utf-8") as f:
+        assert json.load(f) == recommendations
+    assert read_table_as_dict(bin_path) == recommendations
+
+    write_outputs(json_path, bin_path, recommendations, keys, neighbors, output_format="binary")
+    assert not (tmp_path / "recs.json").exists() and (tmp_path / "recs.bin").exists()
+    write_outputs(json_path, bin_path, recommendations, keys, neighbors, output_format="json")
+    assert (tmp_path / "recs.json").exists() and not (tmp_path / "recs.bin").exists()
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from scipy.sparse import random as sparse_random
+
+from neighbors import mask_rated, top_k_block
+from quantize import QuantizedMatrix, overlap, quantized_top_k
+
+N_USERS, N_MOVIES, N_FACTORS, K = 50, 600, 16, 20
+
+
+@pytest.fixture
+def factors():
+    rng = np.random.default_rng(0)
+    US = rng.standard_normal((N_USERS, N_FACTORS)).astype(np.float32)
+    Vt = rng.standard_normal((N_FACTORS, N_MOVIES)).astype(np.float32)
+    R = sparse_random(N_USERS, N_MOVIES, density=0.05, format="csr", dtype=np.float32, random_state=0)
+    return US, Vt, R
+
+
+@pytest.mark.parametrize("mode, tolerance", [("int8", 0.5 / 127), ("float16", 1e-3)])
+def test_quantize_round_trip(tmp_path, mode, tolerance, factors):
+    X = factors[1].T
+    Q = QuantizedMatrix.quantize(X, mode, block_size=64)
+    assert Q.mode == mode and Q.nbytes < X.nbytes
+    error = np.abs(Q.rows(np.arange(N_MOVIES)) - X).max(axis=1) / np.abs(X).max(axis=1)
+    assert error.max() <= tolerance
+
+    Q.save(str(tmp_path / "V"))
+    loaded = QuantizedMatrix.load(str(tmp_path / "V"))
+    np.testing.assert_array_equal(loaded.rows(np.arange(N_MOVIES)), Q.rows(np.arange(N_MOVIES)))
+    queries = factors[0][:5]
+    np.testing.assert_allclose(loaded.scores(queries, block_size=100), queries @ Q.rows(np.arange(N_MOVIES)).T,
+                               rtol=1e-5, atol=1e-4)
+
+
+@pytest.mark.parametrize("mode", ["int8", "float16"])
+def test_quantized_top_k_overlaps_float32(mode, factors):
+    US, Vt, R = factors
+    scores = US @ Vt
+    mask_rated(scores, R.indptr, R.indices, 0, N_USERS)
+    reference, _ = top_k_block(scores, K, exclude_self=False)
+
+    V_q = QuantizedMatrix.quantize(Vt.T, mode)
+    US_q = QuantizedMatrix.quantize(US, mode)
+    scan, _ = quantized_top_k(V_q, Vt, US_q.rows(np.arange(N_USERS)), US, K, R, rerank_factor=1)
+    reranked, reranked_scores = quantized_top_k(V_q, Vt, US_q.rows(np.arange(N_USERS)), US, K, R, rerank_factor=4)
+
+    assert overlap(scan, reference, K) >= 0.9
+    assert overlap(reranked, reference, K) >= 0.99
+    # Re-ranked scores are the exact float32 ones, and rated movies never come back
+    np.testing.assert_allclose(reranked_scores, np.take_along_axis(scores, reranked, axis=1), rtol=1e-5, atol=1e-5)
+    for user in range(N_USERS):
+        assert not set(reranked[user]) & set(R.indices[R.indptr[user]:R.indptr[user + 1]])
@@ -0,0 +1,154 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix, random as sparse_random
+from scipy.sparse.linalg import svds
+
+from recommender_service import RecommenderService, make_handler
+
+N_USERS, N_MOVIES, N_FACTORS = 300, 400, 8
+TOP_N = 10
+
+
+def make_service(seed=0):
+    """Small dense model; trained users have even ids so merged (odd) users interleave with them."""
+    rng = np.random.default_rng(seed)
+    U = rng.standard_normal((N_USERS, N_FACTORS)).astype(np.float32)
+    Sigma = np.sort(rng.random(N_FACTORS).astype(np.float32))[::-1] + 0.5
+    Vt = rng.standard_normal((N_FACTORS, N_MOVIES)).astype(np.float32)
+    R = sparse_random(N_USERS, N_MOVIES, density=0.05, format="csr", dtype=np.float32, random_state=seed)
+    return RecommenderService(U, Sigma, Vt, np.arange(N_USERS) * 2, np.arange(N_MOVIES) + 1, R)
+
+
+def test_batch_requests_stay_consistent_during_merges():
+    service = make_service()
+    trained = (np.arange(0, N_USERS, 7) * 2).tolist()
+    expected = service.recommend_batch(trained, TOP_N)
+    errors = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            try:
+                if service.recommend_batch(trained, TOP_N) != expected:
+                    errors.append("recommendations changed during a merge")
+            except Exception as e:  # IndexError when rows of two model versions mix
+                errors.append(repr(e))
+
+    def merge():
+        rng = np.random.default_rng(1)
+        try:
+            for round_ in range(40):
+                # New odd ids land between trained users and shift their rows
+                user_ids = [2 * (round_ * 5 + i) + 1 for i in range(5)]
+                ratings = [{int(m): float(rng.integers(1, 6)) for m in rng.choice(N_MOVIES, 8, replace=False) + 1}
+                           for _ in user_ids]
+                service.recommend_for_ratings(ratings, TOP_N, user_ids=user_ids)
+                service.merge_folded(save=False)
+        finally:
+            done.set()
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    merger = threading.Thread(target=merge)
+    for thread in readers + [merger]:
+        thread.start()
+    for thread in readers + [merger]:
+        thread.join(timeout=120)
+
+    assert not errors, errors[:3]
+    assert service.n_users > N_USERS
+    assert service.recommend_batch(trained, TOP_N) == expected
+
+
+def make_svd_service(seed=0):
+    """Service over a truncated SVD of R itself, as collaborative_svd trains it."""
+    R = sparse_random(N_USERS, N_MOVIES, density=0.05, format="csr", dtype=np.float64, random_state=seed)
+    R.data = np.ceil(R.data * 5)
+    U, Sigma, Vt = svds(R, k=N_FACTORS)
+    return RecommenderService(U, Sigma, Vt, np.arange(N_USERS), np.arange(N_MOVIES) + 1, R.astype(np.float32)), R
+
+
+def test_projection_fold_in_reproduces_trained_rows():
+    service, R = make_svd_service()
+    users = np.arange(0, N_USERS, 11)
+    np.testing.assert_allclose(service.fold_in(R[users].astype(np.float32), "projection"),
+                               service.US[users], rtol=1e-4, atol=1e-4)
+
+    ratings = [{int(service.idx_to_movie[m]): float(r) for m, r in zip(R[u].indices, R[u].data)} for u in users]
+    assert service.recommend_for_ratings(ratings, TOP_N) == [service.recommend(int(u), TOP_N) for u in users]
+
+
+def test_ridge_fold_in_recovers_factors_of_consistent_ratings():
+    service, _ = make_svd_service()
+    rng = np.random.default_rng(2)
+    p = rng.standard_normal((3, N_FACTORS)).astype(np.float32)
+    rows, cols = np.repeat(np.arange(3), 40), np.concatenate([rng.choice(N_MOVIES, 40, replace=False) for _ in p])
+    # Observed ratings are exactly V_obs · p, so the ridge solve returns p (up to the tiny penalty)
+    values = np.einsum("nk,nk->n", service.Vt.T[cols], p[rows])
+    R = csr_matrix((values, (rows, cols)), shape=(3, N_MOVIES), dtype=np.float32)
+    np.testing.assert_allclose(service.fold_in(R, "ridge", reg=1e-6), p, atol=1e-3)
+
+
+def test_folded_users_are_served_until_merged():
+    service, R = make_svd_service()
+    ratings = [{1: 5.0, 2: 4.0, 3: 1.0}]
+    expected = service.recommend_for_ratings(ratings, TOP_N, user_ids=[10_001])[0]
+    assert service.recommend(10_001, TOP_N) == expected
+    assert service.merge_folded(save=False) == 1
+    assert service.n_users == N_USERS + 1 and service.recommend(10_001, TOP_N) == expected
+
+
+@pytest.mark.parametrize("request_", [
+    [1, 2],
+    {"users": [1, 2]},
+    {"users": {"5": [1]}},
+    {"ratings": [1, 2]},
+    {"userIds": 5},
+])
+def test_handle_rejects_malformed_requests(request_):
+    with pytest.raises(ValueError):
+        make_service().handle(request_)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(make_service()))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+@pytest.mark.parametrize("body", [
+    b'{"users": [1, 2]}',
+    b'{"users": {"5": [1]}}',
+    b'{"users": {"5": {"1": "x"}}}',
+    b'[1, 2]',
+    b'not json',
+])
+def test_http_answers_400_for_bad_bodies(server, body):
+    status, payload = post(f"{server}/fold-in", body)
+    assert status == 400
+    assert "error" in payload
+
+
+def test_http_fold_in_and_batch(server):
+    status, payload = post(f"{server}/fold-in", b'{"n": 10, "users": {"7": {"1": 5, "2": 4}}}')
+    assert status == 200 and len(payload["recommendations"]["7"]) == TOP_N
+    status, payload = post(f"{server}/recommend/batch", b'{"n": 10, "userIds": [0, 7, 99999]}')
+    assert status == 200 and set(payload["recommendations"]) == {"0", "7"}
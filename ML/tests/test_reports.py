@@ -0,0 +1,30 @@
+import json
+
+from reports import compare, save_json
+
+
+def test_compare_gates_costs_upwards_and_scores_downwards():
+    baseline = {"content": {"wall_time": 10.0, "peak_rss_mb": 100.0}, "svd": {"ndcg@10": 0.2, "coverage": 0.5}}
+    results = {"content": {"wall_time": 13.0, "peak_rss_mb": 90.0, "status": "ran"},
+               "svd": {"ndcg@10": 0.19, "coverage": 0.1}, "new": {"wall_time": 1.0}}
+
+    costs = compare(results, baseline, ("wall_time", "peak_rss_mb"), 0.25)
+    assert costs == ["content wall_time +30.0%"]
+    assert compare(results, baseline, ("wall_time", "peak_rss_mb"), 0.35) == []
+
+    # Only gated prefixes count: coverage falls 80% but is not a ranking metric
+    scores = compare(results, baseline, ("ndcg@",), 0.02, direction=-1)
+    assert scores == ["svd ndcg@10 -5.0%"]
+
+
+def test_compare_skips_missing_values():
+    baseline = {"content": {"wall_time": None, "peak_rss_mb": 0}}
+    results = {"content": {"wall_time": 5.0, "peak_rss_mb": None}}
+    assert compare(results, baseline, ("wall_time", "peak_rss_mb"), 0.25) == []
+
+
+def test_save_json_creates_directories(tmp_path):
+    path = str(tmp_path / "a" / "b.json")
+    save_json(path, {"x": 1})
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"x": 1}
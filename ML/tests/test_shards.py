@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+from scipy.sparse import random as sparse_random
+
+from conftest import ML_DIR
+from shards import (
+    item_ranges,
+    load_shards,
+    read_manifest,
+    user_shard,
+    user_shard_dir,
+    write_item_shards,
+    write_user_shard,
+)
+
+N_USERS, N_MOVIES, N_FACTORS = 90, 50, 4
+USER_SHARDS, ITEM_SHARDS = 4, 3
+DATABASE_SERVICE = os.path.join(os.path.dirname(ML_DIR), "backend", "src", "services", "database.service.js")
+
+
+@pytest.fixture
+def model():
+    rng = np.random.default_rng(0)
+    user_ids = np.sort(rng.choice(1_000_000, N_USERS, replace=False))
+    movie_ids = np.sort(rng.choice(10_000, N_MOVIES, replace=False))
+    U = rng.standard_normal((N_USERS, N_FACTORS)).astype(np.float32)
+    Sigma = np.array([4, 3, 2, 1], dtype=np.float32)
+    Vt = rng.standard_normal((N_FACTORS, N_MOVIES)).astype(np.float32)
+    R = sparse_random(N_USERS, N_MOVIES, density=0.2, format="csr", dtype=np.float32, random_state=0)
+
+    write_item_shards(Sigma, Vt, movie_ids, USER_SHARDS, ITEM_SHARDS, model={"engine": "svd", "history": [1]})
+    shards = user_shard(user_ids, USER_SHARDS)
+    for shard in range(USER_SHARDS):
+        rows = np.flatnonzero(shards == shard)
+        write_user_shard(shard, U[rows], user_ids[rows], R[rows])
+    return U, Sigma, Vt, user_ids, movie_ids, R
+
+
+def test_item_ranges_cover_every_column():
+    assert item_ranges(10, 3) == [(0, 3), (3, 7), (7, 10)]
+    assert item_ranges(2, 5) == [(0, 1), (1, 2)]
+
+
+def test_manifest_and_full_load_round_trip(model):
+    U, Sigma, Vt, user_ids, movie_ids, R = model
+    manifest = read_manifest()
+    assert manifest["user_shards"] == USER_SHARDS and len(manifest["items"]) == ITEM_SHARDS
+    assert manifest["model"] == {"engine": "svd"}
+    assert [item["columns"] for item in manifest["items"]] == [list(r) for r in item_ranges(N_MOVIES, ITEM_SHARDS)]
+
+    loaded = load_shards()
+    for actual, expected in zip(loaded, (U, Sigma, Vt, user_ids, movie_ids)):
+        np.testing.assert_array_equal(np.asarray(actual), expected)
+    assert (loaded[5] != R).nnz == 0
+
+
+def test_partial_load_selects_users_and_columns(model):
+    U, _, Vt, user_ids, movie_ids, R = model
+    rows = np.flatnonzero(user_shard(user_ids, USER_SHARDS) == 1)
+    ranges = item_ranges(N_MOVIES, ITEM_SHARDS)
+    columns = np.concatenate([np.arange(*ranges[0]), np.arange(*ranges[2])])
+
+    U_s, _, Vt_s, user_ids_s, movie_ids_s, R_s = load_shards(user_shards=[1], item_shards=[0, 2])
+    np.testing.assert_array_equal(user_ids_s, user_ids[rows])
+    np.testing.assert_array_equal(np.asarray(U_s), U[rows])
+    np.testing.assert_array_equal(movie_ids_s, movie_ids[columns])
+    np.testing.assert_array_equal(Vt_s, Vt[:, columns])
+    np.testing.assert_array_equal(R_s.toarray(), R[rows][:, columns].toarray())
+
+
+def test_missing_user_shard_is_reported(model):
+    os.remove(os.path.join(user_shard_dir(2), "meta.json"))  # written last: the shard is incomplete
+    with pytest.raises(FileNotFoundError):
+        load_shards(user_shards=[2])
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_backend_user_shard_matches_python():
+    user_ids = [0, 1, 7, 123, 65_535, 2 ** 31 - 1, 4_000_000_000, 987_654_321]
+    script = (f"import({json.dumps('file://' + DATABASE_SERVICE)}).then(m => console.log(JSON.stringify("
+              f"{json.dumps(user_ids)}.map(id => [3, 8, 17].map(n => m.userShard(id, n))))))")
+    output = subprocess.run(["node", "--input-type=module", "-e", script], capture_output=True, text=True, check=True)
+    expected = [[int(user_shard([uid], n)[0]) for n in (3, 8, 17)] for uid in user_ids]
+    assert json.loads(output.stdout.strip().splitlines()[-1]) == expected
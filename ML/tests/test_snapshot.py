@@ -0,0 +1,53 @@
+import shutil
+
+import mongomock
+import numpy as np
+import pytest
+
+import snapshot
+from config import RATINGS_COLLECTION
+
+
+@pytest.fixture
+def ratings(monkeypatch):
+    collection = mongomock.MongoClient().db.ratings
+    collection.insert_many([
+        {"userId": user, "movieId": 100 * user + i, "rating": 4.0, "timestamp": 0}
+        for user, n in [(7, 3), (2, 5), (9, 3), (4, 1)] for i in range(n)
+    ])
+    monkeypatch.setattr(snapshot, "is_mongodb_available", lambda: True)
+    monkeypatch.setitem(snapshot._SOURCES, RATINGS_COLLECTION, (lambda: collection, snapshot._export_ratings))
+    yield collection
+    for name in (RATINGS_COLLECTION, snapshot.USER_COUNTS):
+        shutil.rmtree(snapshot.snapshot_dir(name), ignore_errors=True)
+
+
+def test_user_counts_follow_the_ratings_snapshot(ratings):
+    assert snapshot.get_user_counts() is None
+
+    snapshot.ensure_snapshot(RATINGS_COLLECTION)
+    users, counts = snapshot.get_user_counts()
+    np.testing.assert_array_equal(users, [2, 7, 9, 4])  # most ratings first, ties by id
+    np.testing.assert_array_equal(counts, [5, 3, 3, 1])
+    assert len(snapshot.get_ratings()["userId"]) == 12
+
+    ratings.insert_one({"userId": 4, "movieId": 999, "rating": 3.0, "timestamp": 0})
+    snapshot.ensure_snapshot(RATINGS_COLLECTION)  # without refresh the snapshot is used as-is
+    np.testing.assert_array_equal(snapshot.get_user_counts()[1], [5, 3, 3, 1])
+
+    snapshot.ensure_snapshot(RATINGS_COLLECTION, refresh=True)
+    users, counts = snapshot.get_user_counts()
+    np.testing.assert_array_equal(users, [2, 7, 9, 4])
+    np.testing.assert_array_equal(counts, [5, 3, 3, 2])
+
+
+def test_stale_user_counts_are_ignored(ratings):
+    snapshot.ensure_snapshot(RATINGS_COLLECTION)
+    shutil.rmtree(snapshot.snapshot_dir(snapshot.USER_COUNTS))
+    assert snapshot.get_user_counts() is None
+
+    snapshot.ensure_snapshot(RATINGS_COLLECTION, refresh=True)  # up to date, counts written again
+    assert snapshot.get_user_counts() is not None
+
+    snapshot.write_snapshot(snapshot.USER_COUNTS, {"userId": np.array([1]), "n": np.array([1])}, {"count": 0})
+    assert snapshot.get_user_counts() is None
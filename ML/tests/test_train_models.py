@@ -0,0 +1,44 @@
+import ast
+import dataclasses
+import os
+
+import pytest
+
+import train_models
+from conftest import ML_DIR
+
+
+def local_imports(module, seen=None):
+    """ML/ modules imported at module level by `module`, followed recursively."""
+    seen = set() if seen is None else seen
+    with open(os.path.join(ML_DIR, f"{module}.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module:
+            names = [node.module]
+        elif isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        else:
+            continue
+        for name in names:
+            if name not in seen and os.path.exists(os.path.join(ML_DIR, f"{name}.py")):
+                seen.add(name)
+                local_imports(name, seen)
+    return seen
+
+
+@pytest.mark.parametrize("stage", train_models.STAGES, ids=lambda stage: stage.name)
+def test_stage_sources_cover_its_imports(stage):
+    module = stage.target.split(":")[0]
+    sources = {os.path.basename(path)[:-3] for path in stage.inputs + train_models.COMMON_SOURCES
+               if path.endswith(".py")}
+    assert local_imports(module) | {module} <= sources
+
+
+def test_stage_settings_change_the_digest():
+    stage = next(stage for stage in train_models.STAGES if stage.name == "collab")
+    cache = {}
+    digest = train_models.inputs_digest(stage, cache)
+    assert train_models.inputs_digest(stage, cache) == digest
+    switched = dataclasses.replace(stage, settings={**stage.settings, "engine": "other"})
+    assert train_models.inputs_digest(switched, cache) != digest
@@ -1,18 +1,33 @@
-import json
-import warnings
+from pathlib import Path
+
 import joblib
 import numpy as np
-import pandas as pd
+from scipy.sparse import csr_matrix, vstack
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-
+from sklearn.preprocessing import normalize
+
+from artifacts import save_dense, save_sparse, load_sparse, sparse_exists
+from instrumentation import span, count, traced, stage_trace
+from incremental import source_digest, feature_hashes, load_state, save_state, plan_update, update_neighbors
+from snapshot import get_movies, snapshot_watermark
+from neighbor_table import write_outputs, write_neighbor_table, indices_to_ids
+from neighbors import top_k_block, sparse_cosine_top_k, neighbors_to_dict
+from parallel import map_row_blocks, resolve_n_jobs
 from config import (
-    OUT_MOVIES_JSON,
+    OUT_TFIDF_JSON,
+    OUT_TFIDF_BIN,
+    OUTPUT_FORMAT,
     TFIDF_VECTORIZER_PATH,
     TFIDF_MATRIX_PATH,
+    TFIDF_MOVIE_IDS_PATH,
     TOP_N_SIMILAR,
-    is_mongodb_available,
-    get_movies_collection,
+    SIMILARITY_BLOCK_SIZE,
+    TFIDF_NEIGHBORS_PATH,
+    TFIDF_SIMILARITY_MODE,
+    TFIDF_MIN_SIMILARITY,
+    INCREMENTAL_TRAINING,
+    MOVIES_COLLECTION,
 )
 
 # ──────────────────────────────────────────────────────────────
@@ -23,21 +38,90 @@ from config import (
 MAX_FEATURES = 6500
 GENRE_WEIGHT = 3
 MAX_OVERVIEW_LENGTH = 1200
-
-
-def run():
+TEXT_COLUMNS = ["movieId", "genres", "overview"]
+
+
+def iter_cosine_blocks(tfidf_matrix, block_size=SIMILARITY_BLOCK_SIZE):
+    """Yield (start, stop, block) of dense cosine similarities, `block_size` rows at a time."""
+    n_rows = tfidf_matrix.shape[0]
+    block_size = max(1, int(block_size))
+    for start in range(0, n_rows, block_size):
+        stop = min(start + block_size, n_rows)
+        block = cosine_similarity(tfidf_matrix[start:stop], tfidf_matrix)
+        yield start, stop, block.astype(np.float32, copy=False)
+
+
+def dense_cosine_worker(arrays, start, stop, k=TOP_N_SIMILAR):
+    """Row-block worker: dense cosine block for rows [start, stop) reduced to top-K."""
+    matrix = arrays["matrix"]
+    with span("similarity"):
+        block = cosine_similarity(matrix[start:stop], matrix).astype(np.float32, copy=False)
+        count("pairs", block.size)
+    return top_k_block(block, k, row_offset=start)
+
+
+@traced("neighbors")
+def compute_neighbors(tfidf_matrix, k=TOP_N_SIMILAR, mode=TFIDF_SIMILARITY_MODE,
+                      block_size=SIMILARITY_BLOCK_SIZE, n_jobs=None):
+    """Top-K cosine (indices, scores) for every TF-IDF row in `mode` ("sparse" or "dense")."""
+    if mode == "sparse":
+        return sparse_cosine_top_k(
+            tfidf_matrix,
+            k=k,
+            block_size=block_size,
+            threshold=TFIDF_MIN_SIMILARITY,
+            n_jobs=n_jobs,
+        )
+
+    results = map_row_blocks(
+        dense_cosine_worker,
+        {"matrix": tfidf_matrix},
+        n_rows=tfidf_matrix.shape[0],
+        block_size=block_size,
+        n_jobs=n_jobs,
+        k=k,
+    )
+    indices = np.vstack([idx for idx, _ in results])
+    scores = np.vstack([sc for _, sc in results])
+    return indices, scores
+
+
+def update_matrix(old_matrix, plan, changed_rows):
+    """TF-IDF rows in the plan's order: saved rows for unchanged movies, `changed_rows` for the rest."""
+    n_rows = len(plan["order"])
+    stacked = vstack([
+        old_matrix[plan["old_rows"]],
+        csr_matrix((n_rows - len(plan["old_rows"]), old_matrix.shape[1]), dtype=old_matrix.dtype),
+        changed_rows.astype(old_matrix.dtype),
+    ]).tocsr()
+    take = np.arange(n_rows)
+    take[plan["changed"]] = n_rows + np.arange(len(plan["changed"]))
+    return stacked[take]
+
+
+def incremental_params():
+    """Settings an incremental update must share with the state it starts from."""
+    return {"k": TOP_N_SIMILAR, "mode": TFIDF_SIMILARITY_MODE, "min_similarity": TFIDF_MIN_SIMILARITY,
+            "max_features": MAX_FEATURES, "genre_weight": GENRE_WEIGHT,
+            "max_overview_length": MAX_OVERVIEW_LENGTH, "source": source_digest(__file__)}
+
+
+def run(incremental=INCREMENTAL_TRAINING):
+    """
+    Train TF-IDF neighbours. With `incremental`, only movies added or changed
+    since the last run are transformed and rescored with the saved vectorizer
+    (falls back to a full run when no usable state exists).
+    """
     print("TF-IDF model training started...")
     print("→ Using cosine similarity for text features")
     print("→ Filtering to movies with descriptions/overviews")
 
-    if not is_mongodb_available():
-        print("❌ MongoDB not available. Cannot continue.")
-        return
-
-    movies_col = get_movies_collection()
-    print("Loading movies from MongoDB...")
+    print("Loading movies from snapshot...")
 
-    df = pd.DataFrame(list(movies_col.find({}, {"_id": 0})))
+    df = get_movies(columns=TEXT_COLUMNS)
+    if df is None:
+        print("❌ MongoDB not available and no movies snapshot found. Cannot continue.")
+        return
     if df.empty:
         print("❌ No movies found in collection.")
         return
@@ -62,58 +146,95 @@ def run():
     # Weighted combination: repeat genres (genres are more reliable)
     df["text"] = (df["genres"] + " ") * GENRE_WEIGHT + df["overview"]
 
-    # ── Build TF-IDF ─────────────────────────────────────────────
-    print("Building TF-IDF with cosine similarity...")
-    tfidf = TfidfVectorizer(
-        stop_words="english",
-        max_features=MAX_FEATURES,
-        ngram_range=(1, 2),
-        min_df=3,
-        dtype=np.float32
-    )
-
-    tfidf_matrix = tfidf.fit_transform(df["text"])
-
-    print(f"→ TF-IDF matrix shape: {tfidf_matrix.shape}")
-    print(f"→ Vocabulary size: {len(tfidf.get_feature_names_out())}")
-
-    # ── Calculate cosine similarity ──────────────────────────────
-    print("Calculating cosine similarity...")
-    cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-    print(f"→ Similarity matrix shape: {cosine_sim.shape}")
+    hashes = feature_hashes(df, ["text"])
+    watermark = snapshot_watermark(MOVIES_COLLECTION)
+    state = load_state("tfidf", incremental_params()) if incremental else None
+    if state is not None and not (df["movieId"].is_unique and Path(TFIDF_VECTORIZER_PATH).exists()
+                                  and sparse_exists(TFIDF_MATRIX_PATH)):
+        state = None
+    if incremental and state is None:
+        print("⚠️  No usable incremental state — running a full rebuild")
+
+    if state is not None and state["watermark"] == watermark:
+        # Nothing to rescore, but outputs may be missing or due in another
+        # OUTPUT_FORMAT: the empty update below rewrites them from the saved state
+        print("→ Movies snapshot unchanged since the last run — rewriting outputs from the saved state")
+
+    if state is not None:
+        # ── Incremental update ───────────────────────────────────
+        plan = plan_update(state, df["movieId"].to_numpy(), hashes)
+        df, hashes = df.iloc[plan["order"]].copy(), hashes[plan["order"]]
+        print(f"→ Incremental update: {len(plan['changed']):,} new/changed, "
+              f"{plan['removed']:,} removed, {len(plan['stale']):,} lists to rebuild")
+
+        # Fixed vocabulary / idf: only new and changed texts are transformed
+        tfidf = joblib.load(TFIDF_VECTORIZER_PATH)
+        with span("vectorize"):
+            old_matrix = load_sparse(TFIDF_MATRIX_PATH, mmap=False)
+            changed_rows = (tfidf.transform(df["text"].iloc[plan["changed"]]) if len(plan["changed"])
+                            else csr_matrix((0, old_matrix.shape[1]), dtype=old_matrix.dtype))
+            tfidf_matrix = update_matrix(old_matrix, plan, changed_rows)
+            count("rows", len(plan["changed"]))
+        unit = normalize(tfidf_matrix)
+        neighbor_idx, neighbor_scores = update_neighbors(
+            lambda rows: (unit[rows] @ unit.T).toarray(), plan, TOP_N_SIMILAR,
+            threshold=TFIDF_MIN_SIMILARITY if TFIDF_SIMILARITY_MODE == "sparse" else None,
+        )
+        save_sparse(TFIDF_MATRIX_PATH, tfidf_matrix)
+    else:
+        # ── Build TF-IDF ─────────────────────────────────────────────
+        print("Building TF-IDF with cosine similarity...")
+        tfidf = TfidfVectorizer(
+            stop_words="english",
+            max_features=MAX_FEATURES,
+            ngram_range=(1, 2),
+            min_df=3,
+            dtype=np.float32
+        )
+
+        with span("vectorize"):
+            tfidf_matrix = tfidf.fit_transform(df["text"])
+            count("rows", tfidf_matrix.shape[0])
+            count("nnz", tfidf_matrix.nnz)
+
+        print(f"→ TF-IDF matrix shape: {tfidf_matrix.shape}")
+        print(f"→ Vocabulary size: {len(tfidf.get_feature_names_out())}")
+
+        # ── Calculate cosine similarity + top-K ─────────────────────
+        print(f"Calculating cosine similarity with streaming top-K ({TFIDF_SIMILARITY_MODE} mode)...")
+        print(f"→ Block size: {SIMILARITY_BLOCK_SIZE:,} rows, workers: {resolve_n_jobs()}")
+        neighbor_idx, neighbor_scores = compute_neighbors(tfidf_matrix)
+
+        # ── Save artifacts ───────────────────────────────────────────
+        print("Saving TF-IDF model and matrix...")
+        with span("save_model"):
+            joblib.dump(tfidf, TFIDF_VECTORIZER_PATH, compress=3)
+            save_sparse(TFIDF_MATRIX_PATH, tfidf_matrix)
 
-    # ── Save artifacts ───────────────────────────────────────────
-    print("Saving TF-IDF model and matrix...")
-    joblib.dump(tfidf, TFIDF_VECTORIZER_PATH, compress=3)
-    joblib.dump(tfidf_matrix, TFIDF_MATRIX_PATH, compress=3)
+    movie_ids = df["movieId"].tolist()
+    save_dense(TFIDF_MOVIE_IDS_PATH, movie_ids, dtype=np.int64)
+    save_state("tfidf", movie_ids, hashes, neighbor_idx, neighbor_scores, watermark, incremental_params())
+    print(f"→ Neighbour table shape: {neighbor_idx.shape}")
 
     # ── Generate recommendations ─────────────────────────────────
     print("Generating TF-IDF recommendations...")
-    recommendations = {}
-    movie_ids = df["movieId"].tolist()
-
-    for idx, movie_id in enumerate(movie_ids):
-        # Get similarity scores for this movie
-        sim_scores = cosine_sim[idx]
-        
-        # Get indices of most similar movies (excluding itself)
-        similar_indices = np.argsort(sim_scores)[::-1][1:TOP_N_SIMILAR + 1]
-        
-        # Get movie IDs of similar movies
-        similar_movie_ids = [movie_ids[i] for i in similar_indices]
-        
-        recommendations[str(movie_id)] = similar_movie_ids
+    recommendations = neighbors_to_dict(movie_ids, neighbor_idx)
 
     # ── Save TF-IDF recommendations ──────────────────────────────
-    tfidf_output = OUT_MOVIES_JSON.replace("movies.json", "tfidf_recommendations.json")
-    print(f"Saving TF-IDF recommendations to {tfidf_output}...")
-    with open(tfidf_output, "w", encoding="utf-8") as f:
-        json.dump(recommendations, f, indent=2)
+    print(f"Saving TF-IDF recommendations to {OUT_TFIDF_JSON} ({OUTPUT_FORMAT})...")
+    neighbor_ids = indices_to_ids(movie_ids, neighbor_idx)
+    write_outputs(
+        OUT_TFIDF_JSON, OUT_TFIDF_BIN, recommendations,
+        keys=movie_ids, neighbors=neighbor_ids, scores=neighbor_scores,
+    )
+    # Scored neighbour table for the hybrid blender (always written)
+    write_neighbor_table(TFIDF_NEIGHBORS_PATH, movie_ids, neighbor_ids, neighbor_scores)
 
     print(f"✅ TF-IDF model complete!")
     print(f"   → {len(recommendations):,} movies with recommendations")
-    print(f"   → Saved to: {tfidf_output}")
+    print(f"   → Saved to: {OUT_TFIDF_JSON}")
 
 
 if __name__ == "__main__":
-    run()
+    with stage_trace("tfidf"):
+        run()
@@ -1,85 +1,461 @@
 """
-Full ML pipeline (MongoDB-based):
-1. Content-Based (TF-IDF + Cosine)
-2. Collaborative Filtering (SVD)
-3. Hybrid Recommendation
+Full ML pipeline (MongoDB-based), run as a small DAG:
+
+    snapshot ─┬─ content (Jaccard + Cosine) ─┐
+              ├─ tfidf (TF-IDF + Cosine) ────┼─ hybrid
+              └─ collab (SVD) ───────────────┘
+                 tfidf + collab ────────────── ann (IVF indexes)
+                 collab ────────────────────── quantize (int8 / float16 factors)
+
+Each stage declares its input and output files; a stage depends on the
+stages producing its inputs. Independent stages run concurrently in
+separate processes (PIPELINE_JOBS). A stage is skipped when the content
+hashes of its inputs (snapshot, upstream artifacts, its source code) and the
+environment-driven settings it runs with (Stage.settings) match
+the last successful run and its outputs still exist. Per-stage wall time
+and peak RSS are written to PIPELINE_DIR/run_report.json; with ML_TRACE=1
+each stage also writes a span trace (see instrumentation.py).
 
 Run:
     python train_models.py
+    python train_models.py --refresh   # re-export changed collections to the snapshot cache
+    python train_models.py --force     # run every stage regardless of input hashes
+    python train_models.py --incremental  # content / TF-IDF rescore only new or changed movies
 """
 
+import argparse
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import sys
 import time
-from typing import Callable
+import traceback
+from dataclasses import dataclass, field
+from multiprocessing.connection import wait
+from typing import Dict, List
 
-from config import is_mongodb_available, close_mongodb_connection
-from content_based import run as run_content
-from collaborative_svd import run as run_collab
-from hybrid import run as run_hybrid
+from artifacts import sparse_paths
+from instrumentation import stage_trace, span
+from reports import save_json
+from config import (
+    close_mongodb_connection,
+    MOVIES_COLLECTION,
+    RATINGS_COLLECTION,
+    BASE_DIR,
+    PIPELINE_DIR,
+    PIPELINE_JOBS,
+    INCREMENTAL_TRAINING,
+    OUTPUT_FORMAT,
+    OUT_MOVIES_JSON,
+    OUT_MOVIE_INDEX,
+    OUT_CONTENT_BASED,
+    OUT_TFIDF_JSON,
+    OUT_HYBRID_JSON,
+    OUT_CONTENT_BASED_BIN,
+    OUT_TFIDF_BIN,
+    OUT_HYBRID_BIN,
+    OUT_USER_RECS,
+    OUT_USER_RECS_BIN,
+    CONTENT_NEIGHBORS_PATH,
+    TFIDF_NEIGHBORS_PATH,
+    TFIDF_VECTORIZER_PATH,
+    TFIDF_MATRIX_PATH,
+    TFIDF_MOVIE_IDS_PATH,
+    SVD_U_PATH,
+    SVD_SIGMA_PATH,
+    SVD_Vt_PATH,
+    SVD_RATINGS_PATH,
+    USER_IDS_PATH,
+    MOVIE_IDS_PATH,
+    ANN_DIR,
+    QUANT_DIR,
+    SHARD_MANIFEST_PATH,
+    OUT_USER_SHARDS_INDEX,
+    USER_SHARDS,
+    ITEM_SHARDS,
+    SVD_META_PATH,
+    FACTOR_QUANTIZATION,
+    COLLAB_ENGINE,
+    N_FACTORS,
+    ALS_ITERATIONS,
+    ALS_REG,
+    ALS_ALPHA,
+    ALS_SOLVER,
+    ALS_CG_STEPS,
+)
+from snapshot import ensure_snapshot, refresh_all, snapshot_dir
 
+STATE_PATH = os.path.join(PIPELINE_DIR, "state.json")
+REPORT_PATH = os.path.join(PIPELINE_DIR, "run_report.json")
+HASH_CHUNK = 1 << 20
 
-def run_step(name: str, func: Callable[[], None]) -> bool:
-    """Run a pipeline step with timing and error handling."""
-    print("\n" + "═" * 70)
-    print(f" STARTING: {name.upper()} ".center(70))
-    print("═" * 70 + "\n")
 
+# ──────────────────────────────────────────────────────────────
+# Stage declarations
+# ──────────────────────────────────────────────────────────────
+
+@dataclass
+class Stage:
+    name: str
+    title: str
+    target: str                      # "module:function", imported in the stage process
+    inputs: List[str]
+    outputs: List[str]
+    depends_on: List[str] = field(default_factory=list)
+    kwargs: Dict[str, object] = field(default_factory=dict)  # passed to the target
+    incremental: bool = False        # target accepts incremental=True (see incremental.py)
+    settings: Dict[str, object] = field(default_factory=dict)  # effective config hashed with the inputs
+
+
+def _source(*modules):
+    return [os.path.join(BASE_DIR, f"{module}.py") for module in modules]
+
+
+def _format_outputs(json_path, bin_path):
+    """The recommendation files OUTPUT_FORMAT makes a stage write."""
+    return {"json": [json_path], "binary": [bin_path], "both": [json_path, bin_path]}[OUTPUT_FORMAT]
+
+
+# Shared code: a change here invalidates every stage
+COMMON_SOURCES = _source("config", "artifacts", "neighbors", "neighbor_table", "parallel", "snapshot", "incremental",
+                         "instrumentation", "loader", "reports")
+
+# Environment-driven settings are not in any hashed file: each stage hashes
+# the values it ran with, so switching e.g. ML_COLLAB_ENGINE retrains
+FORMAT_SETTINGS = {"output_format": OUTPUT_FORMAT}
+COLLAB_SETTINGS = {
+    **FORMAT_SETTINGS,
+    "engine": COLLAB_ENGINE,
+    "factors": N_FACTORS,
+    "user_shards": USER_SHARDS,
+    "item_shards": ITEM_SHARDS,
+    **({"als": {"iterations": ALS_ITERATIONS, "reg": ALS_REG, "alpha": ALS_ALPHA,
+                "solver": ALS_SOLVER, "cg_steps": ALS_CG_STEPS}} if COLLAB_ENGINE == "als" else {}),
+}
+
+SVD_ARTIFACTS = [SVD_U_PATH, SVD_SIGMA_PATH, SVD_Vt_PATH, USER_IDS_PATH, MOVIE_IDS_PATH,
+                 *sparse_paths(SVD_RATINGS_PATH).values()]
+
+STAGES = [
+    Stage(
+        "content", "Content-based model (Jaccard + Cosine)", "content_based:run", incremental=True,
+        settings=FORMAT_SETTINGS,
+        inputs=[snapshot_dir(MOVIES_COLLECTION), *_source("content_based", "movie_index")],
+        outputs=[CONTENT_NEIGHBORS_PATH, OUT_MOVIES_JSON, OUT_MOVIE_INDEX,
+                 *_format_outputs(OUT_CONTENT_BASED, OUT_CONTENT_BASED_BIN)],
+    ),
+    Stage(
+        "tfidf", "TF-IDF model (Cosine)", "tfidf_model:run", incremental=True,
+        settings=FORMAT_SETTINGS,
+        inputs=[snapshot_dir(MOVIES_COLLECTION), *_source("tfidf_model")],
+        outputs=[TFIDF_NEIGHBORS_PATH, TFIDF_VECTORIZER_PATH, TFIDF_MOVIE_IDS_PATH,
+                 *sparse_paths(TFIDF_MATRIX_PATH).values(),
+                 *_format_outputs(OUT_TFIDF_JSON, OUT_TFIDF_BIN)],
+    ),
+    Stage(
+        "collab", "Collaborative filtering (SVD)", "collaborative_svd:run", settings=COLLAB_SETTINGS,
+        inputs=[snapshot_dir(RATINGS_COLLECTION), *_source("collaborative_svd", "shards", "als")],
+        outputs=[*SVD_ARTIFACTS, SVD_META_PATH,
+                 *_format_outputs(OUT_USER_RECS, OUT_USER_RECS_BIN.format(kind="collaborative")),
+                 *([SHARD_MANIFEST_PATH, OUT_USER_SHARDS_INDEX] if USER_SHARDS > 0 else [])],
+    ),
+    Stage(
+        "hybrid", "Hybrid recommendation blending", "hybrid:run", settings=FORMAT_SETTINGS,
+        inputs=[CONTENT_NEIGHBORS_PATH, TFIDF_NEIGHBORS_PATH, *SVD_ARTIFACTS,
+                snapshot_dir(RATINGS_COLLECTION), *_source("hybrid")],
+        outputs=[*_format_outputs(OUT_USER_RECS, OUT_USER_RECS_BIN.format(kind="hybrid")),
+                 *_format_outputs(OUT_HYBRID_JSON, OUT_HYBRID_BIN)],
+    ),
+    Stage(
+        "ann", "Approximate nearest-neighbour indexes", "ann:run",
+        inputs=[*SVD_ARTIFACTS, TFIDF_MOVIE_IDS_PATH, *sparse_paths(TFIDF_MATRIX_PATH).values(), *_source("ann")],
+        outputs=[os.path.join(ANN_DIR, "svd_items"), os.path.join(ANN_DIR, "tfidf"),
+                 os.path.join(ANN_DIR, "report.json")],
+    ),
+    Stage(
+        "quantize", "Quantized SVD factors", "quantize:run", settings={"mode": FACTOR_QUANTIZATION},
+        inputs=[*SVD_ARTIFACTS, *_source("quantize")],
+        outputs=[os.path.join(QUANT_DIR, f"US.{FACTOR_QUANTIZATION}.codes.npy"),
+                 os.path.join(QUANT_DIR, f"V.{FACTOR_QUANTIZATION}.codes.npy"),
+                 os.path.join(QUANT_DIR, "report.json")],
+    ),
+]
+
+
+def resolve_dependencies(stages):
+    """Fill `depends_on` from the declared files: a stage depends on every producer of its inputs."""
+    producers = {path: stage.name for stage in stages for path in stage.outputs}
+    for stage in stages:
+        stage.depends_on = sorted({producers[path] for path in stage.inputs
+                                   if path in producers and producers[path] != stage.name})
+    return stages
+
+
+# ──────────────────────────────────────────────────────────────
+# Content hashes
+# ──────────────────────────────────────────────────────────────
+
+def file_digest(path, cache):
+    """blake2b of a file, reused from `cache` while its size and mtime are unchanged."""
+    stat = os.stat(path)
+    key = [stat.st_size, stat.st_mtime_ns]
+    cached = cache.get(path)
+    if cached and cached["key"] == key:
+        return cached["digest"]
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    cache[path] = {"key": key, "digest": digest.hexdigest()}
+    return cache[path]["digest"]
+
+
+def path_digest(path, cache):
+    """Digest of a file or of every file below a directory ("missing" if absent)."""
+    if os.path.isfile(path):
+        return file_digest(path, cache)
+    if not os.path.isdir(path):
+        return "missing"
+    digest = hashlib.blake2b(digest_size=16)
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            digest.update(os.path.relpath(full, path).encode("utf-8"))
+            digest.update(file_digest(full, cache).encode("ascii"))
+    return digest.hexdigest()
+
+
+def inputs_digest(stage, cache):
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(set(stage.inputs + COMMON_SOURCES)):
+        digest.update(path.encode("utf-8"))
+        digest.update(path_digest(path, cache).encode("ascii"))
+    digest.update(json.dumps(stage.settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_state():
+    if not os.path.exists(STATE_PATH):
+        return {"stages": {}, "files": {}}
+    with open(STATE_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ──────────────────────────────────────────────────────────────
+# Stage processes
+# ──────────────────────────────────────────────────────────────
+
+def peak_rss_mb():
+    """(own, children) peak resident set size in MB; (None, None) where `resource` is unavailable."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None, None
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # bytes on macOS, KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+
+def _stage_process(name, target, kwargs, conn):
+    """Entry point of a stage process: run `target` and send back timing / memory (and the trace path)."""
     start = time.time()
+    error = trace = None
     try:
-        func()
-        elapsed = time.time() - start
-        print(f"\n✓ {name} completed successfully in {elapsed:.1f} seconds")
-        return True
+        module_name, func_name = target.split(":")
+        with stage_trace(name) as trace:
+            with span("import"):
+                func = getattr(importlib.import_module(module_name), func_name)
+            func(**kwargs)
     except Exception as e:
-        elapsed = time.time() - start
-        print(f"\n❌ {name} FAILED after {elapsed:.1f} seconds")
-        print(f"   Error: {e}")
-        return False
-    finally:
-        print("-" * 70)
+        error = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    own, children = peak_rss_mb()
+    conn.send({"wall_time": round(time.time() - start, 3), "error": error,
+               "peak_rss_mb": own, "workers_peak_rss_mb": children, "trace": trace})
+    conn.close()
 
 
-def main():
-    print("🚀 Starting complete ML training pipeline")
-    print(f"   Current time: {time.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"   MongoDB available: {'YES' if is_mongodb_available() else 'NO'}")
-    print("-" * 70 + "\n")
+def _start_stage(stage):
+    print("\n" + "═" * 70)
+    print(f" STARTING: {stage.title.upper()} ".center(70))
+    print("═" * 70 + "\n")
+    sys.stdout.flush()
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_stage_process, args=(stage.name, stage.target, stage.kwargs, sender),
+                                      name=stage.name)
+    process.start()
+    sender.close()
+    return process, receiver
+
+
+def _finish_stage(stage, process, receiver):
+    process.join()
+    if receiver.poll():
+        result = receiver.recv()
+    else:
+        result = {"wall_time": None, "error": f"process exited with code {process.exitcode}",
+                  "peak_rss_mb": None, "workers_peak_rss_mb": None}
+    receiver.close()
+
+    result["status"] = "failed" if result["error"] else "ran"
+    if result["error"]:
+        print(f"\n❌ {stage.title} FAILED: {result['error']}")
+    else:
+        print(f"\n✓ {stage.title} completed successfully in {result['wall_time']:.1f} seconds")
+    print("-" * 70)
+    return result
+
+
+# ──────────────────────────────────────────────────────────────
+# Scheduler
+# ──────────────────────────────────────────────────────────────
 
-    if not is_mongodb_available():
-        raise RuntimeError("MongoDB is not available. Please start MongoDB.")
+def run_pipeline(stages, jobs=PIPELINE_JOBS, force=False):
+    """
+    Run `stages` in dependency order, up to `jobs` at a time.
+    Returns {stage name: result dict}; status is "ran", "skipped", "failed" or "blocked".
+    """
+    stages = resolve_dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    state = load_state()
+    results = {}
+    running = {}  # process sentinel → (stage, process, receiver, input digest)
+    pending = [stage.name for stage in stages]
 
-    # Step 1: Content-based
-    content_ok = run_step("Content-based model (TF-IDF)", run_content)
+    while pending or running:
+        # Start (or skip) every stage whose dependencies are done
+        waiting = len(pending)
+        for name in list(pending):
+            stage = by_name[name]
+            dep_status = [results.get(dep, {}).get("status") for dep in stage.depends_on]
+            if any(status in ("failed", "blocked") for status in dep_status):
+                pending.remove(name)
+                results[name] = {"status": "blocked", "blocked_by": stage.depends_on}
+                print(f"⚠️  {stage.title}: skipped, an upstream stage failed")
+                continue
+            if not all(status in ("ran", "skipped") for status in dep_status):
+                continue
+            if len(running) >= max(1, jobs):
+                break
 
-    # Step 2: Collaborative filtering
-    collab_ok = run_step("Collaborative filtering (SVD)", run_collab)
+            pending.remove(name)
+            digest = inputs_digest(stage, state["files"])
+            previous = state["stages"].get(name, {})
+            if (not force and previous.get("inputs") == digest
+                    and all(os.path.exists(path) for path in stage.outputs)):
+                results[name] = {"status": "skipped", "inputs": digest}
+                print(f"→ {stage.title}: inputs unchanged, skipped")
+                continue
 
-    # Step 3: Hybrid recommendations
-    hybrid_ok = run_step("Hybrid recommendation blending", run_hybrid)
+            process, receiver = _start_stage(stage)
+            running[process.sentinel] = (stage, process, receiver, digest)
 
-    # Close MongoDB connection
+        if not running:
+            if pending and len(pending) == waiting:
+                raise RuntimeError(f"Unresolvable stage dependencies: {pending}")
+            continue
+
+        for sentinel in wait(list(running)):
+            stage, process, receiver, digest = running.pop(sentinel)
+            result = _finish_stage(stage, process, receiver)
+            result["inputs"] = digest
+            results[stage.name] = result
+            if result["status"] == "ran":
+                state["stages"][stage.name] = {"inputs": digest, "finished": time.time()}
+            else:
+                state["stages"].pop(stage.name, None)  # outputs may be partial: never skip next time
+            save_json(STATE_PATH, state)
+
+    save_json(STATE_PATH, state)
+    return results
+
+
+def write_report(results, started, stages):
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+        "wall_time": round(time.time() - started, 3),
+        "jobs": PIPELINE_JOBS,
+        "stages": {
+            stage.name: {"title": stage.title, "depends_on": stage.depends_on, **results.get(stage.name, {})}
+            for stage in stages
+        },
+    }
+    save_json(REPORT_PATH, report)
+    return report
+
+
+def main(refresh: bool = False, force: bool = False, jobs: int = PIPELINE_JOBS, incremental: bool = INCREMENTAL_TRAINING):
+    started = time.time()
+    print("🚀 Starting complete ML training pipeline")
+    print(f"   Current time: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+    # MongoDB is connected lazily: without --refresh only a missing snapshot needs it
+    print(f"   MongoDB: {'checked for changes' if refresh else 'only used if a snapshot is missing'}")
+    print(f"   Parallel stages: {jobs}")
+    print("-" * 70 + "\n")
+
+    # Snapshots are exported once and shared by every stage
+    if refresh:
+        refresh_all()
+    snapshots_ok = all(
+        ensure_snapshot(name) is not None for name in (MOVIES_COLLECTION, RATINGS_COLLECTION)
+    )
+
+    # Stages only read the snapshot: close MongoDB before starting stage processes
     try:
         close_mongodb_connection()
         print("✓ MongoDB connection closed cleanly")
     except Exception as e:
         print(f"Warning: could not close MongoDB connection: {e}")
 
+    if not snapshots_ok:
+        raise RuntimeError("MongoDB is not available and no snapshot exists. Please start MongoDB.")
+
+    for stage in STAGES:
+        if stage.incremental:
+            stage.kwargs["incremental"] = incremental
+
+    results = run_pipeline(STAGES, jobs=jobs, force=force)
+    report = write_report(results, started, STAGES)
+
     # Summary
     print("\n" + "═" * 80)
     print(" TRAINING PIPELINE SUMMARY ".center(80))
     print("═" * 80 + "\n")
 
-    print(f"Content-based model:      {'✅ Success' if content_ok else '❌ Failed'}")
-    print(f"Collaborative SVD model:  {'✅ Success' if collab_ok else '❌ Failed'}")
-    print(f"Hybrid blending:          {'✅ Success' if hybrid_ok else '❌ Failed'}")
+    labels = {"ran": "✅ Success", "skipped": "⏭  Up to date", "failed": "❌ Failed", "blocked": "⚠️ Blocked"}
+    for stage in STAGES:
+        result = results[stage.name]
+        line = f"{stage.title + ':':<45} {labels[result['status']]}"
+        if result["status"] in ("ran", "failed") and result.get("wall_time") is not None:
+            line += f"  ({result['wall_time']:.1f}s"
+            if result.get("peak_rss_mb") is not None:
+                line += f", peak RSS {result['peak_rss_mb']:,.0f} MB"
+            line += ")"
+        print(line)
 
-    if content_ok and collab_ok and hybrid_ok:
+    if all(result["status"] in ("ran", "skipped") for result in results.values()):
         print("\n🎉 ALL STEPS COMPLETED SUCCESSFULLY")
         print("   You can now use the trained models in the backend/frontend.")
     else:
         print("\n⚠️ Pipeline completed with errors. Fix failed steps above.")
 
+    print(f"\nRun report: {REPORT_PATH} ({report['wall_time']:.1f}s total)")
     print("\n" + "═" * 80)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Train all recommendation models.")
+    parser.add_argument("--refresh", action="store_true",
+                        help="re-check MongoDB and re-export changed collections to the snapshot cache")
+    parser.add_argument("--force", action="store_true", help="run every stage even if its inputs are unchanged")
+    parser.add_argument("--incremental", action="store_true", default=INCREMENTAL_TRAINING,
+                        help="content / TF-IDF: rescore only movies added or changed since the last run")
+    parser.add_argument("--jobs", type=int, default=PIPELINE_JOBS, help="stages run concurrently")
+    args = parser.parse_args()
+    main(refresh=args.refresh, force=args.force, jobs=args.jobs, incremental=args.incremental)
@@ -91,6 +91,18 @@ def verify_mongodb_data():
                         print(f"    {key:<18}: {value}")
                     print("    " + "─" * 70)
 
+                # Active users, grouped on the server
+                from loader import active_user_counts, index_for, resolve_load_workers
+                from collaborative_svd import MIN_USER_RATINGS
+
+                users, counts = active_user_counts(ratings_col, MIN_USER_RATINGS)
+                print(f"\n    Users with {MIN_USER_RATINGS}+ ratings: {len(users):,}"
+                      + (f" (most active: {counts[0]:,} ratings)" if len(users) else ""))
+                if index_for(ratings_col, "userId") is None:
+                    print("    ⚠️  No index on userId — create one for partitioned reads:")
+                    print("       db.ratings.createIndex({ userId: 1 })")
+                print(f"    Parallel readers: {resolve_load_workers(ratings_col)}")
+
         except Exception as e:
             print(f"❌  Error reading ratings collection: {e}")
             success = False
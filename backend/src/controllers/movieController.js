@@ -2,8 +2,15 @@ import {
     getMoviesFromStore,
     getMovieByIdFromStore,
     getMoviesByIdsFromStore,
+    findMoviesInStore,
+    searchMoviesInStore,
 } from '../services/database.service.js';
 
+const optionalNumber = (value) => {
+    const number = parseFloat(value);
+    return isNaN(number) ? null : number;
+};
+
 export const getMovies = (req, res) => {
     try {
         const limit = Math.min(parseInt(req.query.limit, 10) || 24, 100);
@@ -24,37 +31,24 @@ export const getMovies = (req, res) => {
             return res.status(500).json({ error: 'Movies data is not an array' });
         }
 
+        const filters = {
+            q,
+            genre,
+            year: optionalNumber(req.query.year),
+            minYear: optionalNumber(req.query.minYear),
+            maxYear: optionalNumber(req.query.maxYear),
+            minRating: optionalNumber(req.query.minRating),
+            sort: req.query.sort === 'popularity' ? 'popularity' : null,
+        };
+
         console.log(`getMovies: Loaded ${movies.length} movies, q="${q}", genre="${genre}"`);
 
-        // Apply filters
-        if (q || genre) {
-            movies = movies.filter((m) => {
-                if (!m) return false; // Skip null/undefined movies
-
-                let matchesQuery = true;
-                let matchesGenre = true;
-
-                if (q) {
-                    const title = String(m.title || '');
-                    const overview = String(m.overview || '');
-                    const titleMatch = title.toLowerCase().includes(q);
-                    const overviewMatch = overview.toLowerCase().includes(q);
-                    matchesQuery = titleMatch || overviewMatch;
-                }
-
-                if (genre) {
-                    matchesGenre = m.genres && (
-                        Array.isArray(m.genres)
-                            ? m.genres.some(g => String(g).toLowerCase().includes(genre))
-                            : String(m.genres).toLowerCase().includes(genre)
-                    );
-                }
-
-                return matchesQuery && matchesGenre;
-            });
-
-            console.log(`getMovies: After filtering, found ${movies.length} matches`);
+        // Genre / year / rating filters intersect the serving index's posting lists
+        const filtered = findMoviesInStore(filters);
+        if (filtered !== movies) {
+            console.log(`getMovies: After filtering, found ${filtered.length} matches`);
         }
+        movies = filtered;
 
         const total = movies.length;
         const paginated = movies.slice(offset, offset + limit);
@@ -114,17 +108,7 @@ export const searchMovies = (req, res) => {
             return res.status(500).json({ error: 'Movies data is not an array' });
         }
 
-        const filtered = allMovies.filter((m) => {
-            const titleMatch = m.title?.toLowerCase().includes(q);
-            const overviewMatch = m.overview?.toLowerCase().includes(q);
-            const genresMatch =
-                m.genres &&
-                (Array.isArray(m.genres)
-                    ? m.genres.some((g) => String(g).toLowerCase().includes(q))
-                    : String(m.genres).toLowerCase().includes(q));
-
-            return titleMatch || overviewMatch || genresMatch;
-        });
+        const filtered = searchMoviesInStore(q);
 
         res.json({
             movies: filtered.slice(0, limit),
@@ -1,5 +1,6 @@
 import {
-    loadRecommendations,
+    getRecommendationIds,
+    getUserRecommendationLists,
     getMoviesByIdsFromStore,
 } from '../services/database.service.js';
 
@@ -13,11 +14,8 @@ export const getContentBasedRecommendations = (req, res) => {
         const limit = Math.min(parseInt(req.query.limit, 10) || 10, 50);
         const algorithm = (req.query.algorithm || 'content').toLowerCase();
 
-        const contentBased = loadRecommendations('content_based.json');
-
-        // Support both string and number keys
-        const key = movieId.toString();
-        let recIds = contentBased[key] || contentBased[movieId] || [];
+        // Binary neighbour table when available, content_based.json otherwise
+        let recIds = getRecommendationIds('content_based', movieId);
 
         if (!Array.isArray(recIds)) {
             return res.json({ movies: [], message: 'No recommendations found' });
@@ -60,18 +58,7 @@ export const getUserRecommendations = (req, res) => {
         const limit = Math.min(parseInt(req.query.limit, 10) || 20, 100);
         const type = (req.query.type || 'hybrid').toLowerCase();
 
-        const userRecs = loadRecommendations('user_recommendations.json');
-
-        if (!userRecs || typeof userRecs !== 'object') {
-            return res.json({
-                userId,
-                type,
-                movies: [],
-                message: 'No recommendations data available',
-            });
-        }
-
-        const userData = userRecs[userId];
+        const userData = getUserRecommendationLists(userId);
         if (!userData) {
             return res.json({
                 userId,
@@ -2,13 +2,30 @@ import { Router } from 'express';
 import { existsSync, statSync } from 'fs';
 import path from 'path';
 import { fileURLToPath } from 'url';
-import { loadRecommendations, loadMoviesFromJson } from '../services/database.service.js';
+import {
+    loadRecommendations,
+    loadMoviesFromJson,
+    loadMovieIndex,
+    loadNeighbourTable,
+} from '../services/database.service.js';
 
 const __dirname = path.dirname(fileURLToPath(import.meta.url));
 const DATA_DIR = path.join(__dirname, '../../data');
 
 const router = Router();
 
+// The pipeline writes binary neighbour tables by default (ML OUTPUT_FORMAT);
+// the JSON files only exist in its "json" / "both" compatibility modes
+const USER_REC_TYPES = ['hybrid', 'collaborative', 'content'];
+
+function fileStats(filenames) {
+    const stats = filenames.map((name) => statSync(path.join(DATA_DIR, name)));
+    return {
+        lastModified: new Date(Math.max(...stats.map((s) => s.mtimeMs))).toISOString(),
+        sizeBytes: stats.reduce((total, s) => total + s.size, 0),
+    };
+}
+
 /**
  * GET /status
  * Returns information about ML data freshness and availability
@@ -21,15 +38,24 @@ router.get('/status', (req, res) => {
             summary: {},
         };
 
-        // Check content_based.json
+        // Check content_based.bin, else content_based.json
+        const contentBasedTable = loadNeighbourTable('content_based.bin');
         const contentBasedPath = path.join(DATA_DIR, 'content_based.json');
-        if (existsSync(contentBasedPath)) {
+        if (contentBasedTable) {
+            status.files.content_based = {
+                exists: true,
+                format: 'binary',
+                ...fileStats(['content_based.bin']),
+                movieCount: contentBasedTable.size,
+            };
+        } else if (existsSync(contentBasedPath)) {
             const stats = statSync(contentBasedPath);
             const data = loadRecommendations('content_based.json');
             const movieCount = Object.keys(data || {}).length;
 
             status.files.content_based = {
                 exists: true,
+                format: 'json',
                 lastModified: stats.mtime.toISOString(),
                 sizeBytes: stats.size,
                 movieCount,
@@ -41,9 +67,21 @@ router.get('/status', (req, res) => {
             };
         }
 
-        // Check user_recommendations.json
+        // Check user_recommendations.<type>.bin, else user_recommendations.json
+        const userTables = USER_REC_TYPES
+            .map((type) => ({ type, file: `user_recommendations.${type}.bin` }))
+            .map((entry) => ({ ...entry, table: loadNeighbourTable(entry.file) }))
+            .filter((entry) => entry.table);
         const userRecsPath = path.join(DATA_DIR, 'user_recommendations.json');
-        if (existsSync(userRecsPath)) {
+        if (userTables.length) {
+            status.files.user_recommendations = {
+                exists: true,
+                format: 'binary',
+                ...fileStats(userTables.map((entry) => entry.file)),
+                userCount: Math.max(...userTables.map((entry) => entry.table.size)),
+                availableTypes: userTables.map((entry) => entry.type),
+            };
+        } else if (existsSync(userRecsPath)) {
             const stats = statSync(userRecsPath);
             const data = loadRecommendations('user_recommendations.json');
             const userCount = Object.keys(data || {}).length;
@@ -58,6 +96,7 @@ router.get('/status', (req, res) => {
 
             status.files.user_recommendations = {
                 exists: true,
+                format: 'json',
                 lastModified: stats.mtime.toISOString(),
                 sizeBytes: stats.size,
                 userCount,
@@ -89,6 +128,12 @@ router.get('/status', (req, res) => {
             };
         }
 
+        // Check movies.index.bin (optional; filtering falls back to a scan without it)
+        const movieIndex = loadMovieIndex();
+        status.files.movie_index = movieIndex
+            ? { exists: true, movieCount: movieIndex.size }
+            : { exists: false, error: 'File not found or does not match movies.json' };
+
         // Generate summary
         const now = new Date();
         const contentBasedAge = status.files.content_based.exists
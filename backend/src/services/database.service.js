@@ -10,6 +10,11 @@ const DATA_DIR = path.join(__dirname, '../../data');
 // ──────────────────────────────────────────────────────────────
 let moviesCache = null;
 let recommendationsCache = new Map(); // filename → data
+let neighbourTableCache = new Map(); // filename → table | null
+let userShardIndex; // user_recommendations.shards.json (null when not sharded)
+let movieIndex; // movies.index.bin (null when missing or stale)
+let movieIdMap = null; // id → movie, when there is no index
+let movieSearchText = null; // lower-cased title / overview and genres per movie row
 
 // ──────────────────────────────────────────────────────────────
 // Utility functions
@@ -78,6 +83,24 @@ export function loadMoviesFromJson() {
     return moviesCache;
 }
 
+/**
+ * Row of a movie id in movies.json (-1 if absent)
+ * @param {number} id
+ * @returns {number}
+ */
+function movieRow(id) {
+    const index = loadMovieIndex();
+    if (index) return index.rowOf(id);
+
+    if (!movieIdMap) {
+        movieIdMap = new Map();
+        loadMoviesFromJson().forEach((movie, row) => {
+            if (!movieIdMap.has(movie.id)) movieIdMap.set(movie.id, row);
+        });
+    }
+    return movieIdMap.get(id) ?? -1;
+}
+
 /**
  * Get a single movie by ID
  * @param {string|number} id
@@ -90,11 +113,12 @@ export function getMovieByIdFromStore(id) {
     const numId = Number(id);
     if (isNaN(numId)) return null;
 
-    return movies.find(m => m.id === numId) || null;
+    const row = movieRow(numId);
+    return row >= 0 ? movies[row] : null;
 }
 
 /**
- * Get multiple movies by array of IDs
+ * Get multiple movies by array of IDs (in movies.json order)
  * @param {Array<string|number>} ids
  * @returns {Array<object>}
  */
@@ -104,9 +128,13 @@ export function getMoviesByIdsFromStore(ids) {
     const movies = loadMoviesFromJson();
     if (!movies.length) return [];
 
-    const idSet = new Set(ids.map(Number).filter(n => !isNaN(n)));
-
-    return movies.filter(m => idSet.has(m.id));
+    const rows = new Set();
+    for (const id of ids.map(Number)) {
+        if (isNaN(id)) continue;
+        const row = movieRow(id);
+        if (row >= 0) rows.add(row);
+    }
+    return [...rows].sort((a, b) => a - b).map(row => movies[row]);
 }
 
 /**
@@ -141,6 +169,415 @@ export function loadRecommendations(filename = 'user_recommendations.json') {
     return normalized;
 }
 
+// ──────────────────────────────────────────────────────────────
+// Binary neighbour tables (written by ML/neighbor_table.py)
+// Sorted int32 keys + N×K int32 neighbour ids (+ optional float16 scores),
+// looked up with a binary search instead of parsing a large JSON file.
+// ──────────────────────────────────────────────────────────────
+const NEIGHBOUR_TABLE_MAGIC = 'MRNT';
+
+function typedView(buffer, offset, length, Type) {
+    // Copy into a fresh ArrayBuffer so the typed array is correctly aligned
+    const bytes = buffer.subarray(offset, offset + length * Type.BYTES_PER_ELEMENT);
+    return new Type(bytes.buffer.slice(bytes.byteOffset, bytes.byteOffset + bytes.length));
+}
+
+function halfToFloat(h) {
+    const sign = h & 0x8000 ? -1 : 1;
+    const exponent = (h >> 10) & 0x1f;
+    const fraction = h & 0x03ff;
+    if (exponent === 0) return sign * Math.pow(2, -14) * (fraction / 1024);
+    if (exponent === 0x1f) return fraction ? NaN : sign * Infinity;
+    return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+}
+
+/**
+ * Load a binary neighbour table (e.g. content_based.bin)
+ * @param {string} filename
+ * @returns {object|null} { size, k, get(id) } or null if missing/invalid
+ */
+export function loadNeighbourTable(filename) {
+    if (neighbourTableCache.has(filename)) {
+        return neighbourTableCache.get(filename);
+    }
+
+    const filePath = path.join(DATA_DIR, filename);
+    let table = null;
+
+    if (existsSync(filePath)) {
+        try {
+            const buffer = readFileSync(filePath);
+            if (buffer.toString('latin1', 0, 4) !== NEIGHBOUR_TABLE_MAGIC) {
+                throw new Error('bad magic');
+            }
+            const headerLength = buffer.readUInt32LE(8);
+            const header = JSON.parse(buffer.toString('utf8', 12, 12 + headerLength));
+            const { n, k } = header;
+
+            const keys = typedView(buffer, header.keys_offset, n, Int32Array);
+            const neighbours = typedView(buffer, header.neighbors_offset, n * k, Int32Array);
+            const scores = header.has_scores
+                ? typedView(buffer, header.scores_offset, n * k, Uint16Array)
+                : null;
+
+            const findRow = (id) => {
+                let lo = 0;
+                let hi = n - 1;
+                while (lo <= hi) {
+                    const mid = (lo + hi) >> 1;
+                    if (keys[mid] === id) return mid;
+                    if (keys[mid] < id) lo = mid + 1;
+                    else hi = mid - 1;
+                }
+                return -1;
+            };
+
+            table = {
+                size: n,
+                k,
+                has(id) {
+                    return findRow(Number(id)) >= 0;
+                },
+                get(id, { withScores = false } = {}) {
+                    const row = findRow(Number(id));
+                    if (row < 0) return withScores ? { ids: [], scores: [] } : [];
+                    const ids = [];
+                    const rowScores = [];
+                    for (let j = row * k; j < (row + 1) * k; j++) {
+                        if (neighbours[j] < 0) continue;
+                        ids.push(neighbours[j]);
+                        if (scores) rowScores.push(halfToFloat(scores[j]));
+                    }
+                    return withScores ? { ids, scores: rowScores } : ids;
+                },
+            };
+            console.log(`Loaded neighbour table ${filename} (${n} keys × ${k})`);
+        } catch (err) {
+            console.error(`Failed to read neighbour table: ${filePath}`);
+            console.error(err.message);
+            table = null;
+        }
+    }
+
+    neighbourTableCache.set(filename, table);
+    return table;
+}
+
+/**
+ * Recommendation ids for one movie, preferring the binary table over JSON
+ * @param {string} baseName - e.g. 'content_based' (reads content_based.bin or content_based.json)
+ * @param {string|number} id
+ * @returns {Array<number>}
+ */
+export function getRecommendationIds(baseName, id) {
+    const table = loadNeighbourTable(`${baseName}.bin`);
+    if (table) return table.get(id);
+
+    const data = loadRecommendations(`${baseName}.json`);
+    const recIds = data[String(id)] || [];
+    return Array.isArray(recIds) ? recIds : [];
+}
+
+// ──────────────────────────────────────────────────────────────
+// Movie serving index (written by ML/movie_index.py with movies.json)
+// Posting lists of movies.json rows per genre token, release year and
+// rating bucket, an id → row table and the popularity order. A filter is
+// an intersection of small sorted row lists instead of a catalogue scan.
+// ──────────────────────────────────────────────────────────────
+const MOVIE_INDEX_MAGIC = 'MRMI';
+const MOVIE_INDEX_ALIGN = 64;
+
+function genreTokens(genres) {
+    if (!genres) return [];
+    const text = Array.isArray(genres) ? genres.join(' ') : String(genres);
+    return text.toLowerCase().split(/\s+/).filter(Boolean);
+}
+
+function sortedUnique(rows) {
+    rows.sort();
+    let n = 0;
+    for (let i = 0; i < rows.length; i++) {
+        if (i === 0 || rows[i] !== rows[i - 1]) rows[n++] = rows[i];
+    }
+    return rows.subarray(0, n);
+}
+
+/**
+ * Union of ascending row lists
+ * @param {Array<Int32Array>} lists
+ * @returns {Int32Array}
+ */
+function unionRows(lists) {
+    if (lists.length === 1) return lists[0];
+    const rows = new Int32Array(lists.reduce((total, list) => total + list.length, 0));
+    let offset = 0;
+    for (const list of lists) {
+        rows.set(list, offset);
+        offset += list.length;
+    }
+    return sortedUnique(rows);
+}
+
+/**
+ * Intersection of ascending row lists, walking the smallest one
+ * @param {Array<Int32Array>} lists
+ * @returns {Int32Array}
+ */
+function intersectRows(lists) {
+    const [smallest, ...others] = [...lists].sort((a, b) => a.length - b.length);
+    const positions = others.map(() => 0);
+    const rows = [];
+    for (const row of smallest) {
+        let inAll = true;
+        for (let i = 0; i < others.length && inAll; i++) {
+            const list = others[i];
+            let pos = positions[i];
+            while (pos < list.length && list[pos] < row) pos++;
+            positions[i] = pos;
+            inAll = pos < list.length && list[pos] === row;
+        }
+        if (inAll) rows.push(row);
+    }
+    return Int32Array.from(rows);
+}
+
+/**
+ * Load movies.index.bin; null when missing, invalid or not built from the loaded movies.json
+ * @returns {object|null} { rowOf(id), postings(facet, term), terms(facet), popularity, rank }
+ */
+export function loadMovieIndex() {
+    if (movieIndex !== undefined) return movieIndex;
+
+    const filePath = path.join(DATA_DIR, 'movies.index.bin');
+    movieIndex = null;
+    if (!existsSync(filePath)) return movieIndex;
+
+    try {
+        const buffer = readFileSync(filePath);
+        if (buffer.toString('latin1', 0, 4) !== MOVIE_INDEX_MAGIC) {
+            throw new Error('bad magic');
+        }
+        const headerLength = buffer.readUInt32LE(8);
+        const header = JSON.parse(buffer.toString('utf8', 12, 12 + headerLength));
+        const dataOffset = Math.ceil((12 + headerLength) / MOVIE_INDEX_ALIGN) * MOVIE_INDEX_ALIGN;
+        const arrays = {};
+        for (const [name, [offset, length]] of Object.entries(header.arrays)) {
+            arrays[name] = typedView(buffer, dataOffset + offset, length, Int32Array);
+        }
+
+        // movies.json and the index are written together; refuse an index from another run
+        const movies = loadMoviesFromJson();
+        if (header.n !== movies.length || movies.some((movie, row) => movie.id !== arrays.ids[row])) {
+            console.warn('movies.index.bin does not match movies.json — filtering by scan');
+            return movieIndex;
+        }
+
+        const { id_keys: idKeys, id_rows: idRows, popularity, postings } = arrays;
+        const rank = new Int32Array(header.n);
+        popularity.forEach((row, position) => { rank[row] = position; });
+
+        movieIndex = {
+            size: header.n,
+            popularity,
+            rank,
+            rowOf(id) {
+                // Lower bound, so a duplicated id resolves to its first row like Array.find
+                let lo = 0;
+                let hi = idKeys.length;
+                while (lo < hi) {
+                    const mid = (lo + hi) >> 1;
+                    if (idKeys[mid] < id) lo = mid + 1;
+                    else hi = mid;
+                }
+                return lo < idKeys.length && idKeys[lo] === id ? idRows[lo] : -1;
+            },
+            terms(facet) {
+                return Object.keys(header.facets[facet] || {});
+            },
+            postings(facet, term) {
+                const [offset, length] = header.facets[facet]?.[String(term)] || [0, 0];
+                return postings.subarray(offset, offset + length);
+            },
+        };
+        console.log(`Loaded movie index (${header.n} movies, ${Object.keys(header.facets.genre || {}).length} genres)`);
+    } catch (err) {
+        console.error(`Failed to read movie index: ${filePath}`);
+        console.error(err.message);
+        movieIndex = null;
+    }
+    return movieIndex;
+}
+
+function searchText(movies) {
+    if (!movieSearchText) {
+        const lower = value => (Array.isArray(value) ? value.join(' ') : String(value || '')).toLowerCase();
+        movieSearchText = {
+            text: movies.map(m => `${lower(m?.title)}\u0000${lower(m?.overview)}`),
+            genres: movies.map(m => lower(m?.genres)),
+        };
+    }
+    return movieSearchText;
+}
+
+function movieYear(movie) {
+    const year = Number(movie.release_year ?? movie.year);
+    if (year > 0) return Math.trunc(year);
+    const match = /^(\d{4})/.exec(String(movie.release_date ?? movie.releaseDate ?? ''));
+    return match ? Number(match[1]) : null;
+}
+
+/**
+ * Rows matching the genre / year / rating filters, from the index posting lists
+ * @returns {Int32Array|null} ascending rows, or null without an index
+ */
+function indexedRows(index, { genre, year, minYear, maxYear, minRating }) {
+    const lists = [];
+    for (const token of genreTokens(genre)) {
+        lists.push(unionRows(index.terms('genre').filter(t => t.includes(token)).map(t => index.postings('genre', t))));
+    }
+    if (year != null) {
+        lists.push(index.postings('year', year));
+    } else if (minYear != null || maxYear != null) {
+        const years = index.terms('year').map(Number)
+            .filter(y => (minYear == null || y >= minYear) && (maxYear == null || y <= maxYear));
+        lists.push(unionRows(years.map(y => index.postings('year', y))));
+    }
+    if (minRating != null) {
+        const buckets = index.terms('rating').filter(b => Number(b) >= Math.floor(minRating));
+        lists.push(unionRows(buckets.map(b => index.postings('rating', b))));
+    }
+    if (!lists.length) return null;
+    return intersectRows(lists);
+}
+
+/**
+ * Movies matching the browsing filters, in movies.json order (or by popularity)
+ * Uses the serving index when present and falls back to one scan otherwise.
+ * @param {object} filters - { q, genre, year, minYear, maxYear, minRating, sort: 'popularity' }
+ *                           (q and genre lower-cased substrings)
+ * @returns {Array<object>}
+ */
+export function findMoviesInStore({ q = '', genre = '', year = null, minYear = null, maxYear = null,
+    minRating = null, sort = null } = {}) {
+    const movies = loadMoviesFromJson();
+    const filters = { genre, year, minYear, maxYear, minRating };
+    if (!q && !sort && Object.values(filters).every(v => v == null || v === '')) return movies;
+
+    const index = loadMovieIndex();
+    const tokens = genreTokens(genre);
+    let rows;
+    if (index) {
+        rows = indexedRows(index, filters);
+        if (!rows) {
+            rows = sort === 'popularity' ? index.popularity : Int32Array.from(movies.keys());
+            sort = null; // already in order
+        }
+    } else {
+        rows = [];
+        movies.forEach((m, row) => {
+            if (!m) return;
+            const y = movieYear(m);
+            const movieTokens = genreTokens(m.genres);
+            if (!tokens.every(token => movieTokens.some(t => t.includes(token)))) return;
+            if (year != null && y !== year) return;
+            if (minYear != null && !(y >= minYear)) return;
+            if (maxYear != null && !(y <= maxYear)) return;
+            rows.push(row);
+        });
+    }
+
+    // Exact checks on the narrowed candidates: rating within its bucket, free-text query
+    let matched = Array.from(rows);
+    if (minRating != null) matched = matched.filter(row => Number(movies[row].vote_average) >= minRating);
+    if (q) {
+        const { text } = searchText(movies);
+        matched = matched.filter(row => text[row].includes(q));
+    }
+
+    if (sort === 'popularity') {
+        if (index) matched.sort((a, b) => index.rank[a] - index.rank[b]);
+        else {
+            // Same order as the index: popularity, then vote count, descending; then row
+            const key = (row, field) => Number(movies[row][field]) || 0;
+            matched.sort((a, b) => key(b, 'popularity') - key(a, 'popularity')
+                || key(b, 'vote_count') - key(a, 'vote_count') || a - b);
+        }
+    }
+    return matched.map(row => movies[row]);
+}
+
+/**
+ * Free-text search over title, overview and genres (lower-cased substring)
+ * Substrings cannot use the posting lists; the text is lower-cased once per
+ * process instead of on every request.
+ * @param {string} q
+ * @returns {Array<object>}
+ */
+export function searchMoviesInStore(q) {
+    const movies = loadMoviesFromJson();
+    const { text, genres } = searchText(movies);
+    return movies.filter((m, row) => m && (text[row].includes(q) || genres[row].includes(q)));
+}
+
+// ──────────────────────────────────────────────────────────────
+// Sharded user recommendations (ML/shards.py)
+// user_recommendations.shards.json lists one table per user shard; a user
+// is looked up only in the table of its shard, so only those tables load.
+// ──────────────────────────────────────────────────────────────
+const USER_SHARD_HASH = 0x9E3779B1;
+
+function loadUserShardIndex() {
+    if (userShardIndex === undefined) {
+        const filePath = path.join(DATA_DIR, 'user_recommendations.shards.json');
+        userShardIndex = existsSync(filePath) ? safeLoadJson(filePath) : null;
+    }
+    return userShardIndex;
+}
+
+/**
+ * Shard of a userId: (userId * 0x9E3779B1 mod 2^32) mod shards, as in ML/shards.py
+ * @param {string|number} userId
+ * @param {number} nShards
+ * @returns {number}
+ */
+export function userShard(userId, nShards) {
+    return (Math.imul(Number(userId), USER_SHARD_HASH) >>> 0) % nShards;
+}
+
+function getShardedUserList(type, userId) {
+    const index = loadUserShardIndex();
+    const files = index?.tables?.[type];
+    if (!Array.isArray(files) || !index.user_shards) return null;
+
+    const table = loadNeighbourTable(files[userShard(userId, index.user_shards)]);
+    return table && table.has(userId) ? table.get(userId) : null;
+}
+
+/**
+ * All recommendation lists for a user: { hybrid: [...], collaborative: [...], ... }
+ * Uses user_recommendations.<type>.bin when present, then the user's shard
+ * table (sharding mode), else user_recommendations.json
+ * @param {string|number} userId
+ * @returns {object|null}
+ */
+export function getUserRecommendationLists(userId) {
+    const lists = {};
+    for (const type of ['hybrid', 'collaborative', 'content']) {
+        const table = loadNeighbourTable(`user_recommendations.${type}.bin`);
+        if (table && table.has(userId)) {
+            lists[type] = table.get(userId);
+        }
+    }
+    if (!lists.collaborative) {
+        const sharded = getShardedUserList('collaborative', userId);
+        if (sharded) lists.collaborative = sharded;
+    }
+    if (Object.keys(lists).length) return lists;
+
+    const userRecs = loadRecommendations('user_recommendations.json');
+    return userRecs[String(userId)] || null;
+}
+
 /**
  * Get all movies (convenience alias)
  */